@@ -0,0 +1,93 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+
+class ActivationQueueFull(Exception):
+    """激活队列已满，调用方应快速拒绝请求。"""
+
+
+class ActivationTimeout(Exception):
+    """请求在激活队列中等待超过上限。"""
+
+
+class Activator:
+    """
+    冷启动期间的请求缓冲（类似 Knative Activator）。
+
+    每个函数一个 FIFO 队列，队列非空时由唯一的唤醒任务负责扩容与等待就绪，
+    就绪后按入队顺序依次放行并交给它们同一个唤醒结果；唤醒失败时把同一个异常交给所有排队请求。
+    队列清空后立即释放该函数的全部状态，不会随函数名增长。
+
+    这里的状态只在单个网关进程内有效，多实例部署时每个实例各自唤醒。
+    """
+
+    def __init__(self, max_depth: int, max_wait: float) -> None:
+        self.max_depth = max_depth
+        self.max_wait = max_wait
+        self._queues: Dict[str, Deque[asyncio.Future]] = {}
+        self._wakers: Dict[str, asyncio.Task] = {}
+
+    def depth(self, fn_name: str) -> int:
+        queue = self._queues.get(fn_name)
+        return len(queue) if queue else 0
+
+    def depths(self) -> Dict[str, int]:
+        return {fn_name: len(q) for fn_name, q in self._queues.items() if q}
+
+    async def wait(
+        self,
+        fn_name: str,
+        wake: Callable[[], Awaitable[Any]],
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """
+        入队等待函数就绪并返回 wake 的结果；wake 只会在该函数当前没有唤醒任务时被调用一次。
+        timeout 为本请求最多等待的秒数，缺省为 max_wait；超时只让本请求离开，不影响唤醒。
+        """
+        queue = self._queues.get(fn_name)
+        if queue is None:
+            queue = deque()
+            self._queues[fn_name] = queue
+        if len(queue) >= self.max_depth:
+            raise ActivationQueueFull(fn_name)
+
+        future = asyncio.get_running_loop().create_future()
+        queue.append(future)
+        if fn_name not in self._wakers:
+            self._wakers[fn_name] = asyncio.ensure_future(self._drive(fn_name, wake))
+
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(future),
+                timeout=self.max_wait if timeout is None else timeout,
+            )
+        except asyncio.TimeoutError:
+            raise ActivationTimeout(fn_name)
+        finally:
+            if not future.done():
+                future.cancel()
+                try:
+                    queue.remove(future)
+                except ValueError:
+                    pass
+
+    async def _drive(self, fn_name: str, wake: Callable[[], Awaitable[Any]]) -> None:
+        result = None
+        error = None
+        try:
+            result = await wake()
+        except Exception as e:
+            error = e
+        finally:
+            self._wakers.pop(fn_name, None)
+
+        queue = self._queues.pop(fn_name, None)
+        while queue:
+            future = queue.popleft()
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
@@ -0,0 +1,110 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+# 一个投递单元：(首个事件的下标, 事件列表)
+BatchUnit = Tuple[int, List[Any]]
+BatchOutcome = Dict[str, Any]
+
+
+def parse_events(body: bytes) -> List[Any]:
+    """
+    解析批量调用的请求体：JSON 数组，或 NDJSON（每行一个 JSON 事件，空行忽略）。
+    格式错误时抛出 ValueError。
+    """
+    text = body.decode("utf-8")
+    stripped = text.lstrip()
+    if stripped.startswith("["):
+        events = json.loads(stripped)
+        if not isinstance(events, list):
+            raise ValueError("请求体必须是 JSON 数组")
+        return events
+
+    events = []
+    for lineno, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            events.append(json.loads(line))
+        except ValueError as e:
+            raise ValueError(f"第 {lineno} 行不是合法 JSON: {e}")
+    return events
+
+
+def split_units(events: List[Any], batch_size: int) -> List[BatchUnit]:
+    if batch_size <= 0:
+        return [(index, [event]) for index, event in enumerate(events)]
+    return [(start, events[start:start + batch_size]) for start in range(0, len(events), batch_size)]
+
+
+def decode_result(status_code: int, content_type: str, body: bytes) -> BatchOutcome:
+    """
+    把 Runner 的单次响应转换为一行结果：JSON 响应解析为对象，其余按文本返回。
+    """
+    if content_type.startswith("application/json"):
+        try:
+            value: Any = json.loads(body)
+        except ValueError:
+            value = body.decode("utf-8", errors="replace")
+    else:
+        value = body.decode("utf-8", errors="replace")
+    if status_code >= 400:
+        error = value.get("error", value) if isinstance(value, dict) else value
+        return {"status": status_code, "error": error}
+    return {"status": status_code, "result": value}
+
+
+async def fan_out(
+    units: List[BatchUnit],
+    run_unit: Callable[[int, List[Any]], Awaitable[List[BatchOutcome]]],
+    concurrency: int,
+    ordered: bool,
+) -> AsyncIterator[List[BatchOutcome]]:
+    """
+    以最多 concurrency 个单元并发执行，逐个产出每个单元的结果。
+
+    ordered 时按输入顺序产出：单元的并发名额在结果产出后才归还，
+    因此排在慢单元后面、已完成待输出的结果最多 concurrency 个，内存有界。
+    单元执行失败时，该单元的每个事件都得到一条错误（HTTPException 沿用其状态码，其余为 502）。
+    """
+    slots = asyncio.Semaphore(concurrency)
+    finished: "asyncio.Queue[Tuple[int, List[BatchOutcome]]]" = asyncio.Queue()
+    tasks: List[asyncio.Task] = []
+
+    async def run(position: int, start: int, events: List[Any]) -> None:
+        try:
+            outcomes = await run_unit(start, events)
+        except Exception as e:
+            error = getattr(e, "detail", None) or str(e) or type(e).__name__
+            status = getattr(e, "status_code", 502)
+            outcomes = [
+                {"index": start + offset, "status": status, "error": error}
+                for offset in range(len(events))
+            ]
+        finished.put_nowait((position, outcomes))
+
+    async def produce() -> None:
+        for position, (start, events) in enumerate(units):
+            await slots.acquire()
+            tasks.append(asyncio.ensure_future(run(position, start, events)))
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        waiting: Dict[int, List[BatchOutcome]] = {}
+        next_position = 0
+        for _ in range(len(units)):
+            position, outcomes = await finished.get()
+            if not ordered:
+                slots.release()
+                yield outcomes
+                continue
+            waiting[position] = outcomes
+            while next_position in waiting:
+                slots.release()
+                yield waiting.pop(next_position)
+                next_position += 1
+    finally:
+        # 客户端断开时停止派发并取消仍在执行的单元
+        producer.cancel()
+        for task in tasks:
+            task.cancel()
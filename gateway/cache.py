@@ -0,0 +1,159 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+# (函数名, 代码版本, method, path, query)
+CacheKey = Tuple[str, str, str, str, str]
+
+# 响应端出现这些指令时不缓存
+_UNCACHEABLE_DIRECTIVES = frozenset({"no-store", "no-cache", "private"})
+
+
+class CachedResponse:
+    """
+    缓存中的一条完整响应；expires_at 为 time.monotonic() 时间。
+    upstream_etag 为 Runner 自己给出的 ETag，只有它存在时过期后才能向上游条件请求。
+    """
+
+    __slots__ = ("status_code", "headers", "body", "etag", "upstream_etag", "expires_at")
+
+    def __init__(
+        self,
+        status_code: int,
+        headers: List[Tuple[str, str]],
+        body: bytes,
+        etag: str,
+        upstream_etag: bool,
+        expires_at: float,
+    ) -> None:
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+        self.upstream_etag = upstream_etag
+        self.expires_at = expires_at
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(k) + len(v) for k, v in self.headers)
+
+    def is_fresh(self, now: Optional[float] = None) -> bool:
+        return (now if now is not None else time.monotonic()) < self.expires_at
+
+
+def body_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    directives: Dict[str, Optional[str]] = {}
+    if not value:
+        return directives
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, arg = part.partition("=")
+        directives[name.strip().lower()] = arg.strip().strip('"') if arg else None
+    return directives
+
+
+def response_ttl(cache_control: Optional[str], default_ttl: float) -> float:
+    """
+    根据响应的 Cache-Control 计算可缓存时长：s-maxage > max-age > 函数默认 TTL，
+    返回 0 表示不可缓存。
+    """
+    directives = parse_cache_control(cache_control)
+    if _UNCACHEABLE_DIRECTIVES.intersection(directives):
+        return 0.0
+    for name in ("s-maxage", "max-age"):
+        if name in directives:
+            try:
+                return max(0.0, float(directives[name] or 0))
+            except ValueError:
+                return 0.0
+    return default_ttl
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # 弱比较：忽略 W/ 前缀
+    wanted = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == wanted:
+            return True
+    return False
+
+
+class ResponseCache:
+    """
+    按总字节数限额的 LRU 响应缓存，额外维护 函数名 -> key 索引，
+    以便函数代码变更或删除时整体失效。
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._entries: "OrderedDict[CacheKey, CachedResponse]" = OrderedDict()
+        self._by_function: Dict[str, Set[CacheKey]] = {}
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def bytes_by_function(self) -> Dict[str, int]:
+        """
+        各函数缓存条目占用的字节数，抓取指标时才计算。
+        """
+        return {
+            fn_name: sum(self._entries[key].size for key in keys)
+            for fn_name, keys in self._by_function.items()
+        }
+
+    def get(self, key: CacheKey) -> Optional[CachedResponse]:
+        """
+        返回条目（可能已过期，供条件请求复用），并刷新其 LRU 位置。
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: CacheKey, entry: CachedResponse) -> bool:
+        size = entry.size
+        if size > self.max_entry_bytes or size > self.max_bytes:
+            return False
+        self._remove(key)
+        self._entries[key] = entry
+        self._by_function.setdefault(key[0], set()).add(key)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+        return True
+
+    def invalidate_function(self, fn_name: str) -> int:
+        keys = self._by_function.pop(fn_name, set())
+        for key in keys:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry.size
+        return len(keys)
+
+    def _remove(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        keys = self._by_function.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                self._by_function.pop(key[0], None)
@@ -0,0 +1,269 @@
+import abc
+import asyncio
+import datetime
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from kubernetes_asyncio import client
+from kubernetes_asyncio.client.rest import ApiException
+
+# 扩缩容租约对象名前缀：faas-scale-{函数名}
+LEASE_NAME_PREFIX = "faas-scale-"
+# 租约对象上记录的函数最近活跃时间（墙钟秒），各网关共享，空闲缩容据此判断
+LAST_ACTIVE_ANNOTATION = "faas.example.com/last-active"
+# 写入最近活跃时间遇到冲突（409）时的重试次数
+TOUCH_MAX_ATTEMPTS = 3
+
+
+class ScaleCoordinator(abc.ABC):
+    """
+    多个网关实例之间的扩缩容协调：同一函数同一时刻只有持有租约的实例下发扩缩容，
+    其他实例通过 Deployment watch 等待结果。
+
+    持有者需要在租约过期前续约，崩溃后租约过期即可被其他实例接管。
+    租约不可重入：持有期间同一实例再次 try_acquire 也返回 False，
+    本实例内的唤醒、空闲缩容与预热之间同样互斥。
+
+    另外记录每个函数在所有实例上的最近活跃时间（touch / last_active）：
+    空闲缩容只看本实例的调用记录时，没有收到流量的实例会把其他实例正在服务的函数缩到 0。
+    """
+
+    def __init__(self, identity: str, lease_seconds: float) -> None:
+        self.identity = identity
+        self.lease_seconds = lease_seconds
+
+    @abc.abstractmethod
+    async def try_acquire(self, fn_name: str) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def renew(self, fn_name: str) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def release(self, fn_name: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def touch(self, fn_name: str, at: float) -> None:
+        """
+        把函数的最近活跃时间推进到 at（墙钟秒），只增不减。
+        """
+
+    @abc.abstractmethod
+    async def last_active(self, fn_name: str) -> Optional[float]:
+        """
+        所有实例中该函数的最近活跃时间，从未记录时返回 None。
+        """
+
+    async def keep_alive(self, fn_name: str) -> None:
+        """
+        持有期间按租约时长的 1/3 周期续约，由调用方在释放前取消；续约失败时退出。
+        """
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await self.renew(fn_name):
+                print(f"Function {fn_name} 扩缩容租约续约失败，可能已被其他网关接管")
+                return
+
+
+class InMemoryCoordinator(ScaleCoordinator):
+    """
+    进程内实现：单实例网关的默认后端，租约与活跃时间都只在本进程内可见。
+    多个实例传入同一个 state 字典（各自使用不同的 identity）即共享租约与活跃时间，
+    行为与 LeaseCoordinator 下的多个网关一致。
+    """
+
+    def __init__(
+        self, identity: str, lease_seconds: float, state: Optional[Dict[str, Any]] = None
+    ) -> None:
+        super().__init__(identity, lease_seconds)
+        state = {} if state is None else state
+        # 函数名 -> (持有者, 过期时间 monotonic)
+        self._leases: Dict[str, Tuple[str, float]] = state.setdefault("leases", {})
+        # 函数名 -> 最近活跃时间（墙钟秒）
+        self._last_active: Dict[str, float] = state.setdefault("last_active", {})
+
+    async def try_acquire(self, fn_name: str) -> bool:
+        now = time.monotonic()
+        current = self._leases.get(fn_name)
+        if current is not None and current[1] > now:
+            return False
+        self._leases[fn_name] = (self.identity, now + self.lease_seconds)
+        return True
+
+    async def renew(self, fn_name: str) -> bool:
+        current = self._leases.get(fn_name)
+        # 已过期的租约可能已被其他实例接管过，不能再续
+        if current is None or current[0] != self.identity or current[1] <= time.monotonic():
+            return False
+        self._leases[fn_name] = (self.identity, time.monotonic() + self.lease_seconds)
+        return True
+
+    async def release(self, fn_name: str) -> None:
+        current = self._leases.get(fn_name)
+        if current is not None and current[0] == self.identity:
+            del self._leases[fn_name]
+
+    async def touch(self, fn_name: str, at: float) -> None:
+        if at > self._last_active.get(fn_name, 0.0):
+            self._last_active[fn_name] = at
+
+    async def last_active(self, fn_name: str) -> Optional[float]:
+        return self._last_active.get(fn_name)
+
+
+class LeaseCoordinator(ScaleCoordinator):
+    """
+    基于 coordination.k8s.io/v1 Lease 的实现，每个函数一个 Lease 对象。
+    抢占与续约都带 resourceVersion 做乐观并发，冲突（409）即视为被其他实例抢先。
+    释放时只清空 holderIdentity，保留对象供下次复用。
+    最近活跃时间写在同一 Lease 对象的注解上，与租约字段一样走 resourceVersion 冲突检测。
+    """
+
+    def __init__(
+        self,
+        api: client.CoordinationV1Api,
+        namespace: str,
+        identity: str,
+        lease_seconds: float,
+        semaphore: asyncio.Semaphore,
+    ) -> None:
+        super().__init__(identity, lease_seconds)
+        self.api = api
+        self.namespace = namespace
+        self.semaphore = semaphore
+
+    def _lease_name(self, fn_name: str) -> str:
+        return f"{LEASE_NAME_PREFIX}{fn_name}"
+
+    def _spec(self, acquire_time: Optional[datetime.datetime] = None) -> client.V1LeaseSpec:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return client.V1LeaseSpec(
+            holder_identity=self.identity,
+            lease_duration_seconds=int(self.lease_seconds),
+            acquire_time=acquire_time or now,
+            renew_time=now,
+        )
+
+    def _held(self, lease: client.V1Lease) -> bool:
+        """
+        租约是否仍被持有（包括本实例自己持有），不可重入。
+        """
+        spec = lease.spec
+        if spec is None or not spec.holder_identity:
+            return False
+        renewed = spec.renew_time or spec.acquire_time
+        if renewed is None:
+            return False
+        duration = spec.lease_duration_seconds or self.lease_seconds
+        expires = renewed + datetime.timedelta(seconds=duration)
+        return expires > datetime.datetime.now(datetime.timezone.utc)
+
+    async def try_acquire(self, fn_name: str) -> bool:
+        name = self._lease_name(fn_name)
+        async with self.semaphore:
+            try:
+                lease = await self.api.read_namespaced_lease(name, self.namespace)
+            except ApiException as e:
+                if e.status != 404:
+                    raise
+                body = client.V1Lease(
+                    metadata=client.V1ObjectMeta(name=name, namespace=self.namespace),
+                    spec=self._spec(),
+                )
+                try:
+                    await self.api.create_namespaced_lease(self.namespace, body)
+                except ApiException as e:
+                    if e.status == 409:
+                        return False
+                    raise
+                return True
+
+            if self._held(lease):
+                return False
+            lease.spec = self._spec()
+            try:
+                await self.api.replace_namespaced_lease(name, self.namespace, lease)
+            except ApiException as e:
+                if e.status == 409:
+                    return False
+                raise
+            return True
+
+    async def renew(self, fn_name: str) -> bool:
+        name = self._lease_name(fn_name)
+        async with self.semaphore:
+            try:
+                lease = await self.api.read_namespaced_lease(name, self.namespace)
+                if lease.spec is None or lease.spec.holder_identity != self.identity:
+                    return False
+                lease.spec = self._spec(acquire_time=lease.spec.acquire_time)
+                await self.api.replace_namespaced_lease(name, self.namespace, lease)
+            except ApiException:
+                return False
+            return True
+
+    async def release(self, fn_name: str) -> None:
+        name = self._lease_name(fn_name)
+        async with self.semaphore:
+            try:
+                lease = await self.api.read_namespaced_lease(name, self.namespace)
+                if lease.spec is None or lease.spec.holder_identity != self.identity:
+                    return
+                lease.spec.holder_identity = None
+                await self.api.replace_namespaced_lease(name, self.namespace, lease)
+            except ApiException as e:
+                # 释放失败不影响正确性，租约到期后自然失效
+                print(f"释放 Function {fn_name} 扩缩容租约失败: {e.status} {e.reason}")
+
+    async def touch(self, fn_name: str, at: float) -> None:
+        name = self._lease_name(fn_name)
+        for _ in range(TOUCH_MAX_ATTEMPTS):
+            async with self.semaphore:
+                try:
+                    try:
+                        lease = await self.api.read_namespaced_lease(name, self.namespace)
+                    except ApiException as e:
+                        if e.status != 404:
+                            raise
+                        body = client.V1Lease(
+                            metadata=client.V1ObjectMeta(
+                                name=name,
+                                namespace=self.namespace,
+                                annotations={LAST_ACTIVE_ANNOTATION: f"{at:.3f}"},
+                            ),
+                            spec=client.V1LeaseSpec(),
+                        )
+                        await self.api.create_namespaced_lease(self.namespace, body)
+                        return
+                    if _parse_last_active(lease) >= at:
+                        return
+                    annotations = dict(lease.metadata.annotations or {})
+                    annotations[LAST_ACTIVE_ANNOTATION] = f"{at:.3f}"
+                    lease.metadata.annotations = annotations
+                    await self.api.replace_namespaced_lease(name, self.namespace, lease)
+                    return
+                except ApiException as e:
+                    if e.status != 409:
+                        raise
+            # 与其他实例的抢占、续约或 touch 冲突，重新读取后再试
+
+    async def last_active(self, fn_name: str) -> Optional[float]:
+        async with self.semaphore:
+            try:
+                lease = await self.api.read_namespaced_lease(self._lease_name(fn_name), self.namespace)
+            except ApiException as e:
+                if e.status == 404:
+                    return None
+                raise
+        value = _parse_last_active(lease)
+        return value if value > 0 else None
+
+
+def _parse_last_active(lease: client.V1Lease) -> float:
+    annotations = (lease.metadata.annotations if lease.metadata else None) or {}
+    try:
+        return float(annotations.get(LAST_ACTIVE_ANNOTATION, 0))
+    except ValueError:
+        return 0.0
@@ -0,0 +1,106 @@
+import random
+from typing import Dict, Iterable, List, Optional, Set
+
+# 负载均衡策略：p2c（随机两选一）/ least（全量最少在途）
+LB_POLICY_P2C = "p2c"
+LB_POLICY_LEAST = "least"
+
+
+class EndpointBalancer:
+    """
+    按 Service 维护就绪 Pod 地址（来自 EndpointSlice），并跟踪每个地址的在途请求数，
+    由网关直接挑选目标 Pod，绕开 kube-proxy 的随机转发。
+
+    所有方法都只在事件循环线程中调用，无需加锁。
+    """
+
+    def __init__(self, policy: str = LB_POLICY_P2C) -> None:
+        self.policy = policy
+        # service -> slice 名 -> 就绪地址列表（"ip:port"）
+        self._slices: Dict[str, Dict[str, List[str]]] = {}
+        # service -> 合并后的就绪地址，挑选时直接使用
+        self._endpoints: Dict[str, List[str]] = {}
+        # 地址 -> 在途请求数
+        self._inflight: Dict[str, int] = {}
+
+    def replace(self, slices: Dict[str, Dict[str, List[str]]]) -> None:
+        """
+        重新 list 后整体替换。
+        """
+        self._slices = {svc: dict(by_slice) for svc, by_slice in slices.items()}
+        self._endpoints = {svc: self._merge(by_slice) for svc, by_slice in self._slices.items()}
+        self._endpoints = {svc: eps for svc, eps in self._endpoints.items() if eps}
+
+    def update_slice(self, service: str, slice_name: str, addresses: Iterable[str]) -> None:
+        by_slice = self._slices.setdefault(service, {})
+        by_slice[slice_name] = list(addresses)
+        self._refresh(service)
+
+    def delete_slice(self, service: str, slice_name: str) -> None:
+        by_slice = self._slices.get(service)
+        if by_slice is None:
+            return
+        by_slice.pop(slice_name, None)
+        if not by_slice:
+            self._slices.pop(service, None)
+        self._refresh(service)
+
+    def endpoints(self, service: str) -> List[str]:
+        return self._endpoints.get(service, [])
+
+    def addresses(self) -> Set[str]:
+        """
+        所有 Service 的就绪地址。
+        """
+        return {a for eps in self._endpoints.values() for a in eps}
+
+    def ready_count(self, service: str) -> int:
+        return len(self._endpoints.get(service, ()))
+
+    def pick(self, service: str, exclude: Iterable[str] = ()) -> Optional[str]:
+        """
+        挑选在途请求最少的地址；没有就绪地址时返回 None，由调用方回退到 Service DNS。
+        """
+        candidates = self._endpoints.get(service)
+        if not candidates:
+            return None
+        if exclude:
+            excluded = set(exclude)
+            candidates = [a for a in candidates if a not in excluded]
+            if not candidates:
+                return None
+        if len(candidates) == 1:
+            return candidates[0]
+
+        inflight = self._inflight
+        if self.policy == LB_POLICY_LEAST:
+            best = min(inflight.get(a, 0) for a in candidates)
+            return random.choice([a for a in candidates if inflight.get(a, 0) == best])
+
+        a, b = random.sample(candidates, 2)
+        return a if inflight.get(a, 0) <= inflight.get(b, 0) else b
+
+    def acquire(self, address: str) -> None:
+        self._inflight[address] = self._inflight.get(address, 0) + 1
+
+    def release(self, address: str) -> None:
+        count = self._inflight.get(address, 0) - 1
+        if count > 0:
+            self._inflight[address] = count
+        else:
+            self._inflight.pop(address, None)
+
+    def _refresh(self, service: str) -> None:
+        merged = self._merge(self._slices.get(service, {}))
+        if merged:
+            self._endpoints[service] = merged
+        else:
+            self._endpoints.pop(service, None)
+
+    @staticmethod
+    def _merge(by_slice: Dict[str, List[str]]) -> List[str]:
+        seen: Dict[str, None] = {}
+        for addresses in by_slice.values():
+            for address in addresses:
+                seen[address] = None
+        return list(seen)
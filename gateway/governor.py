@@ -0,0 +1,114 @@
+import asyncio
+import itertools
+import time
+from typing import Callable, Dict, List, Optional
+
+
+class _Waiter:
+    __slots__ = ("fn_name", "enqueued_at", "seq", "future")
+
+    def __init__(self, fn_name: str, seq: int, future: asyncio.Future) -> None:
+        self.fn_name = fn_name
+        self.enqueued_at = time.monotonic()
+        self.seq = seq
+        self.future = future
+
+
+class ColdStartGovernor:
+    """
+    网关全局的冷启动并发上限：同时只允许 max_concurrent 个函数处于“扩容 + 等待就绪”阶段，
+    其余函数排队，避免大量函数同时唤醒时压垮 API Server 与调度器。
+
+    有空位时按优先级放行：priority(函数名) 返回该函数当前排队的请求数，
+    再加上 aging_per_second * 已等待秒数，排队少的函数等得足够久也会被放行，不会饿死；
+    优先级相同按入队顺序。优先级在放行时才计算，等待期间新到的请求同样计入。
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        priority: Callable[[str], int],
+        aging_per_second: float = 1.0,
+    ) -> None:
+        self.max_concurrent = max_concurrent
+        self.priority = priority
+        self.aging_per_second = aging_per_second
+        self._active: Dict[str, int] = {}
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+
+    @property
+    def active(self) -> int:
+        return sum(self._active.values())
+
+    def saturated(self) -> bool:
+        """
+        已满或有函数在排队；预热等可延后的扩容此时应让路。
+        """
+        return bool(self._waiters) or self.active >= self.max_concurrent
+
+    def is_waiting(self, fn_name: str) -> bool:
+        return any(w.fn_name == fn_name for w in self._waiters)
+
+    def waiting(self) -> Dict[str, int]:
+        result: Dict[str, int] = {}
+        for waiter in self._waiters:
+            result[waiter.fn_name] = result.get(waiter.fn_name, 0) + 1
+        return result
+
+    def active_functions(self) -> Dict[str, int]:
+        return dict(self._active)
+
+    async def acquire(self, fn_name: str) -> float:
+        """
+        等待一个冷启动名额，返回排队耗时（秒）。取消时不会占用名额。
+        """
+        if not self._waiters and self.active < self.max_concurrent:
+            self._take(fn_name)
+            return 0.0
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(fn_name, next(self._seq), future)
+        self._waiters.append(waiter)
+        try:
+            await future
+        except BaseException:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif future.done() and not future.cancelled():
+                # 已被放行但调用方放弃了，名额交给下一个
+                self.release(fn_name)
+            raise
+        return time.monotonic() - waiter.enqueued_at
+
+    def release(self, fn_name: str) -> None:
+        count = self._active.get(fn_name, 0) - 1
+        if count > 0:
+            self._active[fn_name] = count
+        else:
+            self._active.pop(fn_name, None)
+        self._admit()
+
+    def _take(self, fn_name: str) -> None:
+        self._active[fn_name] = self._active.get(fn_name, 0) + 1
+
+    def _admit(self) -> None:
+        while self._waiters and self.active < self.max_concurrent:
+            waiter = self._pick()
+            self._waiters.remove(waiter)
+            if waiter.future.done():
+                continue
+            self._take(waiter.fn_name)
+            waiter.future.set_result(None)
+
+    def _pick(self) -> _Waiter:
+        now = time.monotonic()
+        best: Optional[_Waiter] = None
+        best_key = None
+        for waiter in self._waiters:
+            score = self.priority(waiter.fn_name) + self.aging_per_second * (now - waiter.enqueued_at)
+            key = (score, -waiter.seq)
+            if best_key is None or key > best_key:
+                best, best_key = waiter, key
+        assert best is not None
+        return best
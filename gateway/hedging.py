@@ -0,0 +1,75 @@
+import time
+from typing import List, Optional
+
+
+class LatencyTracker:
+    """
+    最近 window 次上游调用延迟的环形缓冲，用于估计 p95 等分位数。
+    分位数每积累 refresh 个新样本才重新排序一次，热路径上只是一次数组写入。
+    """
+
+    __slots__ = ("window", "refresh", "_samples", "_next", "_dirty", "_sorted")
+
+    def __init__(self, window: int = 256, refresh: int = 16) -> None:
+        self.window = window
+        self.refresh = refresh
+        self._samples: List[float] = []
+        self._next = 0
+        self._dirty = 0
+        self._sorted: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, latency: float) -> None:
+        if len(self._samples) < self.window:
+            self._samples.append(latency)
+        else:
+            self._samples[self._next] = latency
+            self._next = (self._next + 1) % self.window
+        self._dirty += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        if self._dirty >= self.refresh or not self._sorted:
+            self._sorted = sorted(self._samples)
+            self._dirty = 0
+        index = min(len(self._sorted) - 1, int(len(self._sorted) * q))
+        return self._sorted[index]
+
+
+class RetryBudget:
+    """
+    对冲与重试共享的全局预算（令牌桶）：每个原始请求存入 ratio 个令牌，
+    每次额外发出的请求取走 1 个；另外每秒补充 min_per_second 个，保证低流量时也能重试。
+    额外请求数因此被限制在 原始请求数 * ratio + min_per_second * 时长 以内，
+    上游故障时不会因对冲/重试把流量放大数倍。
+    """
+
+    __slots__ = ("ratio", "min_per_second", "max_tokens", "tokens", "_updated")
+
+    def __init__(self, ratio: float, min_per_second: float, max_tokens: float) -> None:
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._updated = time.monotonic()
+
+    def deposit(self) -> None:
+        self._refill()
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if elapsed > 0:
+            self.tokens = min(self.max_tokens, self.tokens + elapsed * self.min_per_second)
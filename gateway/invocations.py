@@ -0,0 +1,326 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+# 异步调用状态
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS invocations (
+    id TEXT PRIMARY KEY,
+    function TEXT NOT NULL,
+    method TEXT NOT NULL,
+    path TEXT NOT NULL,
+    query TEXT NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    status_code INTEGER,
+    response_headers TEXT,
+    response_body BLOB,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_invocations_pending ON invocations (status, next_attempt_at);
+"""
+
+
+class Invocation:
+    """
+    一条异步调用记录；时间字段为 time.time() 墙钟时间，重启后仍然有效。
+    """
+
+    __slots__ = (
+        "id",
+        "function",
+        "method",
+        "path",
+        "query",
+        "headers",
+        "body",
+        "status",
+        "attempts",
+        "status_code",
+        "response_headers",
+        "response_body",
+        "error",
+        "created_at",
+        "updated_at",
+    )
+
+    def __init__(self, row: sqlite3.Row) -> None:
+        self.id = row["id"]
+        self.function = row["function"]
+        self.method = row["method"]
+        self.path = row["path"]
+        self.query = row["query"]
+        self.headers: List[Tuple[str, str]] = [tuple(h) for h in json.loads(row["headers"])]
+        self.body: bytes = row["body"]
+        self.status = row["status"]
+        self.attempts = row["attempts"]
+        self.status_code = row["status_code"]
+        self.response_headers: List[Tuple[str, str]] = [
+            tuple(h) for h in json.loads(row["response_headers"] or "[]")
+        ]
+        self.response_body: Optional[bytes] = row["response_body"]
+        self.error = row["error"]
+        self.created_at = row["created_at"]
+        self.updated_at = row["updated_at"]
+
+
+class InvocationStore:
+    """
+    基于 SQLite 的持久化异步调用队列，网关重启后未完成的调用会重新投递（至少一次语义）。
+
+    sqlite3 是阻塞 API，所有操作都放到专用的单线程执行器中串行执行，
+    既不阻塞事件循环，也不占用默认线程池。
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="faas-invocations")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    async def open(self) -> None:
+        await self._run(self._open)
+
+    async def close(self) -> None:
+        await self._run(self._close)
+        self._executor.shutdown(wait=False)
+
+    async def enqueue(
+        self,
+        function: str,
+        method: str,
+        path: str,
+        query: str,
+        headers: List[Tuple[str, str]],
+        body: bytes,
+        owner: str = "",
+    ) -> str:
+        """
+        写入一条待投递的调用并返回其 ID；owner 为受理的网关实例，编码在 ID 中，
+        其他实例据此给出明确的错误而不是 404。
+        """
+        invocation_id = uuid.uuid4().hex
+        if owner:
+            invocation_id = f"{invocation_id}.{owner}"
+        await self._run(self._insert, invocation_id, function, method, path, query, headers, body)
+        return invocation_id
+
+    async def get(self, invocation_id: str) -> Optional[Invocation]:
+        return await self._run(self._get, invocation_id)
+
+    async def claim(self, limit: int) -> List[Invocation]:
+        """
+        取出最多 limit 条到期的排队调用并标记为 running。
+        """
+        return await self._run(self._claim, limit)
+
+    async def complete(
+        self,
+        invocation_id: str,
+        status_code: int,
+        headers: List[Tuple[str, str]],
+        body: bytes,
+    ) -> None:
+        """
+        记录函数的最终响应：5xx 记为 failed，其余记为 succeeded，响应体都会保存。
+        """
+        await self._run(self._complete, invocation_id, status_code, headers, body)
+
+    async def retry_later(self, invocation_id: str, delay: float, error: str) -> None:
+        await self._run(self._retry_later, invocation_id, delay, error)
+
+    async def fail(self, invocation_id: str, error: str, status_code: Optional[int] = None) -> None:
+        await self._run(self._fail, invocation_id, error, status_code)
+
+    async def count_pending(self) -> int:
+        return await self._run(self._count_pending)
+
+    async def purge_finished(self, older_than: float) -> int:
+        return await self._run(self._purge_finished, older_than)
+
+    async def _run(self, func: Any, *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        # WAL：写入只追加日志，崩溃后可恢复；NORMAL 同步在 WAL 下仍保证不损坏
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        # 上次退出时正在执行的调用结果未知，重新排队
+        conn.execute(
+            "UPDATE invocations SET status = ?, updated_at = ? WHERE status = ?",
+            (STATUS_QUEUED, time.time(), STATUS_RUNNING),
+        )
+        self._conn = conn
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _db(self) -> sqlite3.Connection:
+        assert self._conn is not None, "InvocationStore 尚未 open"
+        return self._conn
+
+    def _insert(
+        self,
+        invocation_id: str,
+        function: str,
+        method: str,
+        path: str,
+        query: str,
+        headers: List[Tuple[str, str]],
+        body: bytes,
+    ) -> None:
+        now = time.time()
+        self._db().execute(
+            "INSERT INTO invocations (id, function, method, path, query, headers, body, status,"
+            " next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                invocation_id,
+                function,
+                method,
+                path,
+                query,
+                json.dumps(headers),
+                body,
+                STATUS_QUEUED,
+                now,
+                now,
+                now,
+            ),
+        )
+
+    def _get(self, invocation_id: str) -> Optional[Invocation]:
+        row = self._db().execute(
+            "SELECT * FROM invocations WHERE id = ?", (invocation_id,)
+        ).fetchone()
+        return Invocation(row) if row is not None else None
+
+    def _claim(self, limit: int) -> List[Invocation]:
+        db = self._db()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = db.execute(
+                "SELECT * FROM invocations WHERE status = ? AND next_attempt_at <= ?"
+                " ORDER BY next_attempt_at LIMIT ?",
+                (STATUS_QUEUED, now, limit),
+            ).fetchall()
+            db.executemany(
+                "UPDATE invocations SET status = ?, attempts = attempts + 1, updated_at = ?"
+                " WHERE id = ?",
+                [(STATUS_RUNNING, now, row["id"]) for row in rows],
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        invocations = [Invocation(row) for row in rows]
+        for invocation in invocations:
+            invocation.status = STATUS_RUNNING
+            invocation.attempts += 1
+        return invocations
+
+    def _complete(
+        self,
+        invocation_id: str,
+        status_code: int,
+        headers: List[Tuple[str, str]],
+        body: bytes,
+    ) -> None:
+        status = STATUS_FAILED if status_code >= 500 else STATUS_SUCCEEDED
+        self._db().execute(
+            "UPDATE invocations SET status = ?, status_code = ?, response_headers = ?,"
+            " response_body = ?, error = NULL, updated_at = ? WHERE id = ?",
+            (status, status_code, json.dumps(headers), body, time.time(), invocation_id),
+        )
+
+    def _retry_later(self, invocation_id: str, delay: float, error: str) -> None:
+        now = time.time()
+        self._db().execute(
+            "UPDATE invocations SET status = ?, next_attempt_at = ?, error = ?, updated_at = ?"
+            " WHERE id = ?",
+            (STATUS_QUEUED, now + delay, error, now, invocation_id),
+        )
+
+    def _fail(self, invocation_id: str, error: str, status_code: Optional[int]) -> None:
+        self._db().execute(
+            "UPDATE invocations SET status = ?, status_code = ?, error = ?, updated_at = ?"
+            " WHERE id = ?",
+            (STATUS_FAILED, status_code, error, time.time(), invocation_id),
+        )
+
+    def _count_pending(self) -> int:
+        row = self._db().execute(
+            "SELECT COUNT(*) FROM invocations WHERE status IN (?, ?)",
+            (STATUS_QUEUED, STATUS_RUNNING),
+        ).fetchone()
+        return int(row[0])
+
+    def _purge_finished(self, older_than: float) -> int:
+        cursor = self._db().execute(
+            "DELETE FROM invocations WHERE status IN (?, ?) AND updated_at < ?",
+            (STATUS_SUCCEEDED, STATUS_FAILED, older_than),
+        )
+        return cursor.rowcount
+
+
+def invocation_owner(invocation_id: str) -> Optional[str]:
+    """
+    从调用 ID 中取出受理的网关实例，旧格式的 ID 返回 None。
+    """
+    _, sep, owner = invocation_id.partition(".")
+    return owner if sep and owner else None
+
+
+def invocation_view(invocation: Invocation) -> Dict[str, Any]:
+    """
+    GET /invocations/{id} 的响应体：状态信息，完成后附带函数返回值
+    （JSON 响应解析为对象，其余按文本返回）。
+    """
+    view: Dict[str, Any] = {
+        "id": invocation.id,
+        "function": invocation.function,
+        "status": invocation.status,
+        "attempts": invocation.attempts,
+        "created_at": invocation.created_at,
+        "updated_at": invocation.updated_at,
+    }
+    if invocation.status_code is not None:
+        view["status_code"] = invocation.status_code
+    if invocation.error:
+        view["error"] = invocation.error
+    if invocation.response_body is not None:
+        content_type = dict((k.lower(), v) for k, v in invocation.response_headers).get(
+            "content-type", ""
+        )
+        body = invocation.response_body
+        if content_type.startswith("application/json"):
+            try:
+                view["result"] = json.loads(body)
+            except ValueError:
+                view["result"] = body.decode("utf-8", errors="replace")
+        else:
+            view["result"] = body.decode("utf-8", errors="replace")
+    return view
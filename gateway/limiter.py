@@ -0,0 +1,85 @@
+import time
+
+
+class AdaptiveLimiter:
+    """
+    单个函数的自适应并发上限（AIMD）：
+    - 以近期最快的上游延迟作为基线，延迟超过 基线 * tolerance + slack 或上游报错视为过载，
+      上限乘以 backoff（每个基线延迟周期最多收缩一次，避免一次拥塞被重复惩罚）；
+    - 否则在上限被用满一半以上时每个响应加 1/limit，即每轮约 +1。
+
+    上限按单副本计，实际可用并发 = limit * 就绪副本数，再受 max_inflight（隔舱）限制，
+    扩容后容量随副本数立即放大，不用重新学习。
+    """
+
+    __slots__ = (
+        "limit",
+        "min_limit",
+        "max_limit",
+        "max_inflight",
+        "tolerance",
+        "slack",
+        "backoff",
+        "inflight",
+        "baseline",
+        "_last_decrease",
+    )
+
+    def __init__(
+        self,
+        initial_limit: float,
+        min_limit: float,
+        max_limit: float,
+        max_inflight: int,
+        tolerance: float = 2.0,
+        slack: float = 0.05,
+        backoff: float = 0.9,
+    ) -> None:
+        self.limit = float(initial_limit)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.max_inflight = max_inflight
+        self.tolerance = tolerance
+        # 绝对容忍量，毫秒级函数的正常抖动不算过载
+        self.slack = slack
+        self.backoff = backoff
+        self.inflight = 0
+        # 无负载时的上游延迟估计（秒）；0 表示尚无样本
+        self.baseline = 0.0
+        self._last_decrease = 0.0
+
+    def capacity(self, replicas: int) -> int:
+        return min(self.max_inflight, max(1, int(self.limit * max(1, replicas))))
+
+    def try_acquire(self, replicas: int) -> bool:
+        if self.inflight >= self.capacity(replicas):
+            return False
+        self.inflight += 1
+        return True
+
+    def release(self) -> None:
+        if self.inflight > 0:
+            self.inflight -= 1
+
+    def observe(self, latency: float, overloaded: bool, replicas: int) -> None:
+        """
+        记录一次上游调用的延迟（到收到响应头为止）与是否过载。
+        """
+        if not overloaded:
+            if self.baseline <= 0 or latency < self.baseline:
+                self.baseline = latency
+            else:
+                # 基线缓慢上漂，函数本身变慢后不会一直被误判为过载
+                self.baseline += (latency - self.baseline) * 0.01
+            overloaded = latency > self.baseline * self.tolerance + self.slack
+
+        if overloaded:
+            now = time.monotonic()
+            if now - self._last_decrease >= max(self.baseline, 0.001):
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+            return
+
+        # 只有真的用到一半以上容量时才放大上限，避免空闲时上限无限增长
+        if self.inflight * 2 >= self.capacity(replicas):
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
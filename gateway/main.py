@@ -1,12 +1,51 @@
 import asyncio
+import hashlib
+import json
+import math
 import os
-from typing import Dict, Optional
+import socket
+import time
+from urllib.parse import parse_qsl, urlencode
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Tuple
 
 import httpx
 from fastapi import FastAPI, HTTPException, Request, Response
-from kubernetes import client, config
-from kubernetes.client import ApiException
-from kubernetes.config.config_exception import ConfigException
+from fastapi.responses import JSONResponse, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from kubernetes_asyncio import client, config, watch
+from kubernetes_asyncio.client.rest import ApiException
+from kubernetes_asyncio.config import ConfigException
+
+from gateway.activator import ActivationQueueFull, ActivationTimeout, Activator
+from gateway.batch import BatchOutcome, decode_result, fan_out, parse_events, split_units
+from gateway.cache import (
+    CacheKey,
+    CachedResponse,
+    ResponseCache,
+    body_etag,
+    etag_matches,
+    parse_cache_control,
+    response_ttl,
+)
+from gateway.coordinator import InMemoryCoordinator, LeaseCoordinator, ScaleCoordinator
+from gateway.endpoints import EndpointBalancer
+from gateway.governor import ColdStartGovernor
+from gateway.hedging import LatencyTracker, RetryBudget
+from gateway.invocations import InvocationStore, invocation_owner, invocation_view
+from gateway.limiter import AdaptiveLimiter
+from gateway.metrics import REGISTRY, UNKNOWN_FUNCTION, FunctionMetrics, StateCollector
+from gateway.outlier import OutlierDetector
+from gateway.prewarm import Prewarmer
+from gateway.ratelimit import LocalRateLimiter, RateLimiter, RedisRateLimiter, aioredis
+from gateway.scheduler import (
+    DEFAULT_PRIORITY_CLASS,
+    PRIORITY_CLASSES,
+    FairScheduler,
+    SchedulerQueueFull,
+    SchedulerTimeout,
+)
+from gateway.singleflight import SingleFlight
+from gateway.timing import COLD_START_HEADER, SERVER_TIMING_HEADER, Activation, ServerTiming
 
 app = FastAPI(title="FaaS Gateway", version="1.0.0")
 
@@ -19,28 +58,373 @@ NAMESPACE = os.getenv("FAAS_NAMESPACE", "default")
 SERVICE_PORT = int(os.getenv("FAAS_SERVICE_PORT", "8080"))
 POLL_INTERVAL_SECONDS = float(os.getenv("FAAS_POLL_INTERVAL", "0.5"))
 POLL_TIMEOUT_SECONDS = float(os.getenv("FAAS_POLL_TIMEOUT", "60"))
+# 单次 watch 请求的服务端超时，到期后带 resourceVersion 续订
+WATCH_TIMEOUT_SECONDS = int(os.getenv("FAAS_WATCH_TIMEOUT", "300"))
+WATCH_RETRY_SECONDS = float(os.getenv("FAAS_WATCH_RETRY", "2"))
+# 控制面请求（读取 / 扩缩容）的并发上限，保护 API Server；watch 长连接不计入
+KUBE_API_MAX_CONCURRENCY = int(os.getenv("FAAS_KUBE_API_MAX_CONCURRENCY", "16"))
+
+# 上游（Runner）连接池配置，每个函数一个长连接池
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("FAAS_UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("FAAS_UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("FAAS_UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+# 单次调用的缺省超时，函数可用 spec.timeoutSeconds 覆盖
+UPSTREAM_TIMEOUT_SECONDS = float(os.getenv("FAAS_UPSTREAM_TIMEOUT", "10"))
+UPSTREAM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("FAAS_UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_POOL_TIMEOUT_SECONDS = float(os.getenv("FAAS_UPSTREAM_POOL_TIMEOUT", "5"))
+
+# 冷启动激活队列：每个函数最多缓冲的请求数、单个请求最长等待时间，以及队列满时建议的重试间隔
+ACTIVATION_MAX_DEPTH = int(os.getenv("FAAS_ACTIVATION_MAX_DEPTH", "1000"))
+ACTIVATION_MAX_WAIT_SECONDS = float(os.getenv("FAAS_ACTIVATION_MAX_WAIT", str(POLL_TIMEOUT_SECONDS)))
+ACTIVATION_RETRY_AFTER_SECONDS = int(os.getenv("FAAS_ACTIVATION_RETRY_AFTER", "1"))
+
+# 全局冷启动并发上限：同时扩容并等待就绪的函数数，其余按排队请求数优先、等待时长老化依次放行。
+# 就绪超时从拿到名额时开始计算，排队中的函数不会一起超时
+COLD_START_MAX_CONCURRENCY = int(os.getenv("FAAS_COLD_START_MAX_CONCURRENCY", "10"))
+# 每等待 1 秒相当于多排队这么多个请求，保证低流量函数也能被放行
+COLD_START_AGING_PER_SECOND = float(os.getenv("FAAS_COLD_START_AGING", "1"))
+# 等待就绪期间按此间隔复查激活队列深度，突发流量还在涌入时继续向上扩容
+COLD_START_RESCALE_INTERVAL_SECONDS = float(os.getenv("FAAS_COLD_START_RESCALE_INTERVAL", "0.25"))
+
+# 每个函数的自适应并发上限（AIMD，按单副本计）；超出时直接 503，不再排到上游超时
+CONCURRENCY_LIMIT_ENABLED = os.getenv("FAAS_CONCURRENCY_LIMIT", "true").lower() in ("1", "true", "yes")
+CONCURRENCY_INITIAL_LIMIT = float(os.getenv("FAAS_CONCURRENCY_INITIAL_LIMIT", "20"))
+CONCURRENCY_MIN_LIMIT = float(os.getenv("FAAS_CONCURRENCY_MIN_LIMIT", "1"))
+CONCURRENCY_MAX_LIMIT = float(os.getenv("FAAS_CONCURRENCY_MAX_LIMIT", "200"))
+CONCURRENCY_LATENCY_TOLERANCE = float(os.getenv("FAAS_CONCURRENCY_LATENCY_TOLERANCE", "2"))
+CONCURRENCY_LATENCY_SLACK_SECONDS = float(os.getenv("FAAS_CONCURRENCY_LATENCY_SLACK", "0.05"))
+# 隔舱：单个函数的在途请求总上限，与该函数独立的上游连接池大小一致，
+# 慢函数最多占满自己的连接池，不会拖住其他函数
+FUNCTION_MAX_INFLIGHT = int(os.getenv("FAAS_FUNCTION_MAX_INFLIGHT", str(UPSTREAM_MAX_CONNECTIONS)))
+SHED_RETRY_AFTER_SECONDS = int(os.getenv("FAAS_SHED_RETRY_AFTER", "1"))
+# 上游返回这些状态码时视为过载信号
+OVERLOAD_STATUS_CODES = frozenset({429, 502, 503, 504})
+
+# 令牌桶限流（按函数 spec.rateLimit 开启）：local 为进程内计数（多副本时限额按副本叠加），
+# redis 为各网关副本共享（需要安装 redis 包），Redis 不可用时回退到本地计数
+RATE_LIMIT_BACKEND = os.getenv("FAAS_RATE_LIMIT_BACKEND", "local").lower()
+RATE_LIMIT_REDIS_URL = os.getenv("FAAS_RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+RATE_LIMIT_REDIS_TIMEOUT_SECONDS = float(os.getenv("FAAS_RATE_LIMIT_REDIS_TIMEOUT", "0.1"))
+# 本地令牌桶数量上限（函数 x 调用方），超出时淘汰最久未使用的桶
+RATE_LIMIT_MAX_KEYS = int(os.getenv("FAAS_RATE_LIMIT_MAX_KEYS", "100000"))
+# 调用方标识：优先取该请求头（API Key，哈希后使用），否则取客户端 IP
+CALLER_ID_HEADER = os.getenv("FAAS_CALLER_ID_HEADER", "x-api-key").lower()
+# 网关位于 Ingress / 负载均衡之后时开启，取 X-Forwarded-For 的第一个地址作为客户端 IP
+TRUST_FORWARDED_FOR = os.getenv("FAAS_TRUST_FORWARDED_FOR", "false").lower() in ("1", "true", "yes")
+
+# 网关全局的上游并发名额（0 表示不限制）。饱和后按函数排队，
+# 优先级类别（spec.priorityClass）严格优先，同类别内按 spec.weight 加权公平放行
+GATEWAY_MAX_INFLIGHT = int(os.getenv("FAAS_GATEWAY_MAX_INFLIGHT", "512"))
+SCHEDULER_MAX_QUEUED = int(os.getenv("FAAS_SCHEDULER_MAX_QUEUED", "2000"))
+SCHEDULER_MAX_WAIT_SECONDS = float(os.getenv("FAAS_SCHEDULER_MAX_WAIT", "30"))
+
+# 对冲：开启 hedgeRequests 的函数，幂等请求超过近期 p95 延迟未返回时向另一个 Pod 再发一份
+HEDGE_QUANTILE = float(os.getenv("FAAS_HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("FAAS_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("FAAS_HEDGE_MIN_DELAY", "0.005"))
+# 连接级失败（请求尚未到达 Pod）换 Pod 重试的次数上限
+UPSTREAM_MAX_RETRIES = int(os.getenv("FAAS_UPSTREAM_MAX_RETRIES", "2"))
+# 对冲与重试共享的全局预算：额外请求不超过原始请求的 ratio 倍 + 每秒 min 个
+RETRY_BUDGET_RATIO = float(os.getenv("FAAS_RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv("FAAS_RETRY_BUDGET_MIN_PER_SECOND", "10"))
+
+# 异步调用：SQLite 持久化队列，后台按全局并发上限投递，执行时长不受同步超时限制。
+# 队列只保存在受理实例的本地存储上，结果也只能在该实例上查询；调用 ID 中带有实例名
+ASYNC_DB_PATH = os.getenv("FAAS_ASYNC_DB_PATH", "faas-invocations.db")
+ASYNC_OWNER = os.getenv("POD_NAME") or socket.gethostname()
+ASYNC_CONCURRENCY = int(os.getenv("FAAS_ASYNC_CONCURRENCY", "8"))
+ASYNC_TIMEOUT_SECONDS = float(os.getenv("FAAS_ASYNC_TIMEOUT", "900"))
+ASYNC_MAX_ATTEMPTS = int(os.getenv("FAAS_ASYNC_MAX_ATTEMPTS", "3"))
+ASYNC_RETRY_BASE_SECONDS = float(os.getenv("FAAS_ASYNC_RETRY_BASE", "2"))
+ASYNC_MAX_PENDING = int(os.getenv("FAAS_ASYNC_MAX_PENDING", "10000"))
+ASYNC_RESULT_TTL_SECONDS = float(os.getenv("FAAS_ASYNC_RESULT_TTL", str(24 * 3600)))
+ASYNC_POLL_INTERVAL_SECONDS = float(os.getenv("FAAS_ASYNC_POLL_INTERVAL", "1"))
+
+# 批量调用：单批事件数上限、默认与最大扇出并发
+BATCH_MAX_EVENTS = int(os.getenv("FAAS_BATCH_MAX_EVENTS", "10000"))
+BATCH_CONCURRENCY = int(os.getenv("FAAS_BATCH_CONCURRENCY", "8"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("FAAS_BATCH_MAX_CONCURRENCY", "64"))
+# Runner 的批量入口（与 runner/server.py 中 BATCH_PATH 一致）
+RUNNER_BATCH_PATH = "/_faas/batch"
+
+# 多网关实例间的扩缩容协调：memory（单实例，默认）/ lease（K8s Lease，多副本或多 worker 时使用）
+SCALE_COORDINATOR = os.getenv("FAAS_SCALE_COORDINATOR", "memory").lower()
+SCALE_LEASE_SECONDS = float(os.getenv("FAAS_SCALE_LEASE_SECONDS", "15"))
+# 租约持有者标识，同一 Pod 内多个 uvicorn worker 以 pid 区分
+GATEWAY_IDENTITY = f"{os.getenv('POD_NAME') or socket.gethostname()}-{os.getpid()}"
+
+# 空闲缩容到 0：函数级窗口来自 spec.scaleToZeroAfter（注解），这里是缺省值。
+# 各网关每个检查周期把本实例的最近调用时间写入协调后端，缩容前取所有实例中最近的一次，
+# 因此多副本部署需要 lease 协调后端，且窗口应明显大于检查周期。
+SCALE_TO_ZERO_ENABLED = os.getenv("FAAS_SCALE_TO_ZERO", "true").lower() in ("1", "true", "yes")
+SCALE_TO_ZERO_AFTER_SECONDS = float(os.getenv("FAAS_SCALE_TO_ZERO_AFTER", "300"))
+# 扩容后至少保持这么久才允许再次缩容，避免抖动
+SCALE_TO_ZERO_STABILIZATION_SECONDS = float(os.getenv("FAAS_SCALE_TO_ZERO_STABILIZATION", "60"))
+SCALE_TO_ZERO_INTERVAL_SECONDS = float(os.getenv("FAAS_SCALE_TO_ZERO_INTERVAL", "10"))
+
+# 预测性预热：按天为周期统计各时段的到达数，预计 LEAD 秒后的时段到达数（每桶 EWMA）
+# 不低于 THRESHOLD 时，提前把已缩到 0 的函数拉起一个副本
+PREWARM_ENABLED = os.getenv("FAAS_PREWARM", "true").lower() in ("1", "true", "yes")
+PREWARM_BUCKET_SECONDS = float(os.getenv("FAAS_PREWARM_BUCKET", "300"))
+# 每天更新一次对应时段，alpha 越大越快适应新的流量规律
+PREWARM_ALPHA = float(os.getenv("FAAS_PREWARM_ALPHA", "0.3"))
+PREWARM_THRESHOLD = float(os.getenv("FAAS_PREWARM_THRESHOLD", "0.5"))
+PREWARM_LEAD_SECONDS = float(os.getenv("FAAS_PREWARM_LEAD", "120"))
+PREWARM_INTERVAL_SECONDS = float(os.getenv("FAAS_PREWARM_INTERVAL", "30"))
+# 到达历史的持久化文件，网关重启后继续使用已积累的规律；为空则不持久化
+PREWARM_STATE_PATH = os.getenv("FAAS_PREWARM_STATE_PATH", "faas-prewarm.json")
+
+# 流式代理：请求体边收边转发，响应按块回写，单个请求只在内存中保留一个块
+PROXY_STREAMING = os.getenv("FAAS_PROXY_STREAMING", "false").lower() in ("1", "true", "yes")
+STREAM_CHUNK_SIZE = int(os.getenv("FAAS_STREAM_CHUNK_SIZE", str(64 * 1024)))
+
+# GET 响应缓存（按函数 spec.responseCacheTTL 开启）：总内存上限与单条上限
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("FAAS_RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.getenv("FAAS_RESPONSE_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+# 请求合并（按函数 spec.coalesceRequests 开启）只作用于幂等方法
+IDEMPOTENT_METHODS = frozenset({"GET", "PUT", "DELETE"})
+
+# Runner 在响应头中回报实际执行的代码版本，与 Deployment 注解一致时才写入缓存
+CODE_VERSION_HEADER = "x-faas-code-version"
+
+# 客户端以相对秒数声明整次调用的截止时间（不依赖两端时钟一致）；
+# 网关转发时改写为本次上游调用的剩余预算交给 Runner
+DEADLINE_HEADER = "x-faas-timeout"
+# 客户端可以把单个请求的优先级类别调低（不能高于函数的 spec.priorityClass）
+PRIORITY_HEADER = "x-faas-priority"
+
+# Runner 因预算不足拒绝执行时带上此头，这类响应不反映函数的延迟与负载，不计入并发上限与延迟统计
+DEADLINE_EXCEEDED_HEADER = "x-faas-deadline-exceeded"
+# Runner 自身故障（如加载用户代码失败）时带上此头，与用户代码抛出的异常区分
+RUNNER_ERROR_HEADER = "x-faas-runner-error"
+
+# RFC 7230 6.1 逐跳头，只在单跳连接上有意义，代理时不能透传
+HOP_BY_HOP_HEADERS = frozenset(
+    {
+        "connection",
+        "keep-alive",
+        "proxy-authenticate",
+        "proxy-authorization",
+        "proxy-connection",
+        "te",
+        "trailer",
+        "transfer-encoding",
+        "upgrade",
+    }
+)
+
+# 与控制面 Deployment 标签保持一致，只 watch 函数运行时
+FUNCTION_LABEL_SELECTOR = "app.kubernetes.io/name=faas-function"
+# 控制面把 Function spec 中网关需要的字段写到 Deployment 注解上
+ANNOTATION_PREFIX = "faas.example.com/"
+# 单个 Pod 期望承载的并发请求数（与 CRD 中 targetConcurrency 默认值一致）
+DEFAULT_TARGET_CONCURRENCY = 10
+# EndpointSlice 控制器写入的归属 Service 标签
+SERVICE_NAME_LABEL = "kubernetes.io/service-name"
+
+# 直连 Pod 的负载均衡策略：p2c / least；service 表示沿用 Service DNS + kube-proxy
+LB_POLICY = os.getenv("FAAS_LB_POLICY", "p2c").lower()
+
+# 实例异常摘除（仅直连 Pod 时生效）：连续失败 CONSECUTIVE_FAILURES 次，或平均耗时超过
+# 同函数其他实例中位数的 LATENCY_FACTOR 倍（0 表示不按延迟摘除）时摘除该实例，
+# 摘除时长从 BASE 秒起每次加倍、不超过 MAX 秒；函数的实例全部被摘除时直接返回 503
+OUTLIER_DETECTION = os.getenv("FAAS_OUTLIER_DETECTION", "true").lower() in ("1", "true", "yes")
+OUTLIER_CONSECUTIVE_FAILURES = int(os.getenv("FAAS_OUTLIER_CONSECUTIVE_FAILURES", "5"))
+OUTLIER_BASE_EJECTION_SECONDS = float(os.getenv("FAAS_OUTLIER_BASE_EJECTION", "10"))
+OUTLIER_MAX_EJECTION_SECONDS = float(os.getenv("FAAS_OUTLIER_MAX_EJECTION", "300"))
+OUTLIER_LATENCY_FACTOR = float(os.getenv("FAAS_OUTLIER_LATENCY_FACTOR", "3"))
+OUTLIER_LATENCY_MIN_SAMPLES = int(os.getenv("FAAS_OUTLIER_LATENCY_MIN_SAMPLES", "20"))
+# 按延迟摘除的实例最多占函数实例数的比例，整体变慢时不会把实例摘光
+OUTLIER_MAX_LATENCY_EJECTION_PERCENT = float(os.getenv("FAAS_OUTLIER_MAX_LATENCY_EJECTION_PERCENT", "50"))
+
+# 冷启动激活队列：限制排队深度与等待时长，单实例网关内只触发一次扩容。
+# 跨实例由 _scale_coordinator 保证同一函数只有一个网关下发扩容。
+_activator = Activator(max_depth=ACTIVATION_MAX_DEPTH, max_wait=ACTIVATION_MAX_WAIT_SECONDS)
+# 全局冷启动名额，优先级为该函数当前排队的请求数
+_cold_start_governor = ColdStartGovernor(
+    max_concurrent=COLD_START_MAX_CONCURRENCY,
+    priority=_activator.depth,
+    aging_per_second=COLD_START_AGING_PER_SECOND,
+)
+# 在 startup 中按 FAAS_SCALE_COORDINATOR 替换为对应后端
+_scale_coordinator: ScaleCoordinator = InMemoryCoordinator(GATEWAY_IDENTITY, SCALE_LEASE_SECONDS)
+
+# Function CRD watch 维护的函数名索引（小写），未知函数直接 404，不访问 API Server
+_known_functions: Set[str] = set()
+# 索引未同步（启动中或 watch 断开）时不做拒绝，回退到按 Deployment 判断
+_functions_synced = False
+
+# Deployment watch 维护的就绪副本缓存：deployment 名 -> ready_replicas。
+# 热路径只读这个字典，不加锁也不访问 API Server。
+_ready_replicas: Dict[str, int] = {}
+# Deployment 上由控制面下发的函数级配置注解：deployment 名 -> annotations
+_function_annotations: Dict[str, Dict[str, str]] = {}
+# watch 断开期间缓存可能过期，此时回退到直接查询 API Server
+_ready_cache_synced = False
+# 冷启动等待者：deployment 名 -> Event，watch 观察到 ready_replicas > 0 时立即唤醒
+_ready_waiters: Dict[str, asyncio.Event] = {}
+
+# 每个函数一个长连接 httpx 客户端，复用 keep-alive 连接，避免每次调用都建连 + DNS 解析
+_upstream_clients: Dict[str, httpx.AsyncClient] = {}
+
+# 调用统计（函数名小写为 key），供空闲缩容判断
+_inflight_requests: Dict[str, int] = {}
+_last_invocation: Dict[str, float] = {}
+_last_scale_up: Dict[str, float] = {}
+# 已写入协调后端的最近调用时间（monotonic），没有新调用时不重复写
+_published_activity: Dict[str, float] = {}
+# 已下发缩容到 0、旧 Pod 仍在退出的函数；此期间不走热路径
+_draining: Set[str] = set()
+_background_tasks: List[asyncio.Task] = []
+
+# 幂等 GET 调用的响应缓存，key 中包含代码版本，代码变更时整体失效
+_response_cache = ResponseCache(
+    max_bytes=RESPONSE_CACHE_MAX_BYTES,
+    max_entry_bytes=RESPONSE_CACHE_MAX_ENTRY_BYTES,
+)
+
+# 相同幂等请求的并发合并
+_single_flight = SingleFlight()
+
+# 每个已知函数一组预绑定标签的指标 child，函数删除时移除
+_function_metrics: Dict[str, FunctionMetrics] = {}
+
+# 每个函数的自适应并发上限
+_limiters: Dict[str, AdaptiveLimiter] = {}
+
+# 令牌桶限流后端，在 startup 中按 FAAS_RATE_LIMIT_BACKEND 替换
+_rate_limiter: RateLimiter = LocalRateLimiter(RATE_LIMIT_MAX_KEYS)
+# 函数名 -> 因限流被拒绝的调用数
+_rate_limited: Dict[str, int] = {}
 
-# 这里使用“内存锁”，保证在单实例网关内不会重复触发扩容。
-# 若需多实例分布式锁，可替换为 Redis 实现（如 aioredis+SETNX）。
-_function_locks: Dict[str, asyncio.Lock] = {}
+# 跨函数的上游名额与加权公平排队
+_scheduler: Optional[FairScheduler] = (
+    FairScheduler(capacity=GATEWAY_MAX_INFLIGHT, max_queued=SCHEDULER_MAX_QUEUED)
+    if GATEWAY_MAX_INFLIGHT > 0
+    else None
+)
 
+# 每个函数近期的上游延迟分布（对冲阈值），以及全局的对冲/重试预算
+_latency_trackers: Dict[str, LatencyTracker] = {}
+_retry_budget = RetryBudget(
+    ratio=RETRY_BUDGET_RATIO,
+    min_per_second=RETRY_BUDGET_MIN_PER_SECOND,
+    max_tokens=max(1.0, RETRY_BUDGET_MIN_PER_SECOND * 10),
+)
+
+# 异步调用队列与投递状态；Event 在 startup 中创建以绑定到服务的事件循环
+_invocation_store = InvocationStore(ASYNC_DB_PATH)
+_async_wakeup: Optional[asyncio.Event] = None
+_async_running: Set[asyncio.Task] = set()
+
+# 函数到达历史与预热效果统计
+_prewarmer = Prewarmer(
+    bucket_seconds=PREWARM_BUCKET_SECONDS,
+    alpha=PREWARM_ALPHA,
+    threshold=PREWARM_THRESHOLD,
+)
+
+# EndpointSlice watch 维护的就绪 Pod 地址与在途请求数
+_balancer = EndpointBalancer(policy=LB_POLICY)
+# 各 Pod 地址的健康状况与摘除状态
+_outliers = OutlierDetector(
+    consecutive_failures=OUTLIER_CONSECUTIVE_FAILURES,
+    base_ejection_seconds=OUTLIER_BASE_EJECTION_SECONDS,
+    max_ejection_seconds=OUTLIER_MAX_EJECTION_SECONDS,
+    latency_factor=OUTLIER_LATENCY_FACTOR if OUTLIER_LATENCY_FACTOR > 0 else math.inf,
+    latency_min_samples=OUTLIER_LATENCY_MIN_SAMPLES,
+    max_latency_ejection_ratio=OUTLIER_MAX_LATENCY_EJECTION_PERCENT / 100,
+)
+# 函数名 -> 因实例全部被摘除而快速失败的调用数
+_circuit_rejections: Dict[str, int] = {}
+
+# 原生 asyncio K8s 客户端（kubernetes_asyncio），自带 aiohttp 连接池，不占用默认线程池
+kube_api_client: Optional[client.ApiClient] = None
 apps_v1_api: Optional[client.AppsV1Api] = None
+discovery_v1_api: Optional[client.DiscoveryV1Api] = None
+custom_objects_api: Optional[client.CustomObjectsApi] = None
+# 控制面请求并发闸门，在 startup 中创建以绑定到服务的事件循环
+_kube_api_semaphore: Optional[asyncio.Semaphore] = None
 
 
-def init_kube_client() -> None:
-    global apps_v1_api
+async def init_kube_client() -> None:
+    global kube_api_client, apps_v1_api, discovery_v1_api, custom_objects_api
+    global _kube_api_semaphore, _scale_coordinator
     try:
         config.load_incluster_config()
         print("Loaded in-cluster kube config.")
     except ConfigException:
-        config.load_kube_config()
+        await config.load_kube_config()
         print("Loaded local kubeconfig.")
-    apps_v1_api = client.AppsV1Api()
+
+    configuration = client.Configuration.get_default_copy()
+    # 连接池需容纳所有 watch 长连接 + 受限的普通请求
+    configuration.connection_pool_maxsize = KUBE_API_MAX_CONCURRENCY + 4
+    kube_api_client = client.ApiClient(configuration)
+    apps_v1_api = client.AppsV1Api(kube_api_client)
+    discovery_v1_api = client.DiscoveryV1Api(kube_api_client)
+    custom_objects_api = client.CustomObjectsApi(kube_api_client)
+    _kube_api_semaphore = asyncio.Semaphore(KUBE_API_MAX_CONCURRENCY)
+    if SCALE_COORDINATOR == "lease":
+        _scale_coordinator = LeaseCoordinator(
+            client.CoordinationV1Api(kube_api_client),
+            NAMESPACE,
+            GATEWAY_IDENTITY,
+            SCALE_LEASE_SECONDS,
+            _kube_api_semaphore,
+        )
+        print(f"扩缩容协调使用 K8s Lease，实例标识 {GATEWAY_IDENTITY}")
+
+
+def init_rate_limiter() -> None:
+    global _rate_limiter
+    if RATE_LIMIT_BACKEND != "redis":
+        return
+    if aioredis is None:
+        print("未安装 redis 包，限流回退到本地令牌桶。")
+        return
+    _rate_limiter = RedisRateLimiter(
+        RATE_LIMIT_REDIS_URL,
+        prefix="faas:ratelimit:",
+        timeout=RATE_LIMIT_REDIS_TIMEOUT_SECONDS,
+        fallback=LocalRateLimiter(RATE_LIMIT_MAX_KEYS),
+    )
+    print(f"限流使用共享 Redis 后端 {RATE_LIMIT_REDIS_URL}")
 
 
 @app.on_event("startup")
 async def on_startup():
-    init_kube_client()
+    global _async_wakeup
+    await init_kube_client()
+    init_rate_limiter()
+    _start_watches()
+    await _invocation_store.open()
+    _async_wakeup = asyncio.Event()
+    _background_tasks.append(asyncio.ensure_future(_async_dispatch_loop()))
+    if SCALE_TO_ZERO_ENABLED:
+        _background_tasks.append(asyncio.ensure_future(_scale_to_zero_loop()))
+    if PREWARM_ENABLED:
+        await _load_prewarm_state()
+        _background_tasks.append(asyncio.ensure_future(_prewarm_loop()))
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+    # 未完成的异步调用保持 running，下次启动时重新排队
+    for task in list(_async_running):
+        task.cancel()
+    await asyncio.gather(*_async_running, return_exceptions=True)
+    await _invocation_store.close()
+    if PREWARM_ENABLED:
+        await _save_prewarm_state()
+    await _close_upstream_clients()
+    await _rate_limiter.close()
+    if kube_api_client is not None:
+        await kube_api_client.close()
 
 
 def _deployment_name_from_function(fn_name: str) -> str:
@@ -53,50 +437,414 @@ def _service_name_from_function(fn_name: str) -> str:
     return f"fn-{fn_name.lower()}-svc"
 
 
-async def _get_or_create_lock(fn_name: str) -> asyncio.Lock:
-    lock = _function_locks.get(fn_name)
-    if lock is None:
-        # 简单保护：创建新锁时加全局锁也可以，这里依赖 GIL+字典写少量冲突即可。
-        lock = asyncio.Lock()
-        _function_locks[fn_name] = lock
-    return lock
+def _deployment_name_from_service(svc_name: str) -> str:
+    return f"{svc_name[:-len('-svc')]}-deploy"
 
 
-async def _get_deployment_ready_replicas(fn_name: str) -> int:
-    assert apps_v1_api is not None
+def _function_name_from_deployment(deploy_name: str) -> str:
+    return deploy_name[len("fn-"):-len("-deploy")]
+
+
+def _is_function_deployment(deploy_name: str) -> bool:
+    return deploy_name.startswith("fn-") and deploy_name.endswith("-deploy")
+
+
+def _wake_ready_waiters(deploy_name: str) -> None:
+    event = _ready_waiters.pop(deploy_name, None)
+    if event is not None:
+        event.set()
+
+
+def _replace_ready_cache(snapshot: Dict[str, int]) -> None:
+    global _ready_cache_synced
+    _ready_replicas.clear()
+    _ready_replicas.update(snapshot)
+    _ready_cache_synced = True
+    # 重新 list 后所有等待者都需要基于新快照重新判断（就绪或已删除）
+    for deploy_name in list(_ready_waiters):
+        _wake_ready_waiters(deploy_name)
+
+
+def _apply_deployment_event(event_type: str, deploy_name: str, ready: int) -> None:
+    if event_type == "DELETED":
+        _ready_replicas.pop(deploy_name, None)
+        _forget_function(_function_name_from_deployment(deploy_name))
+        _wake_ready_waiters(deploy_name)
+    else:
+        previous = _ready_replicas.get(deploy_name, 0)
+        _ready_replicas[deploy_name] = ready
+        if ready == 0:
+            # 旧 Pod 已全部退出，缩容完成
+            fn_name = _function_name_from_deployment(deploy_name)
+            _draining.discard(fn_name)
+            if previous > 0:
+                # 无论由哪个网关缩容，预热的副本没等到请求就结束了
+                _prewarmer.on_scaled_to_zero(fn_name, time.time())
+        if ready > 0:
+            _wake_ready_waiters(deploy_name)
+
+
+def _forget_function(fn_name: str) -> None:
+    """
+    函数被删除时释放它在网关中的全部状态。
+    """
+    _discard_upstream_client(fn_name)
+    _last_invocation.pop(fn_name, None)
+    _last_scale_up.pop(fn_name, None)
+    _published_activity.pop(fn_name, None)
+    _draining.discard(fn_name)
+    _response_cache.invalidate_function(fn_name)
+    _single_flight.forget(fn_name)
+    _limiters.pop(fn_name, None)
+    _latency_trackers.pop(fn_name, None)
+    _prewarmer.forget(fn_name)
+    _rate_limited.pop(fn_name, None)
+    _circuit_rejections.pop(fn_name, None)
+    metrics = _function_metrics.pop(fn_name, None)
+    if metrics is not None:
+        metrics.remove()
+
+
+def _mark_ready_cache_stale() -> None:
+    global _ready_cache_synced
+    _ready_cache_synced = False
+    # watch 断开：唤醒所有等待者，让它们切换到轮询兜底
+    for deploy_name in list(_ready_waiters):
+        _wake_ready_waiters(deploy_name)
+
+
+def _set_function_annotations(deploy_name: str, annotations: Dict[str, str]) -> None:
+    key = ANNOTATION_PREFIX + "code-version"
+    previous = _function_annotations.get(deploy_name)
+    if previous is not None and previous.get(key) != annotations.get(key):
+        # spec.code 变更：该函数的缓存响应全部作废
+        _response_cache.invalidate_function(_function_name_from_deployment(deploy_name))
+    _function_annotations[deploy_name] = annotations
+
+
+def _on_deployment_list(items: List[Any]) -> None:
+    listed = set()
+    for d in items:
+        if _is_function_deployment(d.metadata.name):
+            listed.add(d.metadata.name)
+            _set_function_annotations(d.metadata.name, dict(d.metadata.annotations or {}))
+    for deploy_name in list(_function_annotations):
+        if deploy_name not in listed:
+            _function_annotations.pop(deploy_name, None)
+    _replace_ready_cache(
+        {
+            d.metadata.name: int((d.status and d.status.ready_replicas) or 0)
+            for d in items
+            if _is_function_deployment(d.metadata.name)
+        }
+    )
+
+
+def _on_deployment_event(event_type: str, dep: Any) -> None:
+    if not _is_function_deployment(dep.metadata.name):
+        return
+    if event_type == "DELETED":
+        _function_annotations.pop(dep.metadata.name, None)
+    else:
+        _set_function_annotations(dep.metadata.name, dict(dep.metadata.annotations or {}))
+    ready = int((dep.status and dep.status.ready_replicas) or 0)
+    _apply_deployment_event(event_type, dep.metadata.name, ready)
+
+
+def _on_function_list(items: List[Any]) -> None:
+    global _functions_synced
+    listed = {item["metadata"]["name"].lower() for item in items}
+    # watch 断开期间被删除的函数：同样释放网关内的状态
+    for fn_name in _known_functions - listed:
+        _forget_function(fn_name)
+    _known_functions.clear()
+    _known_functions.update(listed)
+    _functions_synced = True
+
+
+def _on_function_event(event_type: str, obj: Any) -> None:
+    fn_name = obj["metadata"]["name"].lower()
+    if event_type == "DELETED":
+        _known_functions.discard(fn_name)
+        _forget_function(fn_name)
+    else:
+        _known_functions.add(fn_name)
+
+
+def _mark_functions_stale() -> None:
+    global _functions_synced
+    _functions_synced = False
+
+
+def _endpoint_slice_addresses(es: Any) -> List[str]:
+    """
+    取出 EndpointSlice 中可接收流量的地址（ready 且未在终止中）。
+    按 discovery.k8s.io/v1 约定，conditions.ready 为空时视为就绪。
+    """
+    port = SERVICE_PORT
+    for p in es.ports or []:
+        if p.port and (p.name in (None, "", "http")):
+            port = p.port
+            break
+    addresses: List[str] = []
+    for ep in es.endpoints or []:
+        cond = ep.conditions
+        if cond is not None and (cond.ready is False or cond.terminating):
+            continue
+        for ip in ep.addresses or []:
+            addresses.append(f"{ip}:{port}")
+    return addresses
+
+
+def _endpoint_slice_service(es: Any) -> Optional[str]:
+    svc_name = (es.metadata.labels or {}).get(SERVICE_NAME_LABEL)
+    if svc_name and svc_name.startswith("fn-") and svc_name.endswith("-svc"):
+        return svc_name
+    return None
+
+
+def _on_endpoint_slice_list(items: List[Any]) -> None:
+    slices: Dict[str, Dict[str, List[str]]] = {}
+    for es in items:
+        svc_name = _endpoint_slice_service(es)
+        if svc_name is not None:
+            slices.setdefault(svc_name, {})[es.metadata.name] = _endpoint_slice_addresses(es)
+    _balancer.replace(slices)
+    _outliers.retain(_balancer.addresses())
+    for svc_name in slices:
+        if _balancer.ready_count(svc_name) > 0:
+            _wake_ready_waiters(_deployment_name_from_service(svc_name))
+
+
+def _on_endpoint_slice_event(event_type: str, es: Any) -> None:
+    svc_name = _endpoint_slice_service(es)
+    if svc_name is None:
+        return
+    if event_type == "DELETED":
+        # 不可用的端点立即摘除，不等 Deployment 状态更新
+        _balancer.delete_slice(svc_name, es.metadata.name)
+        _outliers.retain(_balancer.addresses())
+        return
+    _balancer.update_slice(svc_name, es.metadata.name, _endpoint_slice_addresses(es))
+    _outliers.retain(_balancer.addresses())
+    if _balancer.ready_count(svc_name) > 0:
+        # Pod 进入 Endpoint 即可接流量，比 Deployment 状态更新更早唤醒冷启动等待者
+        _wake_ready_waiters(_deployment_name_from_service(svc_name))
+
+
+def _clear_endpoints() -> None:
+    # EndpointSlice watch 断开：宁可回退到 Service DNS，也不向可能已消失的 Pod 转发
+    _balancer.replace({})
+
+
+async def _watch_loop(
+    kind: str,
+    list_func: Callable[..., Any],
+    list_kwargs: Dict[str, Any],
+    on_list: Callable[[List[Any]], None],
+    on_event: Callable[[str, Any], None],
+    on_stale: Optional[Callable[[], None]] = None,
+) -> None:
+    """
+    后台任务：通用 list + watch 循环，直接在事件循环中更新各缓存。
+    """
+    while True:
+        try:
+            listed = await list_func(**list_kwargs)
+            on_list(_list_items(listed))
+            resource_version = _resource_version(listed)
+
+            while True:
+                async with watch.Watch().stream(
+                    list_func,
+                    resource_version=resource_version,
+                    timeout_seconds=WATCH_TIMEOUT_SECONDS,
+                    **list_kwargs,
+                ) as stream:
+                    async for event in stream:
+                        obj = event["object"]
+                        resource_version = _resource_version(obj)
+                        on_event(event["type"], obj)
+        except asyncio.CancelledError:
+            raise
+        except ApiException as e:
+            # 410 Gone：resourceVersion 过旧，需要重新 list
+            if e.status != 410:
+                print(f"{kind} watch 异常，{WATCH_RETRY_SECONDS}s 后重试: {e}")
+                if on_stale is not None:
+                    on_stale()
+                await asyncio.sleep(WATCH_RETRY_SECONDS)
+        except Exception as e:
+            print(f"{kind} watch 异常，{WATCH_RETRY_SECONDS}s 后重试: {e}")
+            if on_stale is not None:
+                on_stale()
+            await asyncio.sleep(WATCH_RETRY_SECONDS)
+
+
+def _list_items(listed: Any) -> List[Any]:
+    # CustomObjectsApi 返回的是 dict，内置资源返回模型对象
+    if isinstance(listed, dict):
+        return listed.get("items") or []
+    return listed.items
+
+
+def _resource_version(obj: Any) -> str:
+    if isinstance(obj, dict):
+        return obj["metadata"]["resourceVersion"]
+    return obj.metadata.resource_version
+
+
+def _start_watches() -> None:
+    assert apps_v1_api is not None and discovery_v1_api is not None
+    assert custom_objects_api is not None
+    _background_tasks.append(
+        asyncio.ensure_future(
+            _watch_loop(
+                "Function",
+                custom_objects_api.list_namespaced_custom_object,
+                {
+                    "group": CRD_GROUP,
+                    "version": CRD_VERSION,
+                    "namespace": NAMESPACE,
+                    "plural": CRD_PLURAL,
+                },
+                _on_function_list,
+                _on_function_event,
+                _mark_functions_stale,
+            )
+        )
+    )
+    _background_tasks.append(
+        asyncio.ensure_future(
+            _watch_loop(
+                "Deployment",
+                apps_v1_api.list_namespaced_deployment,
+                {"namespace": NAMESPACE, "label_selector": FUNCTION_LABEL_SELECTOR},
+                _on_deployment_list,
+                _on_deployment_event,
+                _mark_ready_cache_stale,
+            )
+        )
+    )
+    if LB_POLICY != "service":
+        _background_tasks.append(
+            asyncio.ensure_future(
+                _watch_loop(
+                    "EndpointSlice",
+                    discovery_v1_api.list_namespaced_endpoint_slice,
+                    {"namespace": NAMESPACE, "label_selector": SERVICE_NAME_LABEL},
+                    _on_endpoint_slice_list,
+                    _on_endpoint_slice_event,
+                    _clear_endpoints,
+                )
+            )
+        )
+
+
+def _parse_bool(value: str) -> bool:
+    return value.lower() in ("1", "true", "yes")
+
+
+def _annotation_value(
+    annotations: Dict[str, str],
+    key: str,
+    default: Any,
+    cast: Callable[[str], Any],
+) -> Any:
+    value = annotations.get(ANNOTATION_PREFIX + key)
+    if not value:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        return default
+
+
+def _function_setting(fn_name: str, key: str, default: Any, cast: Callable[[str], Any] = int) -> Any:
+    """
+    读取 watch 缓存中的函数级配置，未知函数或缺少注解时返回默认值。
+    """
+    annotations = _function_annotations.get(_deployment_name_from_function(fn_name), {})
+    return _annotation_value(annotations, key, default, cast)
+
+
+def _metrics_for(fn_name: str) -> FunctionMetrics:
+    """
+    取函数的指标 child；只为 watch 中已知的函数建立独立标签，其余名字归入 __unknown__。
+    """
+    key = fn_name.lower()
+    metrics = _function_metrics.get(key)
+    if metrics is None:
+        known = key in _known_functions or _deployment_name_from_function(key) in _function_annotations
+        if not known:
+            key = UNKNOWN_FUNCTION
+            metrics = _function_metrics.get(key)
+        if metrics is None:
+            metrics = FunctionMetrics(key)
+            _function_metrics[key] = metrics
+    return metrics
+
+
+def _cached_ready_replicas(fn_name: str) -> int:
+    """
+    从 watch 缓存读取就绪副本数（Deployment 状态与 EndpointSlice 取较大者）；
+    缓存未同步或未知函数返回 0，交给慢路径处理。
+    """
+    ready = _balancer.ready_count(_service_name_from_function(fn_name))
+    if _ready_cache_synced:
+        ready = max(ready, _ready_replicas.get(_deployment_name_from_function(fn_name), 0))
+    return ready
+
+
+async def _read_function_deployment(fn_name: str) -> client.V1Deployment:
+    assert apps_v1_api is not None and _kube_api_semaphore is not None
     deploy_name = _deployment_name_from_function(fn_name)
     try:
-        dep = await asyncio.to_thread(
-            apps_v1_api.read_namespaced_deployment,
-            name=deploy_name,
-            namespace=NAMESPACE,
-        )
+        async with _kube_api_semaphore:
+            return await apps_v1_api.read_namespaced_deployment(
+                name=deploy_name,
+                namespace=NAMESPACE,
+            )
     except ApiException as e:
         if e.status == 404:
             raise HTTPException(status_code=404, detail=f"Function {fn_name} 不存在 Deployment")
         raise HTTPException(status_code=502, detail=f"查询 Deployment 失败: {e}")
 
+
+async def _get_deployment_ready_replicas(fn_name: str) -> int:
+    dep = await _read_function_deployment(fn_name)
     status = dep.status
     return int(status.ready_replicas or 0)
 
 
-async def _scale_deployment_to_one(fn_name: str) -> None:
+def _initial_replicas(demand: int, annotations: Dict[str, str]) -> int:
+    """
+    按排队请求数与单 Pod 目标并发计算冷启动副本数：ceil(demand / target)，
+    至少 1，至多 spec.maxReplicas。缺少注解（旧版控制面）时退化为 1。
+    """
+    target = _annotation_value(annotations, "target-concurrency", DEFAULT_TARGET_CONCURRENCY, int)
+    max_replicas = _annotation_value(annotations, "max-replicas", 1, int)
+    wanted = -(-demand // max(target, 1))
+    return max(1, min(wanted, max_replicas))
+
+
+async def _scale_deployment(fn_name: str, replicas: int) -> None:
     """
-    将 Deployment 的 replicas 从 0 调整到 1。
+    将 Deployment 的 replicas 调整为指定值。
     """
-    assert apps_v1_api is not None
+    assert apps_v1_api is not None and _kube_api_semaphore is not None
     deploy_name = _deployment_name_from_function(fn_name)
 
     # 使用 scale 子资源，避免完整 patch 出错
-    scale_body = {"spec": {"replicas": 1}}
+    scale_body = {"spec": {"replicas": replicas}}
 
     try:
-        await asyncio.to_thread(
-            apps_v1_api.patch_namespaced_deployment_scale,
-            name=deploy_name,
-            namespace=NAMESPACE,
-            body=scale_body,
-        )
+        async with _kube_api_semaphore:
+            await apps_v1_api.patch_namespaced_deployment_scale(
+                name=deploy_name,
+                namespace=NAMESPACE,
+                body=scale_body,
+            )
     except ApiException as e:
         if e.status == 404:
             raise HTTPException(status_code=404, detail=f"Function {fn_name} 不存在 Deployment")
@@ -105,91 +853,1896 @@ async def _scale_deployment_to_one(fn_name: str) -> None:
 
 async def _wait_for_pod_ready(fn_name: str) -> None:
     """
-    轮询 Deployment 状态直到 ready_replicas >= 1 或超时。
+    等待 ready_replicas >= 1，超过函数的冷启动超时返回 504。
+    """
+    timeout = _cold_start_timeout(fn_name)
+    if not await _wait_until_ready(fn_name, timeout):
+        raise HTTPException(
+            status_code=504,
+            detail=f"等待 Function {fn_name} Pod 就绪超时 ({timeout}s)",
+        )
+
+
+async def _wait_until_ready(fn_name: str, timeout: float) -> bool:
+    """
+    等待 ready_replicas >= 1，超时返回 False。
+    watch 正常时挂在 asyncio.Event 上，由 watch 事件即时唤醒；
+    watch 断开期间回退为按 FAAS_POLL_INTERVAL 轮询 API Server。
     """
-    total = 0.0
-    while total < POLL_TIMEOUT_SECONDS:
+    loop = asyncio.get_running_loop()
+    deploy_name = _deployment_name_from_function(fn_name)
+    deadline = loop.time() + timeout
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+
+        if _ready_cache_synced:
+            if deploy_name not in _ready_replicas:
+                raise HTTPException(status_code=404, detail=f"Function {fn_name} 不存在 Deployment")
+            if _cached_ready_replicas(fn_name) > 0:
+                return True
+            event = _ready_waiters.get(deploy_name)
+            if event is None:
+                event = asyncio.Event()
+                _ready_waiters[deploy_name] = event
+            try:
+                await asyncio.wait_for(event.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+            # 被唤醒后回到循环开头重新判断：可能已就绪、已删除或 watch 已断开
+            continue
+
         ready = await _get_deployment_ready_replicas(fn_name)
         if ready >= 1:
-            return
-        await asyncio.sleep(POLL_INTERVAL_SECONDS)
-        total += POLL_INTERVAL_SECONDS
-    raise HTTPException(
-        status_code=504,
-        detail=f"等待 Function {fn_name} Pod 就绪超时 ({POLL_TIMEOUT_SECONDS}s)",
-    )
+            return True
+        await asyncio.sleep(min(POLL_INTERVAL_SECONDS, remaining))
+    return False
 
 
-async def _ensure_scaled(fn_name: str) -> None:
+async def _activate(fn_name: str) -> Activation:
     """
-    Scale-to-Zero 核心逻辑，配合内存锁避免并发重复扩容。
+    由激活队列的唤醒任务执行：拿到扩缩容租约的网关负责扩容，其余网关只等待结果。
     """
-    lock = await _get_or_create_lock(fn_name)
-    async with lock:
-        # 双重检查，避免已经有其他请求扩容成功
-        ready = await _get_deployment_ready_replicas(fn_name)
-        if ready > 0:
-            return
+    key = fn_name.lower()
+    started = time.perf_counter()
+    while not await _try_acquire_scale_lease(key):
+        if await _follow_activation(fn_name, started):
+            # 由其他网关拉起的副本同样适用缩容稳定窗口
+            _last_scale_up[key] = time.monotonic()
+            return Activation(cold_start=True, ready_seconds=time.perf_counter() - started)
 
-        # 副本为 0 -> 先扩容到 1
-        await _scale_deployment_to_one(fn_name)
-        # 再等待就绪
-        await _wait_for_pod_ready(fn_name)
+    renewer = asyncio.ensure_future(_scale_coordinator.keep_alive(key))
+    try:
+        return await _drive_activation(fn_name)
+    finally:
+        renewer.cancel()
+        await _scale_coordinator.release(key)
 
 
-async def _proxy_to_function_service(
+async def _try_acquire_scale_lease(fn_name: str) -> bool:
+    try:
+        return await _scale_coordinator.try_acquire(fn_name)
+    except ApiException as e:
+        # 协调后端不可用时退化为各实例独立扩容，扩容本身是幂等的
+        print(f"获取 Function {fn_name} 扩缩容租约失败，直接扩容: {e.status} {e.reason}")
+        return True
+
+
+async def _follow_activation(fn_name: str, started: float) -> bool:
+    """
+    其他网关持有租约时通过 watch 等待就绪，最多等一个租约周期后重新尝试抢占
+    （持有者崩溃时租约过期即可接管）。返回 True 表示已就绪。
+    """
+    timeout = _cold_start_timeout(fn_name)
+    remaining = timeout - (time.perf_counter() - started)
+    if remaining <= 0:
+        raise HTTPException(
+            status_code=504,
+            detail=f"等待 Function {fn_name} Pod 就绪超时 ({timeout}s)",
+        )
+    if not await _wait_until_ready(fn_name, min(SCALE_LEASE_SECONDS, remaining)):
+        return False
+    key = fn_name.lower()
+    if key in _draining:
+        # 本实例刚下发过缩容，已就绪的可能只是正在退出的旧 Pod，需确认期望副本已被拉起
+        dep = await _read_function_deployment(fn_name)
+        if int(dep.spec.replicas or 0) <= 0:
+            await asyncio.sleep(POLL_INTERVAL_SECONDS)
+            return False
+        _draining.discard(key)
+    return True
+
+
+async def _drive_activation(fn_name: str) -> Activation:
+    """
+    拿到全局冷启动名额后，确认副本为 0 再扩容并等待就绪，返回各阶段耗时。
+    """
+    key = fn_name.lower()
+    # 双重检查，避免已经有其他请求扩容成功；期望副本为 0 时已就绪的只是正在退出的旧 Pod
+    dep = await _read_function_deployment(fn_name)
+    if int(dep.status.ready_replicas or 0) > 0 and int(dep.spec.replicas or 0) > 0:
+        _draining.discard(key)
+        return Activation()
+
+    metrics = _metrics_for(fn_name)
+    admit_seconds = await _cold_start_governor.acquire(key)
+    try:
+        if admit_seconds > 0:
+            metrics.admit_seconds.observe(admit_seconds)
+            # 排队期间可能已被其他网关拉起，重新确认
+            dep = await _read_function_deployment(fn_name)
+            if int(dep.status.ready_replicas or 0) > 0 and int(dep.spec.replicas or 0) > 0:
+                _draining.discard(key)
+                return Activation(admit_seconds=admit_seconds)
+
+        # 副本为 0 -> 按排队请求数扩到 N；只向上调整，不打断已在进行的扩容
+        demand = _activator.depth(key)
+        annotations = dep.metadata.annotations or {}
+        replicas = _initial_replicas(demand, annotations)
+        started = time.perf_counter()
+        activation = Activation(
+            cold_start=int(dep.spec.replicas or 0) < replicas,
+            admit_seconds=admit_seconds,
+        )
+        if activation.cold_start:
+            print(f"Function {fn_name} 冷启动：排队 {demand} 个请求，扩容到 {replicas} 副本")
+            await _scale_deployment(fn_name, replicas)
+            _last_scale_up[key] = time.monotonic()
+            activation.scale_seconds = time.perf_counter() - started
+            metrics.cold_starts.inc()
+            metrics.scale_seconds.observe(activation.scale_seconds)
+        _draining.discard(key)
+        # 再等待就绪（Pod 调度与 readinessProbe 都算在 ready 阶段），期间排队继续增长时追加扩容
+        ready_started = time.perf_counter()
+        await _wait_ready_scaling_up(fn_name, annotations, max(replicas, int(dep.spec.replicas or 0)))
+        now = time.perf_counter()
+        activation.ready_seconds = now - ready_started
+        metrics.ready_seconds.observe(activation.ready_seconds)
+        if activation.cold_start:
+            metrics.cold_start_seconds.observe(now - started)
+        return activation
+    finally:
+        _cold_start_governor.release(key)
+
+
+async def _wait_ready_scaling_up(fn_name: str, annotations: Dict[str, str], replicas: int) -> None:
+    """
+    等待首个 Pod 就绪；每隔 FAAS_COLD_START_RESCALE_INTERVAL 按当前激活队列深度重算
+    ceil(depth / targetConcurrency)，超过已下发的副本数时再次扩容（只向上，至多 maxReplicas）。
+    突发请求在扩容下发后仍持续到达时，不会全部压到按最初几个请求算出的副本上。
+    """
+    key = fn_name.lower()
+    ready = asyncio.ensure_future(_wait_for_pod_ready(fn_name))
+    try:
+        while True:
+            done, _ = await asyncio.wait({ready}, timeout=COLD_START_RESCALE_INTERVAL_SECONDS)
+            if done:
+                ready.result()
+                return
+            demand = _activator.depth(key)
+            wanted = _initial_replicas(demand, annotations)
+            if wanted <= replicas:
+                continue
+            print(f"Function {fn_name} 冷启动中排队增至 {demand} 个请求，扩容到 {wanted} 副本")
+            try:
+                await _scale_deployment(fn_name, wanted)
+            except HTTPException as e:
+                # 追加扩容失败不影响已下发的副本继续就绪
+                print(f"Function {fn_name} 追加扩容失败: {e.detail}")
+                continue
+            replicas = wanted
+            _last_scale_up[key] = time.monotonic()
+    finally:
+        if not ready.done():
+            ready.cancel()
+
+
+async def _ensure_scaled(
     fn_name: str,
-    request: Request,
-) -> Response:
+    timing: Optional[ServerTiming] = None,
+    deadline: Optional[float] = None,
+) -> None:
     """
-    使用 httpx 反向代理到对应 Service。
+    Scale-to-Zero 核心逻辑。
+    热路径：watch 缓存显示已有就绪副本时直接返回，不排队、不访问 API Server；
+    否则进入该函数的激活队列，由唯一的唤醒任务扩容，就绪后按 FIFO 放行。
+    排队时长受函数冷启动超时与调用方截止时间（deadline，monotonic）共同限制。
     """
-    svc_name = _service_name_from_function(fn_name)
-    # 在集群内部通过 Service DNS 访问
-    target_url = f"http://{svc_name}.{NAMESPACE}.svc.cluster.local:{SERVICE_PORT}{request.url.path}"
+    if _cached_ready_replicas(fn_name) > 0 and fn_name.lower() not in _draining:
+        return
 
-    # 保留查询参数
-    if request.url.query:
-        target_url += f"?{request.url.query}"
+    max_wait = _function_setting(
+        fn_name, "cold-start-timeout-seconds", ACTIVATION_MAX_WAIT_SECONDS, float
+    )
+    remaining = _remaining_seconds(deadline)
+    if remaining is not None and remaining < max_wait:
+        if remaining <= 0:
+            raise HTTPException(status_code=504, detail=f"已超过调用方截止时间，未唤醒 Function {fn_name}")
+        max_wait = remaining
 
-    # 复制请求头（去掉 host，交给 httpx/内核重写）
-    headers = dict(request.headers)
-    headers.pop("host", None)
+    started = time.perf_counter()
+    activation = None
+    try:
+        activation = await _activator.wait(
+            fn_name.lower(),
+            lambda: _activate(fn_name),
+            timeout=max_wait,
+        )
+        _metrics_for(fn_name).queue_seconds.observe(time.perf_counter() - started)
+    except ActivationQueueFull:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Function {fn_name} 冷启动排队已满 ({ACTIVATION_MAX_DEPTH})，请稍后重试",
+            headers={"Retry-After": str(ACTIVATION_RETRY_AFTER_SECONDS)},
+        )
+    except ActivationTimeout:
+        if _cold_start_governor.is_waiting(fn_name.lower()):
+            # 还在等全局冷启动名额，唤醒不会因本请求离开而中止，稍后重试即可命中热路径
+            raise HTTPException(
+                status_code=503,
+                detail=f"Function {fn_name} 正在等待冷启动名额（并发上限 {COLD_START_MAX_CONCURRENCY}），请稍后重试",
+                headers={"Retry-After": str(ACTIVATION_RETRY_AFTER_SECONDS)},
+            )
+        raise HTTPException(
+            status_code=504,
+            detail=f"Function {fn_name} 冷启动排队超时 ({max_wait:.3g}s)",
+        )
+    finally:
+        if timing is not None:
+            timing.add_activation(time.perf_counter() - started, activation)
 
-    # 读取 body（FastAPI 的 Request 是 async 的）
-    body = await request.body()
 
-    timeout = httpx.Timeout(10.0, connect=5.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
+async def _scale_idle_functions() -> None:
+    """
+    把空闲超过窗口的函数缩容到 0：
+    - minReplicas > 0 或缺少注解（无法确认 minReplicas）的函数不处理；
+    - 有在途请求或激活排队的函数不处理；
+    - 最近一次扩容后的稳定窗口内不处理，避免刚拉起就被缩掉。
+    """
+    if not _ready_cache_synced:
+        return
+    await _publish_activity()
+    now = time.monotonic()
+    for deploy_name, ready in list(_ready_replicas.items()):
+        fn_name = _function_name_from_deployment(deploy_name)
+        if ready <= 0 or fn_name in _draining:
+            continue
+        annotations = _function_annotations.get(deploy_name, {})
+        if _annotation_value(annotations, "min-replicas", 1, int) > 0:
+            continue
+        idle_after = _annotation_value(
+            annotations, "scale-to-zero-after", SCALE_TO_ZERO_AFTER_SECONDS, float
+        )
+        if idle_after <= 0:
+            continue
+        # 网关启动前就已在运行的函数，从首次观察到的时刻开始计时
+        _last_invocation.setdefault(fn_name, now)
+        if _local_idle_seconds(fn_name, idle_after) is None:
+            continue
+        scaled_up_at = _last_scale_up.get(fn_name)
+        if scaled_up_at is not None and now - scaled_up_at < SCALE_TO_ZERO_STABILIZATION_SECONDS:
+            continue
+        # 本实例空闲不代表其他网关实例也没有流量
         try:
-            resp = await client.request(
-                method=request.method,
-                url=target_url,
-                content=body,
-                headers=headers,
-            )
-        except httpx.HTTPError as e:
-            raise HTTPException(status_code=502, detail=f"调用后端 Service 失败: {e}")
+            shared = await _scale_coordinator.last_active(fn_name)
+        except ApiException as e:
+            print(f"读取 Function {fn_name} 最近活跃时间失败，暂不缩容: {e.status} {e.reason}")
+            continue
+        if shared is not None and time.time() - shared < idle_after:
+            continue
 
-    # 将下游响应返回给调用方
-    return Response(
-        content=resp.content,
-        status_code=resp.status_code,
-        headers=dict(resp.headers),
-        media_type=resp.headers.get("content-type"),
-    )
+        # 其他网关正在唤醒该函数时不与之竞争
+        if not await _try_acquire_scale_lease(fn_name):
+            continue
+        # 读取活跃时间与抢租约期间可能有新请求到达，持有租约后重新确认，
+        # 确认与标记 draining 之间没有 await，之后到达的请求会走激活流程
+        idle = _local_idle_seconds(fn_name, idle_after)
+        if idle is None:
+            await _scale_coordinator.release(fn_name)
+            continue
+        _draining.add(fn_name)
+        try:
+            await _scale_deployment(fn_name, 0)
+        except HTTPException as e:
+            _draining.discard(fn_name)
+            print(f"Function {fn_name} 缩容到 0 失败: {e.detail}")
+            continue
+        finally:
+            await _scale_coordinator.release(fn_name)
+        print(f"Function {fn_name} 已空闲 {int(idle)}s，缩容到 0")
 
 
-@app.api_route("/invoke/{function_name}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
-async def invoke_function(function_name: str, request: Request):
+def _local_idle_seconds(fn_name: str, idle_after: float) -> Optional[float]:
     """
-    FaaS 网关入口：
-    1. 检查 Deployment 的 ready_replicas；
-    2. 若为 0，触发 Scale-to-One 并等待 Pod 就绪；
-    3. 将请求代理到对应 Service。
+    本实例上函数已空闲的秒数；有在途请求、激活排队或空闲未满 idle_after 时返回 None。
+    """
+    if _inflight_requests.get(fn_name, 0) > 0 or _activator.depth(fn_name) > 0:
+        return None
+    last = _last_invocation.get(fn_name)
+    if last is None:
+        return None
+    idle = time.monotonic() - last
+    return idle if idle >= idle_after else None
+
+
+async def _publish_activity() -> None:
+    """
+    把本实例上有新调用或仍有在途请求的函数的最近活跃时间写入协调后端，供所有网关的空闲缩容参考。
+    """
+    now = time.monotonic()
+    wall_now = time.time()
+    for fn_name, last in list(_last_invocation.items()):
+        if _inflight_requests.get(fn_name, 0) > 0 or _activator.depth(fn_name) > 0:
+            # 长请求期间同样算作活跃
+            last = now
+        elif _published_activity.get(fn_name) == last:
+            continue
+        try:
+            await _scale_coordinator.touch(fn_name, wall_now - (now - last))
+        except ApiException as e:
+            print(f"写入 Function {fn_name} 最近活跃时间失败: {e.status} {e.reason}")
+            continue
+        _published_activity[fn_name] = last
+
+
+async def _scale_to_zero_loop() -> None:
+    while True:
+        await asyncio.sleep(SCALE_TO_ZERO_INTERVAL_SECONDS)
+        try:
+            await _scale_idle_functions()
+        except Exception as e:
+            print(f"空闲缩容检查失败: {e}")
+
+
+def _record_arrival(fn_name: str) -> None:
+    """
+    记录一次到达供预热预测；预热后的第一个请求在这里结算预热效果。
+    """
+    if not PREWARM_ENABLED:
+        return
+    # 与指标一致，只为已知函数建立历史，任意 URL 不会撑大内存
+    if fn_name not in _known_functions and _deployment_name_from_function(fn_name) not in _function_annotations:
+        return
+    now = time.time()
+    _prewarmer.record(fn_name, now)
+    warm = _cached_ready_replicas(fn_name) > 0 and fn_name not in _draining
+    _prewarmer.on_arrival(fn_name, now, warm)
+
+
+async def _prewarm_functions() -> None:
+    """
+    把预计 FAAS_PREWARM_LEAD 秒后有流量、当前副本为 0 的函数提前扩到 1 个副本：
+    - 只处理 minReplicas == 0 且会被缩容到 0 的函数；
+    - 已有就绪副本或正在冷启动排队的函数不处理；
+    - 与冷启动、空闲缩容共用扩缩容租约，并再次确认期望副本为 0，不会打断其他扩缩容。
+    """
+    if not _ready_cache_synced:
+        return
+    for fn_name, forecast in _prewarmer.due(time.time(), PREWARM_LEAD_SECONDS):
+        annotations = _function_annotations.get(_deployment_name_from_function(fn_name))
+        if annotations is None or _annotation_value(annotations, "min-replicas", 1, int) > 0:
+            continue
+        if _annotation_value(annotations, "scale-to-zero-after", SCALE_TO_ZERO_AFTER_SECONDS, float) <= 0:
+            continue
+        if _cached_ready_replicas(fn_name) > 0 or _activator.depth(fn_name) > 0:
+            continue
+        # 冷启动名额紧张时让路给有请求在等的函数
+        if _cold_start_governor.saturated():
+            return
+
+        if not await _try_acquire_scale_lease(fn_name):
+            continue
+        try:
+            dep = await _read_function_deployment(fn_name)
+            if int(dep.spec.replicas or 0) > 0:
+                continue
+            await _scale_deployment(fn_name, 1)
+        except HTTPException as e:
+            print(f"Function {fn_name} 预热失败: {e.detail}")
+            continue
+        finally:
+            await _scale_coordinator.release(fn_name)
+
+        now = time.monotonic()
+        _draining.discard(fn_name)
+        _last_scale_up[fn_name] = now
+        # 预热视同一次调用，副本至少保留 scaleToZeroAfter 窗口等待预计的流量
+        _last_invocation[fn_name] = now
+        _prewarmer.started(fn_name, time.time())
+        print(
+            f"Function {fn_name} 预计 {int(PREWARM_LEAD_SECONDS)}s 后每 "
+            f"{int(PREWARM_BUCKET_SECONDS)}s 约 {forecast:.1f} 次调用，预热 1 个副本"
+        )
+
+
+async def _load_prewarm_state() -> None:
+    if not PREWARM_STATE_PATH:
+        return
+
+    def load() -> Optional[Dict[str, Any]]:
+        try:
+            with open(PREWARM_STATE_PATH, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    try:
+        data = await asyncio.get_running_loop().run_in_executor(None, load)
+    except (OSError, ValueError) as e:
+        print(f"读取预热历史失败，从空历史开始: {e}")
+        return
+    if data is not None:
+        _prewarmer.restore(data)
+
+
+async def _save_prewarm_state() -> None:
+    if not PREWARM_STATE_PATH:
+        return
+    data = _prewarmer.snapshot()
+
+    def save() -> None:
+        # 先写临时文件再替换，进程中途退出也不会留下半个文件
+        tmp_path = f"{PREWARM_STATE_PATH}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, PREWARM_STATE_PATH)
+
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, save)
+    except OSError as e:
+        print(f"保存预热历史失败: {e}")
+
+
+async def _prewarm_loop() -> None:
+    while True:
+        await asyncio.sleep(PREWARM_INTERVAL_SECONDS)
+        try:
+            await _prewarm_functions()
+            await _save_prewarm_state()
+        except Exception as e:
+            print(f"预热检查失败: {e}")
+
+
+def _begin_invocation(fn_name: str) -> None:
+    _inflight_requests[fn_name] = _inflight_requests.get(fn_name, 0) + 1
+    _last_invocation[fn_name] = time.monotonic()
+
+
+def _end_invocation(
+    fn_name: str,
+    limiter: Optional[AdaptiveLimiter] = None,
+    scheduled: bool = False,
+) -> None:
+    count = _inflight_requests.get(fn_name, 0) - 1
+    if count > 0:
+        _inflight_requests[fn_name] = count
+    else:
+        _inflight_requests.pop(fn_name, None)
+    _last_invocation[fn_name] = time.monotonic()
+    if limiter is not None:
+        limiter.release()
+    if scheduled:
+        _release_upstream_slot()
+
+
+async def _track_stream(
+    body: AsyncIterator[bytes],
+    fn_name: str,
+    limiter: Optional[AdaptiveLimiter] = None,
+    scheduled: bool = False,
+) -> AsyncIterator[bytes]:
+    # 流式响应在 handler 返回后才真正发送，结束时再计为调用完成
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        await body.aclose()
+        _end_invocation(fn_name, limiter, scheduled)
+
+
+def _limiter_for(fn_name: str) -> Optional[AdaptiveLimiter]:
+    if not CONCURRENCY_LIMIT_ENABLED:
+        return None
+    limiter = _limiters.get(fn_name)
+    if limiter is None:
+        limiter = AdaptiveLimiter(
+            initial_limit=CONCURRENCY_INITIAL_LIMIT,
+            min_limit=CONCURRENCY_MIN_LIMIT,
+            max_limit=CONCURRENCY_MAX_LIMIT,
+            max_inflight=FUNCTION_MAX_INFLIGHT,
+            tolerance=CONCURRENCY_LATENCY_TOLERANCE,
+            slack=CONCURRENCY_LATENCY_SLACK_SECONDS,
+        )
+        _limiters[fn_name] = limiter
+    return limiter
+
+
+def _caller_identity(request: Request) -> str:
+    """
+    限流用的调用方标识：API Key 请求头（只保留哈希，不在内存与共享后端中存明文），否则为客户端 IP。
+    """
+    api_key = request.headers.get(CALLER_ID_HEADER)
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    if TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return "ip:" + forwarded.split(",")[0].strip()
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+async def _enforce_rate_limits(fn_name: str, request: Request, cost: int = 1) -> None:
     """
-    # 1. 如有必要，触发冷启动唤醒
-    await _ensure_scaled(function_name)
+    按函数的 spec.rateLimit 检查令牌桶：先查单个调用方的限额，再查函数的总限额，
+    超出时返回 429 与 Retry-After。cost 为本次消耗的调用数（批量调用为事件数）。
+    被函数总限额拒绝时退还已扣的调用方令牌，被拒绝的请求不占用调用方的额度。
+    """
+    limits = []
+    caller_rate = _function_setting(fn_name, "caller-rate-limit", 0.0, float)
+    if caller_rate > 0:
+        burst = _function_setting(fn_name, "caller-rate-limit-burst", max(1.0, caller_rate), float)
+        limits.append((f"{fn_name}|{_caller_identity(request)}", caller_rate, burst, "调用方"))
+    rate = _function_setting(fn_name, "rate-limit", 0.0, float)
+    if rate > 0:
+        burst = _function_setting(fn_name, "rate-limit-burst", max(1.0, rate), float)
+        limits.append((fn_name, rate, burst, "函数"))
+
+    for key, rate, burst, scope in limits:
+        if cost > burst:
+            _rate_limited[fn_name] = _rate_limited.get(fn_name, 0) + cost
+            raise HTTPException(
+                status_code=429,
+                detail=f"单次 {cost} 个调用超过 Function {fn_name} 的{scope}突发上限 ({burst:g})",
+            )
+    charged = []
+    for key, rate, burst, scope in limits:
+        wait = await _rate_limiter.try_acquire(key, rate, burst, cost)
+        if wait > 0:
+            for charged_key, charged_rate, charged_burst in charged:
+                await _rate_limiter.refund(charged_key, charged_rate, charged_burst, cost)
+            _rate_limited[fn_name] = _rate_limited.get(fn_name, 0) + cost
+            raise HTTPException(
+                status_code=429,
+                detail=f"超过 Function {fn_name} 的{scope}调用速率限制 ({rate:g}/s)",
+                headers={"Retry-After": str(max(1, math.ceil(wait)))},
+            )
+        charged.append((key, rate, burst))
 
-    # 2. 反向代理到 Service
-    return await _proxy_to_function_service(function_name, request)
\ No newline at end of file
+
+def _request_priority(fn_name: str, request: Request) -> int:
+    """
+    请求的优先级类别：函数的 spec.priorityClass，X-FaaS-Priority 只能把单个请求调低。
+    """
+    level = PRIORITY_CLASSES.get(
+        _function_setting(fn_name, "priority-class", DEFAULT_PRIORITY_CLASS, str),
+        PRIORITY_CLASSES[DEFAULT_PRIORITY_CLASS],
+    )
+    value = request.headers.get(PRIORITY_HEADER)
+    if value is not None:
+        requested = PRIORITY_CLASSES.get(value.strip().lower())
+        if requested is None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"{PRIORITY_HEADER} 必须是 {' / '.join(PRIORITY_CLASSES)} 之一",
+            )
+        level = max(level, requested)
+    return level
+
+
+async def _acquire_upstream_slot(
+    fn_name: str,
+    priority: int,
+    deadline: Optional[float] = None,
+    timing: Optional[ServerTiming] = None,
+) -> bool:
+    """
+    申请网关全局的上游名额，未开启调度时返回 False；返回 True 时调用方负责 _release_upstream_slot。
+    排队时长受 FAAS_SCHEDULER_MAX_WAIT 与调用方截止时间共同限制。
+    """
+    if _scheduler is None:
+        return False
+    max_wait = SCHEDULER_MAX_WAIT_SECONDS
+    remaining = _remaining_seconds(deadline)
+    if remaining is not None:
+        max_wait = min(max_wait, max(remaining, 0.0))
+    weight = max(_function_setting(fn_name, "weight", 1.0, float), 0.001)
+    try:
+        waited = await _scheduler.acquire(fn_name, weight, priority, timeout=max_wait)
+    except SchedulerQueueFull:
+        raise HTTPException(
+            status_code=503,
+            detail=f"网关繁忙，Function {fn_name} 排队已满，请稍后重试",
+            headers={"Retry-After": str(SHED_RETRY_AFTER_SECONDS)},
+        )
+    except SchedulerTimeout:
+        if remaining is not None and remaining <= SCHEDULER_MAX_WAIT_SECONDS:
+            raise HTTPException(status_code=504, detail=f"网关繁忙，Function {fn_name} 排队超过调用方截止时间")
+        raise HTTPException(
+            status_code=503,
+            detail=f"网关繁忙，Function {fn_name} 排队超时 ({SCHEDULER_MAX_WAIT_SECONDS}s)",
+            headers={"Retry-After": str(SHED_RETRY_AFTER_SECONDS)},
+        )
+    if waited > 0:
+        _metrics_for(fn_name).schedule_seconds.observe(waited)
+        if timing is not None:
+            timing.add("schedule", waited)
+    return True
+
+
+def _release_upstream_slot() -> None:
+    if _scheduler is not None:
+        _scheduler.release()
+
+
+def _function_timeout(fn_name: str) -> float:
+    """
+    单次上游调用的超时：spec.timeoutSeconds，未设置时为 FAAS_UPSTREAM_TIMEOUT。
+    """
+    return _function_setting(fn_name, "timeout-seconds", UPSTREAM_TIMEOUT_SECONDS, float)
+
+
+def _cold_start_timeout(fn_name: str) -> float:
+    """
+    冷启动等待 Pod 就绪的上限：spec.coldStartTimeoutSeconds，未设置时为 FAAS_POLL_TIMEOUT。
+    """
+    return _function_setting(fn_name, "cold-start-timeout-seconds", POLL_TIMEOUT_SECONDS, float)
+
+
+def _client_deadline(request: Request) -> Optional[float]:
+    """
+    解析客户端的 X-FaaS-Timeout（秒），返回 monotonic 截止时刻；未携带时为 None。
+    """
+    value = request.headers.get(DEADLINE_HEADER)
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = math.nan
+    if not 0 < seconds < math.inf:
+        raise HTTPException(status_code=400, detail=f"{DEADLINE_HEADER} 必须是正数（秒）")
+    return time.monotonic() + seconds
+
+
+def _request_deadline(request: Request) -> Optional[float]:
+    return getattr(request.state, "faas_deadline", None)
+
+
+def _remaining_seconds(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _deadline_passed(request: Request) -> bool:
+    remaining = _remaining_seconds(_request_deadline(request))
+    return remaining is not None and remaining <= 0
+
+
+def _call_budget(fn_name: str, deadline: Optional[float], per_call: float) -> float:
+    """
+    本次上游调用可用的秒数：per_call 与调用方剩余时间取较小者；
+    已过截止时间时直接 504，不再占用函数的 worker。
+    """
+    remaining = _remaining_seconds(deadline)
+    if remaining is None:
+        return per_call
+    if remaining <= 0:
+        raise HTTPException(status_code=504, detail=f"已超过调用方截止时间，未调用 Function {fn_name}")
+    return min(per_call, remaining)
+
+
+def _budget_timeout(budget: float) -> httpx.Timeout:
+    return httpx.Timeout(
+        budget,
+        connect=min(UPSTREAM_CONNECT_TIMEOUT_SECONDS, budget),
+        pool=min(UPSTREAM_POOL_TIMEOUT_SECONDS, budget),
+    )
+
+
+def _with_deadline(headers: List[Tuple[str, str]], budget: float) -> List[Tuple[str, str]]:
+    """
+    用本次调用的预算替换客户端的 X-FaaS-Timeout，Runner 据此拒绝来不及完成的调用。
+    """
+    result = [(k, v) for k, v in headers if k.lower() != DEADLINE_HEADER]
+    result.append((DEADLINE_HEADER, f"{budget:.3f}"))
+    return result
+
+
+def _build_upstream_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=UPSTREAM_MAX_CONNECTIONS,
+        max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+        keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        UPSTREAM_TIMEOUT_SECONDS,
+        connect=UPSTREAM_CONNECT_TIMEOUT_SECONDS,
+        pool=UPSTREAM_POOL_TIMEOUT_SECONDS,
+    )
+    # Runner 由 uvicorn 提供服务，只支持 HTTP/1.1；多路复用改由 keep-alive 连接池承担
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+def _get_upstream_client(fn_name: str) -> httpx.AsyncClient:
+    key = fn_name.lower()
+    upstream = _upstream_clients.get(key)
+    if upstream is None:
+        upstream = _build_upstream_client()
+        _upstream_clients[key] = upstream
+    return upstream
+
+
+def _discard_upstream_client(fn_name: str) -> None:
+    """
+    函数被删除时释放它的连接池。
+    """
+    upstream = _upstream_clients.pop(fn_name.lower(), None)
+    if upstream is not None:
+        asyncio.ensure_future(upstream.aclose())
+
+
+async def _close_upstream_clients() -> None:
+    clients = list(_upstream_clients.values())
+    _upstream_clients.clear()
+    await asyncio.gather(*(c.aclose() for c in clients), return_exceptions=True)
+
+
+def _filter_headers(
+    items: Iterable[Tuple[str, str]],
+    drop: Iterable[str] = (),
+) -> List[Tuple[str, str]]:
+    """
+    去掉逐跳头以及 Connection 头中声明的逐跳字段，drop 为额外需要去掉的头。
+    """
+    items = list(items)
+    excluded = set(HOP_BY_HOP_HEADERS)
+    excluded.update(h.lower() for h in drop)
+    for key, value in items:
+        if key.lower() == "connection":
+            excluded.update(t.strip().lower() for t in value.split(",") if t.strip())
+    return [(k, v) for k, v in items if k.lower() not in excluded]
+
+
+def _append_headers(response: Response, headers: Iterable[Tuple[str, str]]) -> Response:
+    """
+    把上游响应头逐个追加到 response 上：Set-Cookie 等可重复的头经 dict 合并会只剩最后一个。
+    上游带了的头（如 content-type）以上游为准，替换 Response 自动生成的同名头。
+    """
+    headers = list(headers)
+    for name in {k.lower() for k, _ in headers}:
+        if name in response.headers:
+            del response.headers[name]
+    for key, value in headers:
+        response.headers.append(key, value)
+    return response
+
+
+def _function_target_url(fn_name: str, request: Request, address: Optional[str]) -> str:
+    return _endpoint_url(fn_name, address, request.url.path, request.url.query)
+
+
+def _endpoint_url(fn_name: str, address: Optional[str], path: str, query: str) -> str:
+    if address is not None:
+        # 直连网关挑选出的 Pod
+        target_url = f"http://{address}{path}"
+    else:
+        svc_name = _service_name_from_function(fn_name)
+        # 在集群内部通过 Service DNS 访问
+        target_url = f"http://{svc_name}.{NAMESPACE}.svc.cluster.local:{SERVICE_PORT}{path}"
+
+    # 保留查询参数
+    if query:
+        target_url += f"?{query}"
+    return target_url
+
+
+def _pick_endpoint(fn_name: str, exclude: Iterable[str] = ()) -> Optional[str]:
+    """
+    从 EndpointSlice 中挑选在途请求最少的 Pod 并计入在途数；还没有就绪地址时返回 None，
+    由调用方回退到 Service DNS。
+    被摘除的实例不参与挑选；已知就绪地址但没有可用的（全部被摘除或已尝试过）时返回 503，
+    不回退到 Service DNS，否则 kube-proxy 仍可能把请求转给被摘除的 Pod。
+    """
+    if LB_POLICY == "service":
+        return None
+    svc_name = _service_name_from_function(fn_name)
+    if OUTLIER_DETECTION:
+        _check_circuit(fn_name)
+        endpoints = _balancer.endpoints(svc_name)
+        exclude = set(exclude) | _outliers.unavailable(endpoints)
+        if endpoints and all(a in exclude for a in endpoints):
+            raise CircuitOpen(
+                status_code=503,
+                detail=f"Function {fn_name} 没有可用的健康实例",
+                headers={"Retry-After": str(SHED_RETRY_AFTER_SECONDS)},
+            )
+    address = _balancer.pick(svc_name, exclude=exclude)
+    if address is not None:
+        _balancer.acquire(address)
+        if OUTLIER_DETECTION:
+            _outliers.begin(address)
+    return address
+
+
+def _release_endpoint(address: Optional[str]) -> None:
+    if address is not None:
+        _balancer.release(address)
+
+
+class CircuitOpen(HTTPException):
+    """
+    函数实例全部被摘除时的快速失败；不反映函数的延迟与负载，不计入自适应并发上限。
+    """
+
+
+def _check_circuit(fn_name: str) -> None:
+    """
+    函数的就绪实例全部被摘除（或只剩正在试探的实例）时直接返回 503，
+    不再让请求等到超时；Retry-After 为最早一个实例重新试探的时间。
+    没有就绪实例时交给冷启动流程，不在此拦截。
+    """
+    if not OUTLIER_DETECTION or LB_POLICY == "service":
+        return
+    endpoints = _balancer.endpoints(_service_name_from_function(fn_name))
+    if not endpoints or len(_outliers.unavailable(endpoints)) < len(endpoints):
+        return
+    _circuit_rejections[fn_name.lower()] = _circuit_rejections.get(fn_name.lower(), 0) + 1
+    retry_after = max(1, math.ceil(_outliers.retry_after(endpoints)))
+    raise CircuitOpen(
+        status_code=503,
+        detail=f"Function {fn_name} 的实例均不健康，已暂时停止转发",
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+def _endpoint_verdict(
+    resp: Optional[httpx.Response] = None,
+    error: Optional[BaseException] = None,
+    clipped: bool = False,
+) -> Optional[bool]:
+    """
+    一次上游调用对实例健康的判定：True 为实例故障，False 为正常，None 为不作判定。
+    用户代码抛出异常（普通 500）不算实例故障；受调用方截止时间限制的超时与
+    Runner 因预算不足的拒绝不反映实例状况。clipped 表示本次超时短于函数自身的超时，
+    此时任何超时（包括建连超时）都可能只是调用方给的时间太短，否则客户端用极短的
+    X-FaaS-Timeout 就能把健康实例摘掉。
+    """
+    if error is not None:
+        if isinstance(error, httpx.PoolTimeout):
+            # 网关自身连接池耗尽，与实例无关
+            return None
+        if isinstance(error, httpx.TimeoutException) and clipped:
+            return None
+        if isinstance(error, httpx.TransportError):
+            return True
+        return None
+    if resp is None or DEADLINE_EXCEEDED_HEADER in resp.headers:
+        return None
+    return RUNNER_ERROR_HEADER in resp.headers or resp.status_code in (502, 503)
+
+
+def _report_endpoint(
+    fn_name: str,
+    address: Optional[str],
+    verdict: Optional[bool],
+    latency: Optional[float] = None,
+) -> None:
+    """
+    把一次上游调用的结果计入实例健康状况；latency 为 None 时不参与延迟离群判断。
+    """
+    if address is None or not OUTLIER_DETECTION:
+        return
+    if verdict is None:
+        _outliers.abandon(address)
+    elif verdict:
+        _outliers.failure(address)
+    else:
+        peers = _balancer.endpoints(_service_name_from_function(fn_name))
+        _outliers.success(address, latency, peers)
+
+
+async def _stream_upstream_body(
+    resp: httpx.Response,
+    address: Optional[str],
+) -> AsyncIterator[bytes]:
+    # 原样透传字节（不解压），客户端断开时也保证连接归还连接池
+    try:
+        async for chunk in resp.aiter_raw(STREAM_CHUNK_SIZE):
+            yield chunk
+    finally:
+        await resp.aclose()
+        _release_endpoint(address)
+
+
+async def _proxy_streaming(fn_name: str, request: Request) -> Response:
+    """
+    流式反向代理：请求体以 request.stream() 逐块上送，响应体逐块回写。
+    """
+    budget = _call_budget(fn_name, _request_deadline(request), _function_timeout(fn_name))
+    address = _pick_endpoint(fn_name)
+    target_url = _function_target_url(fn_name, request, address)
+    # host 交给 httpx 重写；Content-Length 保留，缺失时 httpx 自动使用 chunked
+    headers = _with_deadline(_filter_headers(request.headers.items(), drop=("host",)), budget)
+
+    upstream = _get_upstream_client(fn_name)
+    upstream_request = upstream.build_request(
+        method=request.method,
+        url=target_url,
+        content=request.stream(),
+        headers=headers,
+        timeout=_budget_timeout(budget),
+    )
+    metrics = _metrics_for(fn_name)
+    started = time.perf_counter()
+    try:
+        resp = await upstream.send(upstream_request, stream=True)
+    except httpx.HTTPError as e:
+        _release_endpoint(address)
+        _report_endpoint(fn_name, address, _endpoint_verdict(error=e, clipped=budget < _function_timeout(fn_name)))
+        metrics.count_upstream_error(_upstream_error_reason(e))
+        if isinstance(e, httpx.TimeoutException):
+            raise _upstream_timeout(fn_name, e, budget < _function_timeout(fn_name), budget)
+        raise HTTPException(status_code=502, detail=f"调用后端 Service 失败: {e}")
+    except BaseException:
+        _release_endpoint(address)
+        _report_endpoint(fn_name, address, None)
+        raise
+    finally:
+        # 流式模式下上游阶段记到收到响应头为止
+        metrics.upstream_seconds.observe(time.perf_counter() - started)
+    _report_endpoint(fn_name, address, _endpoint_verdict(resp), time.perf_counter() - started)
+
+    response = StreamingResponse(_stream_upstream_body(resp, address), status_code=resp.status_code)
+    return _append_headers(response, _filter_headers(resp.headers.multi_items()))
+
+
+async def _forward_buffered(
+    fn_name: str,
+    request: Request,
+    body: bytes,
+    headers: List[Tuple[str, str]],
+) -> httpx.Response:
+    """
+    把已读取的请求体整体转发给函数 Pod，返回已读完的上游响应。
+    """
+    _retry_budget.deposit()
+    try:
+        if _hedging_enabled(fn_name, request):
+            return await _forward_hedged(fn_name, request, body, headers)
+        return await _forward_attempt(fn_name, request, body, headers, [])
+    except httpx.TimeoutException as e:
+        raise _upstream_timeout(fn_name, e, _deadline_passed(request))
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"调用后端 Service 失败: {e}")
+
+
+def _upstream_timeout(
+    fn_name: str,
+    error: httpx.TimeoutException,
+    clipped: bool,
+    budget: Optional[float] = None,
+) -> HTTPException:
+    """
+    上游超时（建连、发送、等待连接池或读响应）统一为 504；
+    clipped 表示超时来自调用方截止时间，此时说明是调用方给的时间用完了，而不是后端故障。
+    """
+    if clipped:
+        detail = f"调用方截止时间 ({DEADLINE_HEADER}) 已到，Function {fn_name} 未完成"
+    elif isinstance(error, httpx.ConnectTimeout):
+        detail = f"连接 Function {fn_name} 超时"
+    elif isinstance(error, httpx.PoolTimeout):
+        detail = f"等待 Function {fn_name} 的上游连接超时"
+    elif budget is not None:
+        detail = f"Function {fn_name} 未在 {budget:.3g}s 内返回"
+    else:
+        detail = f"Function {fn_name} 未在超时时间内返回"
+    return HTTPException(status_code=504, detail=detail)
+
+
+async def _forward_attempt(
+    fn_name: str,
+    request: Request,
+    body: bytes,
+    headers: List[Tuple[str, str]],
+    tried: List[str],
+) -> httpx.Response:
+    """
+    一次上游调用。连接级失败时请求尚未到达 Pod，预算允许则换一个 Pod 重试（与方法是否幂等无关）；
+    tried 记录已使用的地址，供重试与对冲请求避开。
+    每次尝试的超时为函数 timeoutSeconds 与调用方剩余时间中的较小者，并通过 X-FaaS-Timeout 告知 Runner。
+    """
+    upstream = _get_upstream_client(fn_name)
+    metrics = _metrics_for(fn_name)
+    retries = 0
+    while True:
+        budget = _call_budget(fn_name, _request_deadline(request), _function_timeout(fn_name))
+        address = _pick_endpoint(fn_name, exclude=tried)
+        if address is not None:
+            tried.append(address)
+        started = time.perf_counter()
+        try:
+            resp = await upstream.request(
+                method=request.method,
+                url=_function_target_url(fn_name, request, address),
+                content=body,
+                headers=_with_deadline(headers, budget),
+                timeout=_budget_timeout(budget),
+            )
+        except httpx.HTTPError as e:
+            metrics.count_upstream_error(_upstream_error_reason(e))
+            clipped = budget < _function_timeout(fn_name)
+            _report_endpoint(fn_name, address, _endpoint_verdict(error=e, clipped=clipped))
+            retryable = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+            if (
+                not retryable
+                or retries >= UPSTREAM_MAX_RETRIES
+                or not _alternative_endpoint_available(fn_name, tried)
+                or not _retry_budget.try_withdraw()
+            ):
+                raise
+            retries += 1
+            metrics.retries.inc()
+            continue
+        except BaseException:
+            # 被取消（如对冲请求的另一份先返回）时不作判定
+            _report_endpoint(fn_name, address, None)
+            raise
+        finally:
+            _release_endpoint(address)
+            elapsed = time.perf_counter() - started
+            metrics.upstream_seconds.observe(elapsed)
+        _report_endpoint(fn_name, address, _endpoint_verdict(resp), elapsed)
+        if DEADLINE_EXCEEDED_HEADER not in resp.headers:
+            _latency_tracker(fn_name).add(elapsed)
+        return resp
+
+
+def _alternative_endpoint_available(fn_name: str, tried: List[str]) -> bool:
+    """
+    重试与对冲都要发往另一个 Pod：没有未尝试过的就绪地址时，第二份请求只会经 Service VIP
+    落回同一个慢或不可达的 Pod，此时不发送，也不消耗重试预算。
+    沿用 Service DNS 时无法指定 Pod，至少要有两个就绪副本 kube-proxy 才可能换一个。
+    """
+    endpoints = _balancer.endpoints(_service_name_from_function(fn_name))
+    if LB_POLICY == "service":
+        return len(endpoints) > 1
+    excluded = set(tried)
+    if OUTLIER_DETECTION:
+        excluded |= _outliers.unavailable(endpoints)
+    return any(a not in excluded for a in endpoints)
+
+
+def _hedging_enabled(fn_name: str, request: Request) -> bool:
+    if request.method not in IDEMPOTENT_METHODS:
+        return False
+    return _function_setting(fn_name, "hedge-requests", False, _parse_bool)
+
+
+def _latency_tracker(fn_name: str) -> LatencyTracker:
+    key = fn_name.lower()
+    tracker = _latency_trackers.get(key)
+    if tracker is None:
+        tracker = LatencyTracker()
+        _latency_trackers[key] = tracker
+    return tracker
+
+
+async def _forward_hedged(
+    fn_name: str,
+    request: Request,
+    body: bytes,
+    headers: List[Tuple[str, str]],
+) -> httpx.Response:
+    """
+    对冲请求：原请求超过近期 p95 仍未返回时，在预算允许下向另一个 Pod 再发一份，
+    取先成功的响应并取消另一份；样本不足时不对冲。
+    """
+    tracker = _latency_tracker(fn_name)
+    delay = tracker.quantile(HEDGE_QUANTILE) if len(tracker) >= HEDGE_MIN_SAMPLES else None
+    tried: List[str] = []
+    primary = asyncio.ensure_future(_forward_attempt(fn_name, request, body, headers, tried))
+    tasks = [primary]
+    try:
+        if delay is None:
+            return await primary
+        await asyncio.wait(tasks, timeout=max(delay, HEDGE_MIN_DELAY_SECONDS))
+        if (
+            not primary.done()
+            and _alternative_endpoint_available(fn_name, tried)
+            and _retry_budget.try_withdraw()
+        ):
+            metrics = _metrics_for(fn_name)
+            metrics.hedges_sent.inc()
+            tasks.append(
+                asyncio.ensure_future(
+                    _forward_attempt(fn_name, request, body, headers, list(tried))
+                )
+            )
+
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    if task is not primary:
+                        _metrics_for(fn_name).hedges_won.inc()
+                    return task.result()
+        assert error is not None
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def _upstream_error_reason(error: httpx.HTTPError) -> str:
+    if isinstance(error, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(error, httpx.ConnectError):
+        return "connect"
+    if isinstance(error, (httpx.ProtocolError, httpx.ReadError, httpx.WriteError)):
+        return "protocol"
+    return "other"
+
+
+def _response_headers(resp: httpx.Response) -> List[Tuple[str, str]]:
+    # resp.content 已被 httpx 解压，长度与编码头需要由 Response 重新生成
+    return _filter_headers(
+        resp.headers.multi_items(),
+        drop=("content-length", "content-encoding"),
+    )
+
+
+async def _proxy_to_function_service(
+    fn_name: str,
+    request: Request,
+) -> Response:
+    """
+    使用 httpx 反向代理到对应 Service。
+    """
+    cache_ttl = _response_cache_ttl(fn_name, request)
+    if cache_ttl > 0:
+        return await _proxy_cacheable(fn_name, request, cache_ttl)
+
+    # 合并与对冲都需要完整缓冲响应，开启它们的请求不走流式
+    if (
+        PROXY_STREAMING
+        and not _coalescing_enabled(fn_name, request)
+        and not _hedging_enabled(fn_name, request)
+    ):
+        return await _proxy_streaming(fn_name, request)
+
+    # 复制请求头（去掉 host 和逐跳头，交给 httpx/内核重写）
+    headers = _filter_headers(request.headers.items(), drop=("host",))
+
+    # 读取 body（FastAPI 的 Request 是 async 的）
+    body = await request.body()
+    resp, shared = await _forward_shared(fn_name, request, body, headers)
+
+    # 将下游响应返回给调用方
+    response = _append_headers(
+        Response(content=resp.content, status_code=resp.status_code),
+        _response_headers(resp),
+    )
+    if shared:
+        response.headers["X-FaaS-Coalesced"] = "true"
+    return response
+
+
+def _coalescing_enabled(fn_name: str, request: Request) -> bool:
+    if request.method not in IDEMPOTENT_METHODS:
+        return False
+    return _function_setting(fn_name, "coalesce-requests", False, _parse_bool)
+
+
+async def _forward_shared(
+    fn_name: str,
+    request: Request,
+    body: bytes,
+    headers: List[Tuple[str, str]],
+) -> Tuple[httpx.Response, bool]:
+    """
+    开启请求合并时，相同（函数、代码版本、method、path、query、body 哈希）的并发请求
+    共享一次上游调用；返回 (上游响应, 是否为共享结果)。
+    """
+    if not _coalescing_enabled(fn_name, request):
+        return await _forward_buffered(fn_name, request, body, headers), False
+    key = _request_key(fn_name, request) + (hashlib.sha256(body).hexdigest(),)
+    return await _single_flight.do(
+        fn_name.lower(),
+        key,
+        lambda: _forward_buffered(fn_name, request, body, headers),
+    )
+
+
+def _response_cache_ttl(fn_name: str, request: Request) -> float:
+    """
+    返回本次请求可使用的缓存 TTL；函数未开启缓存、非 GET 或客户端要求 no-store 时为 0。
+    """
+    if request.method != "GET":
+        return 0.0
+    ttl = _function_setting(fn_name, "response-cache-ttl", 0.0, float)
+    if ttl <= 0:
+        return 0.0
+    if "no-store" in parse_cache_control(request.headers.get("cache-control")):
+        return 0.0
+    return ttl
+
+
+def _request_key(fn_name: str, request: Request) -> CacheKey:
+    """
+    响应缓存与请求合并共用的请求标识。
+    Runner 把 query 转成 dict 作为 event，不同参数的顺序不影响结果，按参数名排序后提高命中率；
+    同名参数以最后一个为准，只按名称做稳定排序，保留它们的相对顺序。
+    """
+    pairs = parse_qsl(request.url.query, keep_blank_values=True)
+    query = urlencode(sorted(pairs, key=lambda kv: kv[0]))
+    return (
+        fn_name.lower(),
+        _function_setting(fn_name, "code-version", "", str),
+        request.method,
+        request.url.path,
+        query,
+    )
+
+
+def _cached_response(entry: CachedResponse, request: Request, status: str) -> Response:
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers={"ETag": entry.etag, "X-FaaS-Cache": status})
+    response = _append_headers(
+        Response(content=entry.body, status_code=entry.status_code), entry.headers
+    )
+    response.headers["ETag"] = entry.etag
+    response.headers["X-FaaS-Cache"] = status
+    return response
+
+
+def _lookup_fresh_response(fn_name: str, request: Request) -> Optional[Response]:
+    """
+    缓存命中且未过期时直接构造响应（客户端 ETag 匹配时返回 304），无需唤醒函数。
+    """
+    if _response_cache_ttl(fn_name, request) <= 0:
+        return None
+    if "no-cache" in parse_cache_control(request.headers.get("cache-control")):
+        return None
+    entry = _response_cache.get(_request_key(fn_name, request))
+    if entry is None or not entry.is_fresh():
+        return None
+    return _cached_response(entry, request, "HIT")
+
+
+async def _proxy_cacheable(fn_name: str, request: Request, default_ttl: float) -> Response:
+    """
+    可缓存 GET 的代理：过期条目带 If-None-Match 向上游重新验证，
+    200 响应按 Cache-Control / 函数 TTL 写入缓存。
+    """
+    key = _request_key(fn_name, request)
+    entry = _response_cache.get(key)
+
+    # 客户端的条件头针对的是网关 ETag，不能原样交给 Runner
+    headers = _filter_headers(
+        request.headers.items(),
+        drop=("host", "if-none-match", "if-modified-since"),
+    )
+    if entry is not None and entry.upstream_etag:
+        headers.append(("if-none-match", entry.etag))
+
+    resp, _ = await _forward_shared(fn_name, request, await request.body(), headers)
+    now = time.monotonic()
+
+    if resp.status_code == 304 and entry is not None:
+        entry.expires_at = now + response_ttl(resp.headers.get("cache-control"), default_ttl)
+        return _cached_response(entry, request, "REVALIDATED")
+
+    response_headers = _response_headers(resp)
+    upstream_etag = resp.headers.get("etag")
+    etag = upstream_etag or body_etag(resp.content)
+    ttl = response_ttl(resp.headers.get("cache-control"), default_ttl)
+    expected_version = key[1]
+    cacheable = (
+        resp.status_code == 200
+        and ttl > 0
+        and "set-cookie" not in resp.headers
+        and "vary" not in resp.headers
+        # 代码更新期间旧 Pod 仍可能在跑旧代码，只缓存与当前版本一致的结果
+        and (not expected_version or resp.headers.get(CODE_VERSION_HEADER) == expected_version)
+    )
+    if cacheable:
+        fresh = CachedResponse(
+            status_code=resp.status_code,
+            # Runner 的 Server-Timing 只属于这一次调用，不随缓存复用
+            headers=[
+                (k, v) for k, v in response_headers if k.lower() not in ("etag", "server-timing")
+            ],
+            body=resp.content,
+            etag=etag,
+            upstream_etag=upstream_etag is not None,
+            expires_at=now + ttl,
+        )
+        if _response_cache.put(key, fresh):
+            response = _cached_response(fresh, request, "MISS")
+            if "server-timing" in resp.headers:
+                response.headers[SERVER_TIMING_HEADER] = resp.headers["server-timing"]
+            return response
+
+    return _append_headers(
+        Response(content=resp.content, status_code=resp.status_code), response_headers
+    )
+
+
+async def _async_dispatch_loop() -> None:
+    """
+    后台任务：投递到期的异步调用，有新调用入队或有投递完成时立即被唤醒，
+    否则按 FAAS_ASYNC_POLL_INTERVAL 检查退避到期的重试；顺带清理过期结果。
+    """
+    assert _async_wakeup is not None
+    last_purge = 0.0
+    while True:
+        _async_wakeup.clear()
+        try:
+            await _dispatch_due_invocations()
+            if time.monotonic() - last_purge >= 60:
+                last_purge = time.monotonic()
+                await _invocation_store.purge_finished(time.time() - ASYNC_RESULT_TTL_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"异步调用投递失败: {e}")
+        try:
+            await asyncio.wait_for(_async_wakeup.wait(), timeout=ASYNC_POLL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _dispatch_due_invocations() -> None:
+    free = ASYNC_CONCURRENCY - len(_async_running)
+    if free <= 0:
+        return
+    for invocation in await _invocation_store.claim(free):
+        task = asyncio.ensure_future(_run_invocation(invocation))
+        _async_running.add(task)
+        task.add_done_callback(_on_invocation_done)
+
+
+def _on_invocation_done(task: asyncio.Task) -> None:
+    _async_running.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        # 通常是写回结果时存储出错；调用保持 running，网关重启时重新排队
+        print(f"异步调用执行失败: {task.exception()!r}")
+    if _async_wakeup is not None:
+        _async_wakeup.set()
+
+
+async def _run_invocation(invocation: Any) -> None:
+    """
+    执行一次异步调用：与同步调用一样先唤醒函数，再以函数 timeoutSeconds
+    （未设置时为 FAAS_ASYNC_TIMEOUT）为超时转发。
+    连接失败、冷启动失败与 429/502/503/504 按指数退避重试，其余响应作为最终结果保存。
+    网关饱和时异步调用按 low 优先级排队，让路给同步调用。
+    """
+    fn_name = invocation.function
+    retryable = True
+    try:
+        await _ensure_scaled(fn_name)
+        timeout = _function_setting(fn_name, "timeout-seconds", ASYNC_TIMEOUT_SECONDS, float)
+        scheduled = await _acquire_upstream_slot(fn_name, PRIORITY_CLASSES["low"])
+        _begin_invocation(fn_name)
+        try:
+            resp = await _send_upstream(
+                fn_name,
+                invocation.method,
+                invocation.path,
+                invocation.query,
+                _with_deadline(invocation.headers, timeout),
+                invocation.body,
+                timeout=_budget_timeout(timeout),
+            )
+        finally:
+            _end_invocation(fn_name, scheduled=scheduled)
+    except HTTPException as e:
+        error = f"{e.status_code}: {e.detail}"
+        retryable = e.status_code != 404
+    except httpx.HTTPError as e:
+        error = f"调用后端 Service 失败: {e}"
+    except Exception as e:
+        # 其余异常（如唤醒时访问 API Server 的连接错误）同样按退避重试，不能让调用卡在 running
+        print(f"异步调用 {invocation.id} 执行出错: {e!r}")
+        error = f"网关内部错误: {e!r}"
+    else:
+        error = f"函数返回 {resp.status_code}"
+        final = invocation.attempts >= ASYNC_MAX_ATTEMPTS
+        if resp.status_code not in OVERLOAD_STATUS_CODES or final:
+            await _invocation_store.complete(
+                invocation.id,
+                resp.status_code,
+                _response_headers(resp),
+                resp.content,
+            )
+            return
+
+    if retryable and invocation.attempts < ASYNC_MAX_ATTEMPTS:
+        delay = ASYNC_RETRY_BASE_SECONDS * 2 ** (invocation.attempts - 1)
+        await _invocation_store.retry_later(invocation.id, delay, error)
+    else:
+        await _invocation_store.fail(invocation.id, error)
+
+
+async def _send_upstream(
+    fn_name: str,
+    method: str,
+    path: str,
+    query: str,
+    headers: List[Tuple[str, str]],
+    body: bytes,
+    timeout: Any = httpx.USE_CLIENT_DEFAULT,
+    clipped: bool = False,
+) -> httpx.Response:
+    """
+    不依附于客户端 Request 的单次上游调用（异步调用、批量调用使用），复用函数的连接池。
+    耗时与单次调用不可比，只计入实例的失败判定，不参与延迟离群判断；
+    clipped 表示超时受调用方截止时间限制。
+    """
+    upstream = _get_upstream_client(fn_name)
+    address = _pick_endpoint(fn_name)
+    try:
+        resp = await upstream.request(
+            method=method,
+            url=_endpoint_url(fn_name, address, path, query),
+            content=body,
+            headers=headers,
+            timeout=timeout,
+        )
+    except httpx.HTTPError as e:
+        _metrics_for(fn_name).count_upstream_error(_upstream_error_reason(e))
+        _report_endpoint(fn_name, address, _endpoint_verdict(error=e, clipped=clipped))
+        raise
+    except BaseException:
+        _report_endpoint(fn_name, address, None)
+        raise
+    finally:
+        _release_endpoint(address)
+    _report_endpoint(fn_name, address, _endpoint_verdict(resp))
+    return resp
+
+
+async def _invoke_event(
+    fn_name: str,
+    index: int,
+    event: Any,
+    headers: List[Tuple[str, str]],
+    deadline: Optional[float] = None,
+) -> BatchOutcome:
+    budget = _call_budget(fn_name, deadline, _function_timeout(fn_name))
+    clipped = budget < _function_timeout(fn_name)
+    try:
+        resp = await _send_upstream(
+            fn_name,
+            "POST",
+            f"/invoke/{fn_name}",
+            "",
+            _with_deadline(headers, budget),
+            json.dumps(event).encode(),
+            timeout=_budget_timeout(budget),
+            clipped=clipped,
+        )
+    except httpx.TimeoutException as e:
+        raise _upstream_timeout(fn_name, e, clipped, budget)
+    return {
+        "index": index,
+        **decode_result(resp.status_code, resp.headers.get("content-type", ""), resp.content),
+    }
+
+
+async def _invoke_event_chunk(
+    fn_name: str,
+    start: int,
+    events: List[Any],
+    headers: List[Tuple[str, str]],
+    deadline: Optional[float] = None,
+) -> List[BatchOutcome]:
+    """
+    整组事件发给 Runner 的批量入口，一次往返、一次代码加载。
+    Runner 逐个执行，超时按 函数 timeoutSeconds * 事件数 计算。
+    """
+    per_chunk = _function_timeout(fn_name) * len(events)
+    budget = _call_budget(fn_name, deadline, per_chunk)
+    try:
+        resp = await _send_upstream(
+            fn_name,
+            "POST",
+            RUNNER_BATCH_PATH,
+            "",
+            _with_deadline(headers, budget),
+            json.dumps(events).encode(),
+            timeout=_budget_timeout(budget),
+            clipped=budget < per_chunk,
+        )
+    except httpx.TimeoutException as e:
+        raise _upstream_timeout(fn_name, e, budget < per_chunk, budget)
+    items = resp.json() if resp.status_code == 200 else None
+    if not isinstance(items, list) or len(items) != len(events):
+        error = decode_result(resp.status_code, resp.headers.get("content-type", ""), resp.content)
+        message = error.get("error", error.get("result"))
+        return [
+            {"index": start + offset, "status": resp.status_code, "error": message}
+            for offset in range(len(events))
+        ]
+    return [
+        {"index": start + offset, **(item if isinstance(item, dict) else {"status": 200, "result": item})}
+        for offset, item in enumerate(items)
+    ]
+
+
+async def _batch_lines(results: AsyncIterator[List[BatchOutcome]]) -> AsyncIterator[bytes]:
+    try:
+        async for outcomes in results:
+            yield b"".join(
+                json.dumps(outcome, ensure_ascii=False).encode() + b"\n" for outcome in outcomes
+            )
+    finally:
+        await results.aclose()
+
+
+REGISTRY.register(
+    StateCollector(
+        gauges=[
+            (
+                "faas_gateway_inflight_requests",
+                "正在代理中的函数调用数",
+                lambda: dict(_inflight_requests),
+            ),
+            (
+                "faas_gateway_queued_requests",
+                "在冷启动激活队列中等待的请求数",
+                _activator.depths,
+            ),
+            (
+                "faas_gateway_cold_starts_in_progress",
+                "占用全局冷启动名额、正在扩容或等待就绪的函数",
+                _cold_start_governor.active_functions,
+            ),
+            (
+                "faas_gateway_cold_starts_waiting",
+                "等待全局冷启动名额的函数",
+                _cold_start_governor.waiting,
+            ),
+            (
+                "faas_gateway_scheduler_queued_requests",
+                "网关饱和时在公平调度队列中等待上游名额的请求数",
+                lambda: _scheduler.queued() if _scheduler is not None else {},
+            ),
+            (
+                "faas_gateway_response_cache_bytes",
+                "响应缓存中该函数条目占用的字节数（全部函数共享 FAAS_RESPONSE_CACHE_MAX_BYTES）",
+                _response_cache.bytes_by_function,
+            ),
+            (
+                "faas_gateway_ejected_endpoints",
+                "因连续失败或延迟离群被暂时摘除的实例数",
+                lambda: {
+                    fn: _outliers.ejected(_balancer.endpoints(_service_name_from_function(fn)))
+                    for fn in _known_functions
+                },
+            ),
+            (
+                "faas_gateway_concurrency_limit",
+                "函数当前的自适应并发上限（已乘就绪副本数）",
+                lambda: {
+                    fn: limiter.capacity(_cached_ready_replicas(fn))
+                    for fn, limiter in _limiters.items()
+                },
+            ),
+        ],
+        counters=[
+            (
+                "faas_gateway_coalesced_requests",
+                "被请求合并复用上游结果的调用数",
+                lambda: {fn: s["coalesced"] for fn, s in _single_flight.stats().items()},
+            ),
+            (
+                "faas_gateway_coalescing_upstream_calls",
+                "开启请求合并的函数实际发往上游的调用数",
+                lambda: {fn: s["upstream_calls"] for fn, s in _single_flight.stats().items()},
+            ),
+            (
+                "faas_gateway_prewarms",
+                "按流量预测提前拉起副本的次数",
+                lambda: {fn: s["prewarms"] for fn, s in _prewarmer.stats().items()},
+            ),
+            (
+                "faas_gateway_prewarm_avoided_cold_starts",
+                "预热后首个请求到达时函数已就绪、因而避免的冷启动次数",
+                lambda: {fn: s["avoided_cold_starts"] for fn, s in _prewarmer.stats().items()},
+            ),
+            (
+                "faas_gateway_prewarm_replica_seconds",
+                "预热副本在首个请求到达（或被缩回 0）之前空转的副本秒数",
+                lambda: {fn: s["extra_replica_seconds"] for fn, s in _prewarmer.stats().items()},
+            ),
+            (
+                "faas_gateway_circuit_open_rejections",
+                "函数实例全部被摘除、快速失败（503）的调用数",
+                lambda: dict(_circuit_rejections),
+            ),
+            (
+                "faas_gateway_rate_limited_requests",
+                "超过 spec.rateLimit 被拒绝（429）的调用数",
+                lambda: dict(_rate_limited),
+            ),
+        ],
+    )
+)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """
+    Prometheus 抓取入口。
+    """
+    return Response(content=generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/stats/coalescing")
+async def coalescing_stats():
+    """
+    请求合并统计：每个函数的上游调用数、被合并的请求数与合并比例。
+    """
+    return _single_flight.stats()
+
+
+@app.get("/stats/prewarm")
+async def prewarm_stats():
+    """
+    预热统计：每个函数的预热次数、避免的冷启动次数与额外消耗的副本秒数。
+    """
+    return _prewarmer.stats()
+
+
+@app.post("/async-invoke/{function_name}", status_code=202)
+async def async_invoke_function(function_name: str, request: Request):
+    """
+    异步调用入口：请求写入持久化队列后立即返回调用 ID，结果通过 GET /invocations/{id} 查询。
+    """
+    fn_name = function_name.lower()
+    if _functions_synced and fn_name not in _known_functions:
+        raise HTTPException(status_code=404, detail=f"Function {function_name} 不存在")
+    if await _invocation_store.count_pending() >= ASYNC_MAX_PENDING:
+        raise HTTPException(
+            status_code=503,
+            detail=f"异步调用队列已满 ({ASYNC_MAX_PENDING})，请稍后重试",
+            headers={"Retry-After": str(SHED_RETRY_AFTER_SECONDS)},
+        )
+    await _enforce_rate_limits(fn_name, request)
+    _record_arrival(fn_name)
+    invocation_id = await _invocation_store.enqueue(
+        fn_name,
+        request.method,
+        # Runner 看到的路径与同步调用一致
+        f"/invoke/{function_name}",
+        request.url.query,
+        _filter_headers(request.headers.items(), drop=("host", "content-length")),
+        await request.body(),
+        owner=ASYNC_OWNER,
+    )
+    if _async_wakeup is not None:
+        _async_wakeup.set()
+    return JSONResponse(
+        status_code=202,
+        content={"id": invocation_id, "status": "queued"},
+        headers={"Location": f"/invocations/{invocation_id}"},
+    )
+
+
+@app.get("/invocations/{invocation_id}")
+async def get_invocation(invocation_id: str):
+    """
+    查询异步调用的状态与结果。
+    """
+    invocation = await _invocation_store.get(invocation_id)
+    if invocation is None:
+        owner = invocation_owner(invocation_id)
+        if owner is not None and owner != ASYNC_OWNER:
+            # 请求被负载均衡到了其他网关实例，结果不在本实例的存储上
+            raise HTTPException(
+                status_code=421,
+                detail=(
+                    f"调用 {invocation_id} 由网关实例 {owner} 受理，结果只保存在该实例上，"
+                    f"当前实例 {ASYNC_OWNER} 无法查询"
+                ),
+            )
+        raise HTTPException(status_code=404, detail=f"调用 {invocation_id} 不存在或结果已过期")
+    return invocation_view(invocation)
+
+
+@app.post("/invoke-batch/{function_name}")
+async def invoke_batch(function_name: str, request: Request):
+    """
+    批量调用入口：请求体为事件的 JSON 数组或 NDJSON，结果以 NDJSON 流式返回，
+    每行 {"index", "status", "result" | "error"}。
+    - concurrency：本批最大并发（默认 FAAS_BATCH_CONCURRENCY，不超过 FAAS_BATCH_MAX_CONCURRENCY）；
+    - order=completion：按完成顺序返回，默认按输入顺序。
+    函数设置了 batchSize 时按块发给 Runner 的批量入口，否则逐个事件转发。
+    """
+    fn_name = function_name.lower()
+    if _functions_synced and fn_name not in _known_functions:
+        raise HTTPException(status_code=404, detail=f"Function {function_name} 不存在")
+    try:
+        events = parse_events(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"批量请求体解析失败: {e}")
+    if len(events) > BATCH_MAX_EVENTS:
+        raise HTTPException(status_code=413, detail=f"单批最多 {BATCH_MAX_EVENTS} 个事件")
+    try:
+        concurrency = int(request.query_params.get("concurrency", BATCH_CONCURRENCY))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="concurrency 必须是整数")
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+    ordered = request.query_params.get("order", "input") != "completion"
+    # X-FaaS-Timeout 限制整批的截止时间，到期后剩余事件直接返回 504
+    deadline = _client_deadline(request)
+    priority = _request_priority(fn_name, request)
+    # 每个事件计为一次调用
+    await _enforce_rate_limits(fn_name, request, cost=len(events))
+
+    _record_arrival(fn_name)
+    await _ensure_scaled(function_name, deadline=deadline)
+    _check_circuit(fn_name)
+
+    batch_size = _function_setting(fn_name, "batch-size", 0, int)
+    headers = _filter_headers(
+        request.headers.items(),
+        drop=("host", "content-length", "content-type", "accept-encoding"),
+    )
+    headers.append(("content-type", "application/json"))
+
+    limiter = _limiter_for(fn_name)
+
+    async def run_unit(start: int, unit_events: List[Any]) -> List[BatchOutcome]:
+        # 每个单元与同步调用一样经过公平调度与函数的自适应并发上限，批量调用不能挤占其他函数，
+        # 也不能绕过 bulkhead 压垮函数；超出上限的单元得到 503，不在网关内排队
+        scheduled = await _acquire_upstream_slot(fn_name, priority, deadline)
+        replicas = _cached_ready_replicas(fn_name)
+        if limiter is not None and not limiter.try_acquire(replicas):
+            if scheduled:
+                _release_upstream_slot()
+            raise HTTPException(
+                status_code=503,
+                detail=f"Function {fn_name} 并发已达上限 ({limiter.capacity(replicas)})，请稍后重试",
+            )
+        started = time.perf_counter()
+        # None 表示本单元不计入并发上限的调整（熔断快速失败、被取消等）
+        overloaded: Optional[bool] = None
+        try:
+            if batch_size > 0:
+                outcomes = await _invoke_event_chunk(fn_name, start, unit_events, headers, deadline)
+            else:
+                outcomes = [await _invoke_event(fn_name, start, unit_events[0], headers, deadline)]
+            overloaded = any(o.get("status") in OVERLOAD_STATUS_CODES for o in outcomes)
+            return outcomes
+        except HTTPException as e:
+            if not isinstance(e, CircuitOpen):
+                overloaded = e.status_code in OVERLOAD_STATUS_CODES
+            raise
+        finally:
+            if limiter is not None:
+                # 截止时间到期的单元不代表函数过载；Runner 逐个执行整组事件，按单个事件的耗时计
+                remaining = _remaining_seconds(deadline)
+                if overloaded is not None and (remaining is None or remaining > 0):
+                    elapsed = (time.perf_counter() - started) / len(unit_events)
+                    limiter.observe(elapsed, overloaded, replicas)
+                limiter.release()
+            if scheduled:
+                _release_upstream_slot()
+
+    results = fan_out(split_units(events, batch_size), run_unit, concurrency, ordered)
+    _begin_invocation(fn_name)
+    return StreamingResponse(
+        _track_stream(_batch_lines(results), fn_name),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.api_route("/invoke/{function_name}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+async def invoke_function(function_name: str, request: Request):
+    """
+    FaaS 网关入口：
+    1. 检查 Deployment 的 ready_replicas（优先读 watch 缓存）；
+    2. 若为 0，按排队请求数扩容并等待 Pod 就绪；
+    3. 将请求代理到对应 Pod（无 EndpointSlice 数据时回退到 Service）。
+    """
+    metrics = _metrics_for(function_name)
+    timing = ServerTiming()
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await _invoke(function_name, request, timing)
+        status_code = response.status_code
+        timing.add("total", time.perf_counter() - started)
+        upstream_timing = response.headers.get("server-timing")
+        if upstream_timing is not None:
+            del response.headers["server-timing"]
+        response.headers[SERVER_TIMING_HEADER] = timing.header_value(upstream_timing)
+        response.headers[COLD_START_HEADER] = "true" if timing.cold_start else "false"
+        return response
+    except HTTPException as e:
+        status_code = e.status_code
+        # 排队满、冷启动超时等失败也带上已完成阶段的耗时，便于定位卡在哪一步
+        timing.add("total", time.perf_counter() - started)
+        e.headers = {
+            **(e.headers or {}),
+            SERVER_TIMING_HEADER: timing.header_value(),
+            COLD_START_HEADER: "true" if timing.cold_start else "false",
+        }
+        raise
+    finally:
+        metrics.count_request(status_code)
+        metrics.request_seconds.observe(time.perf_counter() - started)
+
+
+async def _invoke(function_name: str, request: Request, timing: ServerTiming) -> Response:
+    # 0. 函数索引已同步时，不存在的函数 O(1) 拒绝，不进入激活队列也不访问 API Server
+    if _functions_synced and function_name.lower() not in _known_functions:
+        raise HTTPException(status_code=404, detail=f"Function {function_name} 不存在")
+    # 调用方截止时间贯穿冷启动排队与上游调用
+    deadline = _client_deadline(request)
+    request.state.faas_deadline = deadline
+    priority = _request_priority(function_name.lower(), request)
+    # 限流在缓存与唤醒之前，单个调用方无法借高频调用把函数推到 maxReplicas
+    await _enforce_rate_limits(function_name.lower(), request)
+
+    # 1. 幂等 GET 命中响应缓存时直接返回，无需唤醒函数
+    cached = _lookup_fresh_response(function_name, request)
+    if cached is not None:
+        return cached
+
+    # 2. 如有必要，触发冷启动唤醒
+    key = function_name.lower()
+    _record_arrival(key)
+    await _ensure_scaled(function_name, timing, deadline)
+    # 实例全部被摘除时不再排队等上游名额
+    _check_circuit(key)
+
+    # 3. 网关饱和时按函数加权公平排队；超出函数自适应并发上限时快速拒绝，不让请求堆积到上游超时
+    scheduled = await _acquire_upstream_slot(key, priority, deadline, timing)
+    limiter = _limiter_for(key)
+    replicas = _cached_ready_replicas(function_name)
+    if limiter is not None and not limiter.try_acquire(replicas):
+        if scheduled:
+            _release_upstream_slot()
+        raise HTTPException(
+            status_code=503,
+            detail=f"Function {function_name} 并发已达上限 ({limiter.capacity(replicas)})，请稍后重试",
+            headers={"Retry-After": str(SHED_RETRY_AFTER_SECONDS)},
+        )
+
+    # 4. 反向代理到 Pod/Service，并记录调用供空闲缩容使用
+    _begin_invocation(key)
+    started = time.perf_counter()
+    try:
+        response = await _proxy_to_function_service(function_name, request)
+    except BaseException as e:
+        # 调用方截止时间过短导致的 504 与熔断的快速失败不代表函数过载
+        if (
+            limiter is not None
+            and isinstance(e, HTTPException)
+            and not isinstance(e, CircuitOpen)
+            and not _deadline_passed(request)
+        ):
+            limiter.observe(
+                time.perf_counter() - started,
+                e.status_code in OVERLOAD_STATUS_CODES,
+                replicas,
+            )
+        _end_invocation(key, limiter, scheduled)
+        raise
+    elapsed = time.perf_counter() - started
+    timing.add("upstream", elapsed)
+    if limiter is not None and DEADLINE_EXCEEDED_HEADER not in response.headers:
+        limiter.observe(elapsed, response.status_code in OVERLOAD_STATUS_CODES, replicas)
+    if isinstance(response, StreamingResponse):
+        response.body_iterator = _track_stream(response.body_iterator, key, limiter, scheduled)
+    else:
+        _end_invocation(key, limiter, scheduled)
+    return response
\ No newline at end of file
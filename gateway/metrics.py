@@ -0,0 +1,196 @@
+from typing import Callable, Dict, Iterable, Iterator, Tuple
+
+from prometheus_client import CollectorRegistry, Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+# 网关独立的 registry，只暴露网关自身的指标
+REGISTRY = CollectorRegistry(auto_describe=True)
+
+# 冷启动相关阶段跨度大（毫秒级 ~ 分钟级），上游阶段以毫秒级为主
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+# 请求分阶段耗时：queue=激活队列等待，admit=等待全局冷启动名额，scale=扩容请求，
+# ready=等待就绪，schedule=网关饱和时的公平排队，upstream=Runner 调用
+PHASE_QUEUE = "queue"
+PHASE_ADMIT = "admit"
+PHASE_SCHEDULE = "schedule"
+PHASE_SCALE = "scale"
+PHASE_READY = "ready"
+PHASE_UPSTREAM = "upstream"
+
+# 不在网关已知函数列表中的名字统一记到这个标签下，避免标签基数被任意 URL 撑爆
+UNKNOWN_FUNCTION = "__unknown__"
+
+REQUESTS = Counter(
+    "faas_gateway_requests_total",
+    "网关处理的函数调用数，按返回状态码区分",
+    ["function", "code"],
+    registry=REGISTRY,
+)
+REQUEST_SECONDS = Histogram(
+    "faas_gateway_request_duration_seconds",
+    "函数调用在网关中的总耗时",
+    ["function"],
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+PHASE_SECONDS = Histogram(
+    "faas_gateway_phase_duration_seconds",
+    "函数调用各阶段耗时",
+    ["function", "phase"],
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+COLD_STARTS = Counter(
+    "faas_gateway_cold_starts_total",
+    "网关触发的冷启动次数",
+    ["function"],
+    registry=REGISTRY,
+)
+COLD_START_SECONDS = Histogram(
+    "faas_gateway_cold_start_duration_seconds",
+    "冷启动耗时（扩容请求 + 等待就绪）",
+    ["function"],
+    buckets=LATENCY_BUCKETS,
+    registry=REGISTRY,
+)
+HEDGES = Counter(
+    "faas_gateway_hedged_requests_total",
+    "发出的对冲请求数，outcome=won 表示对冲请求先于原请求返回",
+    ["function", "outcome"],
+    registry=REGISTRY,
+)
+RETRIES = Counter(
+    "faas_gateway_upstream_retries_total",
+    "连接级失败后换 Pod 重试的次数",
+    ["function"],
+    registry=REGISTRY,
+)
+UPSTREAM_ERRORS = Counter(
+    "faas_gateway_upstream_errors_total",
+    "调用 Runner 失败次数，按错误类型区分（connect / timeout / protocol / other）",
+    ["function", "reason"],
+    registry=REGISTRY,
+)
+
+
+class FunctionMetrics:
+    """
+    单个函数预先绑定好标签的指标 child。
+    热路径只调用 child 的 inc/observe，不再构造标签元组或字典；
+    状态码 child 首次出现时创建一次，之后复用。
+    """
+
+    __slots__ = (
+        "name",
+        "request_seconds",
+        "queue_seconds",
+        "admit_seconds",
+        "scale_seconds",
+        "ready_seconds",
+        "schedule_seconds",
+        "upstream_seconds",
+        "cold_starts",
+        "cold_start_seconds",
+        "hedges_sent",
+        "hedges_won",
+        "retries",
+        "_codes",
+        "_errors",
+    )
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.request_seconds = REQUEST_SECONDS.labels(name)
+        self.queue_seconds = PHASE_SECONDS.labels(name, PHASE_QUEUE)
+        self.admit_seconds = PHASE_SECONDS.labels(name, PHASE_ADMIT)
+        self.scale_seconds = PHASE_SECONDS.labels(name, PHASE_SCALE)
+        self.ready_seconds = PHASE_SECONDS.labels(name, PHASE_READY)
+        self.schedule_seconds = PHASE_SECONDS.labels(name, PHASE_SCHEDULE)
+        self.upstream_seconds = PHASE_SECONDS.labels(name, PHASE_UPSTREAM)
+        self.cold_starts = COLD_STARTS.labels(name)
+        self.cold_start_seconds = COLD_START_SECONDS.labels(name)
+        self.hedges_sent = HEDGES.labels(name, "sent")
+        self.hedges_won = HEDGES.labels(name, "won")
+        self.retries = RETRIES.labels(name)
+        self._codes: Dict[int, Counter] = {}
+        self._errors: Dict[str, Counter] = {}
+
+    def count_request(self, status_code: int) -> None:
+        child = self._codes.get(status_code)
+        if child is None:
+            child = REQUESTS.labels(self.name, str(status_code))
+            self._codes[status_code] = child
+        child.inc()
+
+    def count_upstream_error(self, reason: str) -> None:
+        child = self._errors.get(reason)
+        if child is None:
+            child = UPSTREAM_ERRORS.labels(self.name, reason)
+            self._errors[reason] = child
+        child.inc()
+
+    def remove(self) -> None:
+        """
+        函数删除后移除它的全部时间序列。
+        """
+        for metric, labels in (
+            (REQUEST_SECONDS, (self.name,)),
+            (PHASE_SECONDS, (self.name, PHASE_QUEUE)),
+            (PHASE_SECONDS, (self.name, PHASE_ADMIT)),
+            (PHASE_SECONDS, (self.name, PHASE_SCALE)),
+            (PHASE_SECONDS, (self.name, PHASE_READY)),
+            (PHASE_SECONDS, (self.name, PHASE_SCHEDULE)),
+            (PHASE_SECONDS, (self.name, PHASE_UPSTREAM)),
+            (COLD_STARTS, (self.name,)),
+            (COLD_START_SECONDS, (self.name,)),
+            (HEDGES, (self.name, "sent")),
+            (HEDGES, (self.name, "won")),
+            (RETRIES, (self.name,)),
+        ):
+            _safe_remove(metric, labels)
+        for code in self._codes:
+            _safe_remove(REQUESTS, (self.name, str(code)))
+        for reason in self._errors:
+            _safe_remove(UPSTREAM_ERRORS, (self.name, reason))
+
+
+def _safe_remove(metric, labels: Tuple[str, ...]) -> None:
+    try:
+        metric.remove(*labels)
+    except KeyError:
+        pass
+
+
+class StateCollector(Collector):
+    """
+    抓取时才读取网关内存状态的指标（在途数、排队数、合并统计等），
+    请求路径上不产生任何额外开销。
+    """
+
+    def __init__(
+        self,
+        gauges: Iterable[Tuple[str, str, Callable[[], Dict[str, float]]]] = (),
+        counters: Iterable[Tuple[str, str, Callable[[], Dict[str, float]]]] = (),
+    ) -> None:
+        self._gauges = list(gauges)
+        self._counters = list(counters)
+
+    def collect(self) -> Iterator:
+        for name, documentation, read in self._gauges:
+            family = GaugeMetricFamily(name, documentation, labels=["function"])
+            for fn_name, value in read().items():
+                family.add_metric([fn_name], value)
+            yield family
+        for name, documentation, read in self._counters:
+            family = CounterMetricFamily(name, documentation, labels=["function"])
+            for fn_name, value in read().items():
+                family.add_metric([fn_name], value)
+            yield family
+
+    def describe(self) -> Iterator:
+        return iter(())
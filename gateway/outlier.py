@@ -0,0 +1,190 @@
+import statistics
+import time
+from typing import Dict, Iterable, List, Optional, Set
+
+
+class _Health:
+    __slots__ = (
+        "failures",
+        "ejections",
+        "ejected_until",
+        "readmitted_at",
+        "probing",
+        "probe_inflight",
+        "latency",
+        "samples",
+    )
+
+    def __init__(self) -> None:
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.readmitted_at = 0.0
+        # 摘除到期后处于试探状态：同一时间只放行一个请求，成功才完全恢复
+        self.probing = False
+        self.probe_inflight = False
+        self.latency = 0.0
+        self.samples = 0
+
+
+class OutlierDetector:
+    """
+    按 Pod 地址跟踪健康状况并摘除异常实例：
+    - 连续 consecutive_failures 次失败（连接失败、超时、Runner 加载代码失败等）立即摘除；
+    - 成功响应耗时的 EWMA 超过同一 Service 其他实例中位数的 latency_factor 倍时摘除，
+      同时被摘除的实例不超过 max_latency_ejection_ratio，且至少留下一个实例，整体变慢时不摘除；
+    - 第 n 次摘除时长为 base_ejection_seconds * 2^(n-1)，不超过 max_ejection_seconds；
+      到期后先放行一个试探请求，失败则以加倍时长再次摘除，成功后恢复，
+      恢复后稳定超过 max_ejection_seconds 时摘除次数清零。
+
+    所有方法都只在事件循环线程中调用，无需加锁。
+    """
+
+    def __init__(
+        self,
+        consecutive_failures: int = 5,
+        base_ejection_seconds: float = 10.0,
+        max_ejection_seconds: float = 300.0,
+        latency_factor: float = 3.0,
+        latency_min_samples: int = 20,
+        latency_alpha: float = 0.1,
+        max_latency_ejection_ratio: float = 0.5,
+    ) -> None:
+        self.consecutive_failures = consecutive_failures
+        self.base_ejection_seconds = base_ejection_seconds
+        self.max_ejection_seconds = max_ejection_seconds
+        self.latency_factor = latency_factor
+        self.latency_min_samples = latency_min_samples
+        self.latency_alpha = latency_alpha
+        self.max_latency_ejection_ratio = max_latency_ejection_ratio
+        self._health: Dict[str, _Health] = {}
+
+    def unavailable(self, addresses: Iterable[str]) -> Set[str]:
+        """
+        当前不应接收请求的地址：摘除中，或已有试探请求在途。
+        """
+        now = time.monotonic()
+        result = set()
+        for address in addresses:
+            health = self._health.get(address)
+            if health is None:
+                continue
+            if health.ejected_until > now or (health.probing and health.probe_inflight):
+                result.add(address)
+        return result
+
+    def ejected(self, addresses: Iterable[str]) -> int:
+        now = time.monotonic()
+        return sum(
+            1 for a in addresses if a in self._health and self._health[a].ejected_until > now
+        )
+
+    def retry_after(self, addresses: Iterable[str]) -> float:
+        """
+        最早一个实例可以重新试探的秒数（0 表示只是在等试探结果）。
+        """
+        now = time.monotonic()
+        waits = [
+            self._health[a].ejected_until - now for a in addresses if a in self._health
+        ]
+        return max(0.0, min(waits)) if waits else 0.0
+
+    def begin(self, address: str) -> None:
+        """
+        请求即将发往 address；试探状态下占住唯一的试探名额。
+        """
+        health = self._health.get(address)
+        if health is not None and health.probing and health.ejected_until <= time.monotonic():
+            health.probe_inflight = True
+
+    def abandon(self, address: str) -> None:
+        """
+        请求没有得出结论（被取消、受调用方截止时间限制等），释放试探名额。
+        """
+        health = self._health.get(address)
+        if health is not None:
+            health.probe_inflight = False
+
+    def success(self, address: str, latency: Optional[float], peers: List[str]) -> Optional[str]:
+        """
+        记录一次成功；因延迟离群被摘除时返回原因。
+        """
+        health = self._get(address)
+        health.failures = 0
+        if health.probing:
+            health.probing = False
+            health.probe_inflight = False
+            health.readmitted_at = time.monotonic()
+            print(f"实例 {address} 试探成功，恢复接收流量")
+        if latency is None:
+            return None
+        if health.samples == 0:
+            health.latency = latency
+        else:
+            health.latency += self.latency_alpha * (latency - health.latency)
+        health.samples += 1
+        if health.samples < self.latency_min_samples:
+            return None
+
+        others = [self._health.get(a) for a in peers if a != address]
+        now = time.monotonic()
+        baseline = [
+            h.latency
+            for h in others
+            if h is not None and h.samples >= self.latency_min_samples and h.ejected_until <= now
+        ]
+        if not baseline:
+            return None
+        median = statistics.median(baseline)
+        if median <= 0 or health.latency <= median * self.latency_factor:
+            return None
+        if self.ejected(peers) + 1 > len(peers) * self.max_latency_ejection_ratio:
+            return None
+        reason = f"平均耗时 {health.latency * 1000:.0f}ms，为其他实例中位数的 {health.latency / median:.1f} 倍"
+        self._eject(address, health, reason)
+        return reason
+
+    def failure(self, address: str) -> Optional[str]:
+        """
+        记录一次失败；因此被摘除时返回原因。
+        """
+        health = self._get(address)
+        health.failures += 1
+        if health.probing:
+            reason = "试探请求失败"
+        elif health.failures >= self.consecutive_failures:
+            reason = f"连续失败 {health.failures} 次"
+        else:
+            return None
+        self._eject(address, health, reason)
+        return reason
+
+    def retain(self, addresses: Iterable[str]) -> None:
+        """
+        只保留仍在 EndpointSlice 中的地址，Pod 替换后旧地址的状态不会堆积。
+        """
+        live = set(addresses)
+        for address in [a for a in self._health if a not in live]:
+            del self._health[address]
+
+    def _get(self, address: str) -> _Health:
+        health = self._health.get(address)
+        if health is None:
+            health = _Health()
+            self._health[address] = health
+        return health
+
+    def _eject(self, address: str, health: _Health, reason: str) -> None:
+        now = time.monotonic()
+        if health.readmitted_at and now - health.readmitted_at > self.max_ejection_seconds:
+            health.ejections = 0
+        duration = min(self.max_ejection_seconds, self.base_ejection_seconds * 2 ** health.ejections)
+        health.ejections += 1
+        health.ejected_until = now + duration
+        health.probing = True
+        health.probe_inflight = False
+        health.failures = 0
+        # 恢复后重新积累耗时样本，不沿用摘除前的异常值
+        health.latency = 0.0
+        health.samples = 0
+        print(f"实例 {address} 被摘除 {duration:g}s（第 {health.ejections} 次）：{reason}")
@@ -0,0 +1,171 @@
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+SECONDS_PER_DAY = 24 * 3600
+
+
+class ArrivalProfile:
+    """
+    单个函数的到达历史：按 bucket_seconds 分桶计数，每个“一天中的时段”保存一个跨天 EWMA，
+    即按天为周期的季节性预测（每小时任务、工作时间流量都会体现为固定时段的高值）。
+    只保留 slots 个浮点数和当前桶的计数，内存与运行时长无关。
+    """
+
+    __slots__ = ("bucket_seconds", "alpha", "seasonal", "_bucket", "_count")
+
+    def __init__(self, bucket_seconds: float, alpha: float) -> None:
+        self.bucket_seconds = bucket_seconds
+        self.alpha = alpha
+        self.seasonal: List[float] = [0.0] * self.slots
+        self._bucket: Optional[int] = None
+        self._count = 0
+
+    @property
+    def slots(self) -> int:
+        return max(1, int(SECONDS_PER_DAY // self.bucket_seconds))
+
+    def record(self, now: float, count: int = 1) -> None:
+        self._advance(now)
+        self._count += count
+
+    def forecast(self, at: float) -> float:
+        """
+        预测 at 所在时段的到达数（每桶）。
+        """
+        return self.seasonal[self._slot(int(at // self.bucket_seconds))]
+
+    def _slot(self, bucket: int) -> int:
+        return bucket % self.slots
+
+    def _advance(self, now: float) -> None:
+        bucket = int(now // self.bucket_seconds)
+        if self._bucket is None:
+            self._bucket = bucket
+            return
+        if bucket <= self._bucket:
+            return
+        # 结束的桶并入对应时段；中间没有请求的桶按 0 并入（最多回补一整天）
+        self._fold(self._bucket, self._count)
+        for skipped in range(max(self._bucket + 1, bucket - self.slots), bucket):
+            self._fold(skipped, 0)
+        self._bucket = bucket
+        self._count = 0
+
+    def _fold(self, bucket: int, count: int) -> None:
+        slot = self._slot(bucket)
+        self.seasonal[slot] += self.alpha * (count - self.seasonal[slot])
+
+
+class PrewarmWindow:
+    """
+    一次预热：started_at 为下发扩容的时刻（墙钟）。
+    """
+
+    __slots__ = ("started_at",)
+
+    def __init__(self, started_at: float) -> None:
+        self.started_at = started_at
+
+
+class Prewarmer:
+    """
+    根据到达历史预测即将到来的流量，在函数缩到 0 时提前拉起一个副本，并统计效果：
+    - avoided：预热后第一个请求到达时函数已就绪，即避免的一次冷启动；
+    - replica_seconds：预热副本在第一个请求到达（或未用上而被缩回 0）之前空转的时长。
+    """
+
+    def __init__(self, bucket_seconds: float, alpha: float, threshold: float) -> None:
+        self.bucket_seconds = bucket_seconds
+        self.alpha = alpha
+        self.threshold = threshold
+        self._profiles: Dict[str, ArrivalProfile] = {}
+        self._windows: Dict[str, PrewarmWindow] = {}
+        # 函数名 -> [预热次数, 避免的冷启动次数, 额外副本秒数]
+        self._stats: Dict[str, List[float]] = {}
+
+    def record(self, fn_name: str, now: float) -> None:
+        profile = self._profiles.get(fn_name)
+        if profile is None:
+            profile = ArrivalProfile(self.bucket_seconds, self.alpha)
+            self._profiles[fn_name] = profile
+        profile.record(now)
+
+    def due(self, now: float, lead_seconds: float) -> List[Tuple[str, float]]:
+        """
+        预计 lead_seconds 后所在时段的到达数达到阈值、且尚未预热的函数及其预测值。
+        """
+        result = []
+        for fn_name, profile in self._profiles.items():
+            if fn_name in self._windows:
+                continue
+            # 推进时钟，让长时间没有请求的函数也把空桶并入历史
+            profile.record(now, 0)
+            forecast = profile.forecast(now + lead_seconds)
+            if forecast >= self.threshold:
+                result.append((fn_name, forecast))
+        return result
+
+    def started(self, fn_name: str, now: float) -> None:
+        self._windows[fn_name] = PrewarmWindow(now)
+        self._stat(fn_name)[0] += 1
+
+    def on_arrival(self, fn_name: str, now: float, warm: bool) -> None:
+        """
+        预热后的第一个请求：函数已就绪则计为避免了一次冷启动，此前的空转计入额外副本秒数。
+        """
+        window = self._windows.pop(fn_name, None)
+        if window is None:
+            return
+        stats = self._stat(fn_name)
+        if warm:
+            stats[1] += 1
+        stats[2] += max(0.0, now - window.started_at)
+
+    def on_scaled_to_zero(self, fn_name: str, now: float) -> None:
+        """
+        预热的副本没等到请求就被缩回 0：整段时长都是额外开销。
+        """
+        window = self._windows.pop(fn_name, None)
+        if window is not None:
+            self._stat(fn_name)[2] += max(0.0, now - window.started_at)
+
+    def forget(self, fn_name: str) -> None:
+        self._profiles.pop(fn_name, None)
+        self._windows.pop(fn_name, None)
+        self._stats.pop(fn_name, None)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            fn_name: {
+                "prewarms": prewarms,
+                "avoided_cold_starts": avoided,
+                "extra_replica_seconds": round(replica_seconds, 3),
+            }
+            for fn_name, (prewarms, avoided, replica_seconds) in self._stats.items()
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        可 JSON 序列化的到达历史，网关重启后用 restore 恢复，不必重新积累多天的数据。
+        """
+        return {
+            "bucket_seconds": self.bucket_seconds,
+            "profiles": {fn: p.seasonal for fn, p in self._profiles.items()},
+        }
+
+    def restore(self, data: Dict[str, Any]) -> None:
+        if not math.isclose(float(data.get("bucket_seconds", 0)), self.bucket_seconds):
+            # 分桶粒度变了，旧历史无法对齐，直接丢弃
+            return
+        for fn_name, seasonal in data.get("profiles", {}).items():
+            profile = ArrivalProfile(self.bucket_seconds, self.alpha)
+            if len(seasonal) == profile.slots:
+                profile.seasonal = [float(v) for v in seasonal]
+                self._profiles[fn_name] = profile
+
+    def _stat(self, fn_name: str) -> List[float]:
+        stats = self._stats.get(fn_name)
+        if stats is None:
+            stats = [0, 0, 0.0]
+            self._stats[fn_name] = stats
+        return stats
@@ -0,0 +1,122 @@
+import abc
+import time
+from collections import OrderedDict
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import RedisError
+except ImportError:  # 可选依赖，只有共享后端需要
+    aioredis = None
+    RedisError = OSError
+
+
+class RateLimiter(abc.ABC):
+    """
+    令牌桶限流：每个 key 一个桶，容量 burst，每秒补充 rate 个令牌，每次调用取走 cost 个。
+    try_acquire 放行时返回 0，否则返回需要等待的秒数（供 Retry-After 使用）。
+    cost 为负数时把令牌还回桶中（不超过 burst），总是放行。
+    """
+
+    @abc.abstractmethod
+    async def try_acquire(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        ...
+
+    async def refund(self, key: str, rate: float, burst: float, cost: float = 1.0) -> None:
+        """
+        退还已扣减的 cost 个令牌：同一请求的其他限额拒绝时，不让已通过的桶白白扣减。
+        """
+        await self.try_acquire(key, rate, burst, -cost)
+
+    async def close(self) -> None:
+        pass
+
+
+class LocalRateLimiter(RateLimiter):
+    """
+    进程内令牌桶：每个桶只有 (令牌数, 更新时间) 两个数，检查为 O(1)。
+    桶数量超过 max_keys 时淘汰最久未使用的桶（被淘汰的桶多半早已补满，重建即是满桶），内存有上限。
+    多副本网关各自计数，总速率约为 限额 * 副本数。
+    """
+
+    def __init__(self, max_keys: int) -> None:
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def try_acquire(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        return self.take(key, rate, burst, cost)
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [burst, now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= cost:
+            bucket[0] = min(burst, bucket[0] - cost)
+            return 0.0
+        return (cost - bucket[0]) / rate
+
+
+# 原子地补充并扣减令牌；时间取 Redis 服务器时钟，避免各网关时钟偏差。
+# 桶在补满所需时间后过期，Redis 中的 key 数量同样有上限。
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(data[1]) or burst
+local updated = tonumber(data[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= cost then
+  tokens = math.min(burst, tokens - cost)
+else
+  wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisRateLimiter(RateLimiter):
+    """
+    共享令牌桶：所有网关副本使用同一个 Redis，限额对整个集群生效。
+    Redis 不可用或超过 timeout 未响应时回退到本地令牌桶（各副本独立计数），
+    不因限流后端故障拒绝全部请求，也不让限流检查拖慢调用。
+    """
+
+    def __init__(self, url: str, prefix: str, timeout: float, fallback: LocalRateLimiter) -> None:
+        assert aioredis is not None, "共享限流后端需要安装 redis 包"
+        self.prefix = prefix
+        self.fallback = fallback
+        self._redis = aioredis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self._script = self._redis.register_script(_TOKEN_BUCKET_SCRIPT)
+        self._degraded = False
+
+    async def try_acquire(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        try:
+            wait = float(await self._script(keys=[self.prefix + key], args=[rate, burst, cost]))
+        except (RedisError, OSError) as e:
+            if not self._degraded:
+                self._degraded = True
+                print(f"共享限流后端不可用，回退到本地令牌桶: {e}")
+            return self.fallback.take(key, rate, burst, cost)
+        if self._degraded:
+            self._degraded = False
+            print("共享限流后端已恢复")
+        return wait
+
+    async def close(self) -> None:
+        await self._redis.close()
@@ -0,0 +1,154 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+# 优先级类别，数值越小越先调度
+PRIORITY_CLASSES = {"high": 0, "normal": 1, "low": 2}
+DEFAULT_PRIORITY_CLASS = "normal"
+
+# 调度流：(函数名, 优先级类别)
+FlowKey = Tuple[str, int]
+
+
+class SchedulerQueueFull(Exception):
+    """调度队列已满，且本请求所在的流排队最长，调用方应快速拒绝。"""
+
+
+class SchedulerTimeout(Exception):
+    """请求在调度队列中等待超过上限。"""
+
+
+class _Waiter:
+    __slots__ = ("start", "seq", "future")
+
+    def __init__(self, start: float, seq: int, future: asyncio.Future) -> None:
+        self.start = start
+        self.seq = seq
+        self.future = future
+
+
+class _Flow:
+    __slots__ = ("last_finish", "waiters")
+
+    def __init__(self) -> None:
+        self.last_finish = 0.0
+        self.waiters: Deque[_Waiter] = deque()
+
+
+class FairScheduler:
+    """
+    网关全局的上游并发名额，饱和时按函数排队并加权公平放行（start-time fair queuing）：
+    - 每个（函数, 优先级类别）是一个流，请求入队时打上虚拟开始时间
+      max(当前虚拟时间, 该流上一个请求的结束标签)，结束标签 = 开始 + 1 / weight；
+    - 有空位时先看优先级类别（严格优先），同类别内放行开始标签最小的请求，
+      权重为 w 的函数长期获得约 w 倍的放行份额，空闲的流不会积攒额度；
+    - 排队总数达到 max_queued 时丢弃排队最长的流中最新的请求，热点函数不能挤占其他函数的排队位置。
+
+    未饱和时 acquire 只是一次计数，没有排队开销。
+    """
+
+    def __init__(self, capacity: int, max_queued: int) -> None:
+        self.capacity = capacity
+        self.max_queued = max_queued
+        self.inflight = 0
+        self._virtual_time = 0.0
+        self._flows: Dict[FlowKey, _Flow] = {}
+        self._queued = 0
+        self._seq = itertools.count()
+
+    def queued(self) -> Dict[str, int]:
+        result: Dict[str, int] = {}
+        for (fn_name, _), flow in self._flows.items():
+            if flow.waiters:
+                result[fn_name] = result.get(fn_name, 0) + len(flow.waiters)
+        return result
+
+    async def acquire(
+        self,
+        fn_name: str,
+        weight: float,
+        priority: int,
+        timeout: Optional[float] = None,
+    ) -> float:
+        """
+        等待一个上游名额，返回排队秒数；拿到名额后调用方必须 release。
+        """
+        if self._queued == 0 and self.inflight < self.capacity:
+            self.inflight += 1
+            return 0.0
+
+        key = (fn_name, priority)
+        flow = self._flows.get(key)
+        if flow is None:
+            flow = _Flow()
+            self._flows[key] = flow
+        if self._queued >= self.max_queued and not self._evict(flow):
+            raise SchedulerQueueFull(fn_name)
+
+        start = max(self._virtual_time, flow.last_finish)
+        flow.last_finish = start + 1.0 / max(weight, 1e-6)
+        waiter = _Waiter(start, next(self._seq), asyncio.get_running_loop().create_future())
+        flow.waiters.append(waiter)
+        self._queued += 1
+        enqueued_at = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=timeout)
+        except BaseException as e:
+            if not waiter.future.done():
+                waiter.future.cancel()
+                self._discard(key, waiter)
+            elif not waiter.future.cancelled() and waiter.future.exception() is None:
+                # 已被放行但调用方因取消或超时离开，名额交给下一个请求
+                self.release()
+            if isinstance(e, asyncio.TimeoutError):
+                raise SchedulerTimeout(fn_name)
+            raise
+        return time.monotonic() - enqueued_at
+
+    def release(self) -> None:
+        if self.inflight > 0:
+            self.inflight -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._queued and self.inflight < self.capacity:
+            _, flow = min(
+                ((k, f) for k, f in self._flows.items() if f.waiters),
+                key=lambda item: (item[0][1], item[1].waiters[0].start, item[1].waiters[0].seq),
+            )
+            waiter = flow.waiters.popleft()
+            self._queued -= 1
+            self._virtual_time = max(self._virtual_time, waiter.start)
+            self.inflight += 1
+            waiter.future.set_result(None)
+        if self._queued == 0:
+            # 队列清空即退出饱和状态，各流的标签不再有意义，下次饱和重新开始计算
+            self._flows.clear()
+            return
+        # 清理已经追上虚拟时间的空闲流，流的数量不随函数名增长
+        for key in [k for k, f in self._flows.items() if not f.waiters and f.last_finish <= self._virtual_time]:
+            del self._flows[key]
+
+    def _evict(self, incoming: _Flow) -> bool:
+        """
+        队列满时让排队最长的流让出最新的一个位置；新请求所在的流本身最长时返回 False。
+        """
+        longest = max(self._flows.values(), key=lambda f: len(f.waiters))
+        if longest is incoming or len(longest.waiters) <= len(incoming.waiters):
+            return False
+        waiter = longest.waiters.pop()
+        self._queued -= 1
+        waiter.future.set_exception(SchedulerQueueFull())
+        return True
+
+    def _discard(self, key: FlowKey, waiter: _Waiter) -> None:
+        flow = self._flows.get(key)
+        if flow is None:
+            return
+        try:
+            flow.waiters.remove(waiter)
+        except ValueError:
+            return
+        self._queued -= 1
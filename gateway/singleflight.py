@@ -0,0 +1,63 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+
+class SingleFlight:
+    """
+    请求合并：同一 key 的并发调用只执行一次 func，所有等待者拿到同一个结果或异常。
+
+    func 在独立任务中执行，发起它的客户端断开不会影响其他等待者。
+    同时按函数统计上游实际调用数与被合并的调用数，用于计算合并比例。
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        # 函数名 -> [上游调用数, 被合并的调用数]
+        self._stats: Dict[str, List[int]] = {}
+
+    async def do(
+        self,
+        fn_name: str,
+        key: Hashable,
+        func: Callable[[], Awaitable[Any]],
+    ) -> Tuple[Any, bool]:
+        """
+        返回 (结果, 是否复用了其他请求的调用)。
+        """
+        stats = self._stats.get(fn_name)
+        if stats is None:
+            stats = [0, 0]
+            self._stats[fn_name] = stats
+
+        task = self._calls.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+            stats[0] += 1
+        else:
+            stats[1] += 1
+        return await asyncio.shield(task), shared
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for fn_name, (calls, coalesced) in self._stats.items():
+            total = calls + coalesced
+            result[fn_name] = {
+                "upstream_calls": calls,
+                "coalesced": coalesced,
+                # 合并比例：每次上游调用平均服务的请求数
+                "collapse_ratio": total / calls if calls else 0.0,
+            }
+        return result
+
+    def forget(self, fn_name: str) -> None:
+        self._stats.pop(fn_name, None)
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 所有等待者都已取消时也要取走异常，避免 "exception was never retrieved"
+        if not task.cancelled():
+            task.exception()
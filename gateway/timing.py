@@ -0,0 +1,66 @@
+from typing import List, Optional, Tuple
+
+# 网关侧阶段名：queue=激活队列等待，admit=等待全局冷启动名额，scale=扩容请求，ready=调度 + 就绪，
+# schedule=网关饱和时的公平排队，upstream=转发到 Runner 并拿到响应头，total=网关内总耗时；
+# Runner 侧为 load / exec
+SERVER_TIMING_HEADER = "Server-Timing"
+COLD_START_HEADER = "X-FaaS-Cold-Start"
+
+
+class Activation:
+    """
+    一次激活的结果，由唤醒任务返回给同一队列中的所有请求。
+    """
+
+    __slots__ = ("cold_start", "admit_seconds", "scale_seconds", "ready_seconds")
+
+    def __init__(
+        self,
+        cold_start: bool = False,
+        scale_seconds: float = 0.0,
+        ready_seconds: float = 0.0,
+        admit_seconds: float = 0.0,
+    ) -> None:
+        self.cold_start = cold_start
+        self.admit_seconds = admit_seconds
+        self.scale_seconds = scale_seconds
+        self.ready_seconds = ready_seconds
+
+
+class ServerTiming:
+    """
+    单个请求的分阶段耗时，输出为 Server-Timing 头（dur 单位为毫秒）。
+    """
+
+    __slots__ = ("cold_start", "_entries")
+
+    def __init__(self) -> None:
+        self.cold_start = False
+        self._entries: List[Tuple[str, float]] = []
+
+    def add(self, name: str, seconds: float) -> None:
+        self._entries.append((name, seconds))
+
+    def add_activation(self, waited: float, activation: Optional[Activation]) -> None:
+        """
+        queue 为本请求在激活队列中的总等待；admit / scale / ready 是它所等待的那次激活的阶段耗时，
+        中途入队的请求 queue 可能小于三者之和。
+        """
+        self.add("queue", waited)
+        if activation is None:
+            return
+        self.cold_start = activation.cold_start
+        if activation.admit_seconds > 0:
+            self.add("admit", activation.admit_seconds)
+        if activation.cold_start:
+            self.add("scale", activation.scale_seconds)
+        self.add("ready", activation.ready_seconds)
+
+    def header_value(self, upstream: Optional[str] = None) -> str:
+        """
+        网关条目在前，Runner 返回的 Server-Timing 原样追加在后。
+        """
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self._entries]
+        if upstream:
+            parts.append(upstream)
+        return ", ".join(parts)
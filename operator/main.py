@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import os
 import traceback
@@ -16,6 +17,18 @@ CRD_PLURAL = "functions"
 # 默认镜像（假设你有一个能从 ConfigMap 挂载并执行 Python 代码的 FaaS Runtime 镜像）
 DEFAULT_RUNTIME_IMAGE = os.getenv("FAAS_RUNTIME_IMAGE", "faas-python-runner:latest")
 DEFAULT_PORT = int(os.getenv("FAAS_SERVICE_PORT", "8080"))
+# 单个 Pod 期望承载的并发请求数，网关冷启动时据此计算初始副本数
+DEFAULT_TARGET_CONCURRENCY = 10
+# 空闲多少秒后缩容到 0（仅 minReplicas 为 0 时生效），0 表示不缩容
+DEFAULT_SCALE_TO_ZERO_AFTER = 300
+# 网关 GET 响应缓存 TTL（秒），0 表示不缓存
+DEFAULT_RESPONSE_CACHE_TTL = 0
+# 网关饱和时的调度优先级类别（与网关一致），默认 normal
+PRIORITY_CLASSES = ("high", "normal", "low")
+DEFAULT_PRIORITY_CLASS = "normal"
+
+# 网关读取的函数级配置统一放在 Deployment 注解上，前缀与 CRD group 一致
+ANNOTATION_PREFIX = f"{CRD_GROUP}/"
 
 # 全局 K8s 客户端，在 startup 时初始化
 apps_v1_api: Optional[client.AppsV1Api] = None
@@ -87,6 +100,95 @@ def validate_spec(spec: Dict[str, Any]) -> None:
     if min_replicas > max_replicas:
         raise kopf.PermanentError("spec.minReplicas 不能大于 spec.maxReplicas。")
 
+    target_concurrency = spec.get("targetConcurrency", DEFAULT_TARGET_CONCURRENCY)
+    if not isinstance(target_concurrency, int) or target_concurrency < 1:
+        raise kopf.PermanentError("spec.targetConcurrency 必须是 >= 1 的整数。")
+
+    scale_to_zero_after = spec.get("scaleToZeroAfter", DEFAULT_SCALE_TO_ZERO_AFTER)
+    if not isinstance(scale_to_zero_after, int) or scale_to_zero_after < 0:
+        raise kopf.PermanentError("spec.scaleToZeroAfter 必须是 >= 0 的整数（秒）。")
+
+    response_cache_ttl = spec.get("responseCacheTTL", DEFAULT_RESPONSE_CACHE_TTL)
+    if not isinstance(response_cache_ttl, int) or response_cache_ttl < 0:
+        raise kopf.PermanentError("spec.responseCacheTTL 必须是 >= 0 的整数（秒）。")
+
+    if not isinstance(spec.get("coalesceRequests", False), bool):
+        raise kopf.PermanentError("spec.coalesceRequests 必须是布尔值。")
+
+    if not isinstance(spec.get("hedgeRequests", False), bool):
+        raise kopf.PermanentError("spec.hedgeRequests 必须是布尔值。")
+
+    batch_size = spec.get("batchSize", 0)
+    if not isinstance(batch_size, int) or batch_size < 0:
+        raise kopf.PermanentError("spec.batchSize 必须是 >= 0 的整数。")
+
+    weight = spec.get("weight", 1)
+    if isinstance(weight, bool) or not isinstance(weight, int) or weight < 1:
+        raise kopf.PermanentError("spec.weight 必须是 >= 1 的整数。")
+
+    if spec.get("priorityClass", DEFAULT_PRIORITY_CLASS) not in PRIORITY_CLASSES:
+        raise kopf.PermanentError(f"spec.priorityClass 必须是 {' / '.join(PRIORITY_CLASSES)} 之一。")
+
+    for field in ("timeoutSeconds", "coldStartTimeoutSeconds"):
+        value = spec.get(field)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            raise kopf.PermanentError(f"spec.{field} 必须是 > 0 的数字（秒）。")
+
+    rate_limit = spec.get("rateLimit") or {}
+    if not isinstance(rate_limit, dict):
+        raise kopf.PermanentError("spec.rateLimit 必须是对象。")
+    for field in ("requestsPerSecond", "perCallerRequestsPerSecond"):
+        value = rate_limit.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0):
+            raise kopf.PermanentError(f"spec.rateLimit.{field} 必须是 > 0 的数字。")
+    for field in ("burst", "perCallerBurst"):
+        value = rate_limit.get(field)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value < 1):
+            raise kopf.PermanentError(f"spec.rateLimit.{field} 必须是 >= 1 的整数。")
+
+
+def code_version(code: str) -> str:
+    """
+    源码版本号：sha256 前 16 位。Runner 会在响应中回报同样的值，网关据此让缓存随代码失效。
+    """
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()[:16]
+
+
+def build_gateway_annotations(spec: Dict[str, Any]) -> Dict[str, str]:
+    """
+    把网关需要的 spec 字段转换为 Deployment 注解。
+    网关已经 watch 函数 Deployment，读取注解即可，无需额外访问 Function CRD。
+    """
+    rate_limit = spec.get("rateLimit") or {}
+    return {
+        f"{ANNOTATION_PREFIX}min-replicas": str(spec.get("minReplicas", 0)),
+        f"{ANNOTATION_PREFIX}max-replicas": str(spec.get("maxReplicas")),
+        f"{ANNOTATION_PREFIX}target-concurrency": str(
+            spec.get("targetConcurrency", DEFAULT_TARGET_CONCURRENCY)
+        ),
+        f"{ANNOTATION_PREFIX}scale-to-zero-after": str(
+            spec.get("scaleToZeroAfter", DEFAULT_SCALE_TO_ZERO_AFTER)
+        ),
+        f"{ANNOTATION_PREFIX}response-cache-ttl": str(
+            spec.get("responseCacheTTL", DEFAULT_RESPONSE_CACHE_TTL)
+        ),
+        f"{ANNOTATION_PREFIX}coalesce-requests": str(bool(spec.get("coalesceRequests", False))).lower(),
+        f"{ANNOTATION_PREFIX}hedge-requests": str(bool(spec.get("hedgeRequests", False))).lower(),
+        f"{ANNOTATION_PREFIX}batch-size": str(spec.get("batchSize", 0)),
+        f"{ANNOTATION_PREFIX}weight": str(spec.get("weight", 1)),
+        f"{ANNOTATION_PREFIX}priority-class": spec.get("priorityClass", DEFAULT_PRIORITY_CLASS),
+        # 未设置时写空值，网关回退到全局缺省；字段被删除时也能覆盖旧注解
+        f"{ANNOTATION_PREFIX}timeout-seconds": str(spec.get("timeoutSeconds", "")),
+        f"{ANNOTATION_PREFIX}cold-start-timeout-seconds": str(spec.get("coldStartTimeoutSeconds", "")),
+        f"{ANNOTATION_PREFIX}rate-limit": str(rate_limit.get("requestsPerSecond", "")),
+        f"{ANNOTATION_PREFIX}rate-limit-burst": str(rate_limit.get("burst", "")),
+        f"{ANNOTATION_PREFIX}caller-rate-limit": str(rate_limit.get("perCallerRequestsPerSecond", "")),
+        f"{ANNOTATION_PREFIX}caller-rate-limit-burst": str(rate_limit.get("perCallerBurst", "")),
+        f"{ANNOTATION_PREFIX}code-version": code_version(spec.get("code", "")),
+    }
+
 
 def build_configmap_body(
     name: str,
@@ -151,6 +253,7 @@ def build_deployment_body(
         name=name,
         namespace=namespace,
         labels=labels,
+        annotations=build_gateway_annotations(spec),
         owner_references=[
             client.V1OwnerReference(
                 api_version=f"{CRD_GROUP}/{CRD_VERSION}",
@@ -1,8 +1,11 @@
 import os
 import sys
+import hashlib
 import importlib.util
 import traceback
 import inspect
+import time
+from collections import deque
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse, PlainTextResponse
 
@@ -24,11 +27,135 @@ def load_user_module():
     except Exception as e:
         return None, f"Module load error: {traceback.format_exc()}"
 
+def code_version():
+    """当前挂载代码的版本：源码 sha256 前 16 位，与控制面写入的注解一致"""
+    try:
+        with open(CODE_PATH, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()[:16]
+    except OSError:
+        return None
+
+# 网关批量调用入口：一次请求携带一组事件，用户代码只加载一次
+BATCH_PATH = "/_faas/batch"
+
+# 网关写入的本次调用剩余预算（秒）；来不及完成的调用直接拒绝，不占用执行
+DEADLINE_HEADER = "X-FaaS-Timeout"
+DEADLINE_EXCEEDED_HEADER = "X-FaaS-Deadline-Exceeded"
+# 本实例自身的故障（如加载用户代码失败），网关据此摘除实例；用户代码抛出的异常不带此头
+RUNNER_ERROR_HEADER = "X-FaaS-Runner-Error"
+# 最近若干次执行耗时，取最小值作为“至少需要多久”的保守估计
+recent_exec_seconds = deque(maxlen=50)
+
+def request_deadline(request: Request):
+    """把剩余预算换算为本地 monotonic 截止时刻，没有或无法解析时返回 None"""
+    value = request.headers.get(DEADLINE_HEADER)
+    if value is None:
+        return None
+    try:
+        return time.monotonic() + float(value)
+    except ValueError:
+        return None
+
+def deadline_error(deadline):
+    """已过截止时间，或剩余时间比最近最快的一次执行还短时，返回拒绝原因"""
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return "Deadline exceeded before execution started."
+    if recent_exec_seconds and remaining < min(recent_exec_seconds):
+        return (
+            f"Remaining budget {remaining * 1000:.1f}ms is shorter than the fastest "
+            f"recent execution ({min(recent_exec_seconds) * 1000:.1f}ms)."
+        )
+    return None
+
+def deadline_response(reason):
+    return JSONResponse(
+        status_code=504,
+        content={"error": reason},
+        headers={DEADLINE_EXCEEDED_HEADER: "true"},
+    )
+
+def load_error_response(err):
+    return JSONResponse(
+        status_code=500,
+        content={"error": err},
+        headers={RUNNER_ERROR_HEADER: "load"},
+    )
+
+@app.post(BATCH_PATH)
+async def batch_invoke(request: Request):
+    """
+    请求体为事件数组，返回等长数组，每项为 {"status", "result"} 或 {"status", "error"}。
+    用户代码定义了 main_batch(events) 时整组交给它，否则逐个调用 main；
+    逐个调用时超过截止时间的剩余事件返回 504，不再执行。
+    """
+    deadline = request_deadline(request)
+    try:
+        events = await request.json()
+    except Exception:
+        return JSONResponse(status_code=400, content={"error": "Batch body must be a JSON array."})
+    if not isinstance(events, list):
+        return JSONResponse(status_code=400, content={"error": "Batch body must be a JSON array."})
+
+    user_module, err = load_user_module()
+    if err:
+        return load_error_response(err)
+    reason = deadline_error(deadline)
+    if reason:
+        return deadline_response(reason)
+
+    if hasattr(user_module, "main_batch"):
+        try:
+            results = user_module.main_batch(events)
+        except Exception:
+            return JSONResponse(status_code=500, content={"error": f"Execution error: {traceback.format_exc()}"})
+        if not isinstance(results, list) or len(results) != len(events):
+            return JSONResponse(status_code=500, content={"error": "main_batch() must return one result per event."})
+        return JSONResponse(content=[batch_item(result) for result in results])
+
+    if not hasattr(user_module, "main"):
+        return JSONResponse(status_code=500, content={"error": "No main() function found."})
+    takes_event = len(inspect.signature(user_module.main).parameters) > 0
+    items = []
+    for event in events:
+        if deadline is not None and time.monotonic() >= deadline:
+            items.append({"status": 504, "error": "Deadline exceeded before execution started."})
+            continue
+        try:
+            result = user_module.main(event) if takes_event else user_module.main()
+            items.append(batch_item(result))
+        except Exception:
+            items.append({"status": 500, "error": f"Execution error: {traceback.format_exc()}"})
+    return JSONResponse(content=items)
+
+def batch_item(result):
+    # 与单次调用一致：字典原样作为 JSON，其余转成文本
+    if isinstance(result, dict):
+        return {"status": 200, "result": result}
+    return {"status": 200, "result": str(result)}
+
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
 async def catch_all(request: Request, path: str):
+    version = code_version()
+    timings = {}
+    response = await invoke_user_function(request, timings, request_deadline(request))
+    # 网关据此判断响应是否由当前版本代码产生，决定能否写入缓存
+    if version:
+        response.headers["X-FaaS-Code-Version"] = version
+    # 代码加载与执行耗时（毫秒），由网关合并进它自己的 Server-Timing
+    response.headers["Server-Timing"] = ", ".join(
+        f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()
+    )
+    return response
+
+async def invoke_user_function(request: Request, timings: dict, deadline=None):
+    started = time.perf_counter()
     user_module, err = load_user_module()
+    timings["load"] = time.perf_counter() - started
     if err:
-        return JSONResponse(status_code=500, content={"error": err})
+        return load_error_response(err)
 
     if not hasattr(user_module, "main"):
         return JSONResponse(status_code=500, content={"error": "No main() function found."})
@@ -42,7 +169,13 @@ async def catch_all(request: Request, path: str):
     else:
         event = dict(request.query_params)
 
-    # 2. 智能执行用户函数
+    # 2. 预算已不够执行一次时直接拒绝
+    reason = deadline_error(deadline)
+    if reason:
+        return deadline_response(reason)
+
+    # 3. 智能执行用户函数
+    started = time.perf_counter()
     try:
         # 获取函数签名，看用户是否定义了参数
         sig = inspect.signature(user_module.main)
@@ -51,12 +184,15 @@ async def catch_all(request: Request, path: str):
             result = user_module.main(event)  # 传参调用
         else:
             result = user_module.main()       # 无参调用
+        timings["exec"] = time.perf_counter() - started
+        recent_exec_seconds.append(timings["exec"])
             
-        # 3. 智能返回 (如果用户返回字典，就转成JSON；否则转成纯文本)
+        # 4. 智能返回 (如果用户返回字典，就转成JSON；否则转成纯文本)
         if isinstance(result, dict):
             return JSONResponse(content=result)
         else:
             return PlainTextResponse(str(result))
             
     except Exception as e:
+        timings["exec"] = time.perf_counter() - started
         return JSONResponse(status_code=500, content={"error": f"Execution error: {traceback.format_exc()}"})
\ No newline at end of file
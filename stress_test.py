@@ -1,6 +1,25 @@
 import asyncio
 import httpx
 import time
+from collections import defaultdict
+
+# 阶段名 -> 每次请求该阶段的耗时（毫秒），来自网关返回的 Server-Timing 头
+phase_samples = defaultdict(list)
+cold_starts = 0
+
+def record_timing(response):
+    """解析 Server-Timing，例如 "queue;dur=12.0, upstream;dur=3.1, load;dur=0.8" """
+    global cold_starts
+    if response.headers.get("x-faas-cold-start") == "true":
+        cold_starts += 1
+    for entry in response.headers.get("server-timing", "").split(","):
+        name, _, params = entry.strip().partition(";")
+        if params.startswith("dur="):
+            phase_samples[name].append(float(params[4:]))
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
 
 async def worker(client, worker_id, duration):
     """每个 worker 会在规定时间内拼命发送请求"""
@@ -9,7 +28,8 @@ async def worker(client, worker_id, duration):
     while time.time() < end_time:
         try:
             # 请求咱们刚才部署的 cpu-test 函数
-            await client.get("http://localhost:8000/invoke/cpu-test", timeout=10.0)
+            response = await client.get("http://localhost:8000/invoke/cpu-test", timeout=10.0)
+            record_timing(response)
             count += 1
         except:
             pass
@@ -25,7 +45,13 @@ async def main():
         tasks = [worker(client, i, duration) for i in range(concurrency)]
         results = await asyncio.gather(*tasks)
         
-    print(f"✅ 压测结束！总共完成了 {sum(results)} 次函数调用。")
+    print(f"✅ 压测结束！总共完成了 {sum(results)} 次函数调用，其中冷启动 {cold_starts} 次。")
+    # 按阶段拆分延迟，定位长尾出在排队、扩容、就绪还是函数本身
+    for name, values in phase_samples.items():
+        print(
+            f"   {name:<9} 次数={len(values):<6} p50={percentile(values, 0.5):.1f}ms "
+            f"p99={percentile(values, 0.99):.1f}ms max={max(values):.1f}ms"
+        )
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file